@@ -0,0 +1,214 @@
+# Benchmarks of the LangDAG scheduler and executor on synthetic DAGs (see `graphs.py`).
+#
+# For every graph, size, processor/selector configuration and node work, it reports:
+#   - compile: time of `dag.compile()` (paid once per DAG),
+#   - makespan: wall time of `run_dag`,
+#   - ideal: the shortest possible makespan given the measured node durations, the longest of the critical path
+#     and the total work divided by the concurrency of the configuration,
+#   - overhead per node: (makespan - ideal) / nodes, the time LangDAG itself adds per node,
+#   - peak memory of the run (measured in a separate run, with tracemalloc).
+#
+# Usage:
+#   python benchmarks/bench.py                                   # default matrix
+#   python benchmarks/bench.py --graphs chain random_layered --sizes 10 100 1000 10000 --work noop
+#   python benchmarks/bench.py --save benchmarks/baseline.json    # store a baseline
+#   python benchmarks/bench.py --compare benchmarks/baseline.json # flag regressions (exit code 1)
+
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+from rich.console import Console
+from rich.table import Table
+
+from langdag import run_dag
+from langdag.__about__ import __version__
+from langdag.context import RunContext
+from langdag.executor import LangExecutor
+from langdag.plan import ExecutionPlan
+from langdag.processor import MultiThreadProcessor, SequentialProcessor
+from langdag.selector import CriticalPathSelector, FullSelector, MaxSelector
+
+from graphs import GRAPHS, make_work
+
+# a wide table when the output is redirected to a file
+console = Console(width=None if sys.stdout.isatty() else 160)
+
+# name: (processor, selector factory (of the DAG), concurrency)
+CONFIGS = {
+    "sequential": (SequentialProcessor, lambda dag: MaxSelector(1), 1),
+    "threads": (MultiThreadProcessor, lambda dag: FullSelector(), math.inf),
+    "threads-max4": (MultiThreadProcessor, lambda dag: MaxSelector(4), 4),
+    "threads-critical4": (MultiThreadProcessor, lambda dag: CriticalPathSelector(dag, 4), 4),
+}
+
+# metrics compared with a baseline, and the smallest absolute increase flagged (below it is noise)
+METRICS = {
+    "compile_ms": 1.0,
+    "makespan_ms": 1.0,
+    "overhead_us_per_node": 5.0,
+    "peak_mb": 0.5,
+}
+
+
+def ideal_makespan(context: RunContext, concurrency: float) -> float:
+    """
+    Returns the shortest possible makespan of the run in seconds given the measured node durations:
+    the longest of its critical path and of its total work spread over `concurrency` workers.
+    """
+    plan = context.plan
+    durations = [context.state_of(node).timing.duration or 0.0 for node in plan.nodes]
+    finish = [0.0] * len(plan.nodes)
+    for level in plan.levels:
+        for i in level:
+            finish[i] = durations[i] + max((finish[j] for j in plan.predecessors[i]), default=0.0)
+    return max(max(finish, default=0.0), sum(durations) / concurrency)
+
+
+def run_once(dag, config: str) -> RunContext:
+    processor_class, selector, _ = CONFIGS[config]
+    processor = processor_class()
+    context = RunContext(dag)
+    try:
+        run_dag(dag, selector=selector(dag), processor=processor, executor=LangExecutor(verbose=False), 
+                verbose=False, progressbar=False, context=context)
+    finally:
+        if hasattr(processor, "shutdown"):
+            processor.shutdown()
+    return context
+
+
+def bench(graph: str, n: int, config: str, work_spec: str, repeat: int) -> Dict[str, Any]:
+    work, _ = make_work(work_spec)
+    dag = GRAPHS[graph](n, work)
+    plan = dag.compile()
+    compile_times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        ExecutionPlan(dag)
+        compile_times.append(time.perf_counter() - started)
+    run_once(dag, config)  # warm up
+
+    makespans, ideals = [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        context = run_once(dag, config)
+        makespans.append(time.perf_counter() - started)
+        ideals.append(ideal_makespan(context, CONFIGS[config][2]))
+
+    tracemalloc.start()
+    run_once(dag, config)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    makespan, ideal = statistics.median(makespans), statistics.median(ideals)
+    nodes = len(plan.nodes)
+    return {
+        "graph": graph,
+        "n": n,
+        "nodes": nodes,
+        "edges": sum(len(x) for x in plan.successors),
+        "config": config,
+        "work": work_spec,
+        "compile_ms": statistics.median(compile_times) * 1000,
+        "makespan_ms": makespan * 1000,
+        "ideal_ms": ideal * 1000,
+        "efficiency": ideal / makespan if makespan else None,
+        "overhead_us_per_node": max(0.0, makespan - ideal) / nodes * 1e6,
+        "peak_mb": peak / 1e6,
+    }
+
+
+def key_of(result: Dict[str, Any]) -> str:
+    return f"{result['graph']}/{result['n']}/{result['config']}/{result['work']}"
+
+
+def regressions(results: List[Dict], baseline: Dict, threshold: float) -> Dict[str, List[str]]:
+    """
+    Returns the metrics of each result that are worse than in `baseline` by more than `threshold` (a fraction),
+    as `{key: ["makespan_ms +35%", ...]}`.
+    """
+    previous = {key_of(x): x for x in baseline["results"]}
+    flagged = {}
+    for result in results:
+        before = previous.get(key_of(result))
+        if before is None:
+            continue
+        for metric, floor in METRICS.items():
+            old, new = before.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + threshold) and new - old > floor:
+                change = f"+{(new - old) / old:.0%}" if old else f"+{new - old:.3g}"
+                flagged.setdefault(key_of(result), []).append(f"{metric} {change}")
+    return flagged
+
+
+def show(results: List[Dict], flagged: Optional[Dict[str, List[str]]] = None) -> None:
+    table = Table(title=f"langdag {__version__} scheduler benchmarks")
+    for column in ("graph", "nodes", "edges", "config", "work", "compile ms", "makespan ms", "ideal ms", "efficiency", 
+                   "overhead µs/node", "peak MB", "regression"):
+        table.add_column(column, justify="left" if column in ("graph", "config", "work", "regression") else "right")
+    for x in results:
+        regression = ", ".join((flagged or {}).get(key_of(x), []))
+        table.add_row(x["graph"], str(x["nodes"]), str(x["edges"]), x["config"], x["work"], 
+                      f"{x['compile_ms']:.2f}", f"{x['makespan_ms']:.2f}", f"{x['ideal_ms']:.2f}", 
+                      f"{x['efficiency']:.2f}" if x["efficiency"] is not None else "-", 
+                      f"{x['overhead_us_per_node']:.1f}", f"{x['peak_mb']:.2f}", 
+                      f"[bold red]{regression}[/]" if regression else "")
+    console.print(table)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the LangDAG scheduler on synthetic DAGs.")
+    parser.add_argument("--graphs", nargs="+", default=list(GRAPHS), choices=list(GRAPHS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 100, 1000])
+    parser.add_argument("--configs", nargs="+", default=list(CONFIGS), choices=list(CONFIGS))
+    parser.add_argument("--work", nargs="+", default=["noop", "sleep:1"], 
+                        help='"noop" or "sleep:<ms>" (default: noop sleep:1)')
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case, the median is reported")
+    parser.add_argument("--max-sleep-nodes", type=int, default=1000, 
+                        help="skip sleep-based cases of larger graphs, they measure time.sleep more than LangDAG")
+    parser.add_argument("--save", help="write the results to this JSON file as a baseline")
+    parser.add_argument("--compare", help="compare with a baseline JSON file and flag regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, 
+                        help="relative increase of a metric flagged as a regression (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    results = []
+    for graph in args.graphs:
+        for n in args.sizes:
+            for work in args.work:
+                if work != "noop" and n > args.max_sleep_nodes:
+                    continue
+                for config in args.configs:
+                    console.log(f"{graph} n={n} {config} {work}")
+                    results.append(bench(graph, n, config, work, args.repeat))
+
+    flagged = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        flagged = regressions(results, baseline, args.threshold)
+    show(results, flagged)
+
+    if args.save:
+        meta = {"langdag": __version__, "python": platform.python_version(), "platform": platform.platform(), 
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        with open(args.save, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+        console.log(f"Baseline written to {args.save}")
+    if flagged:
+        console.print(f"[bold red]{len(flagged)} regressions[/] (threshold {args.threshold:.0%})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# Synthetic DAGs for the scheduler benchmarks (see `bench.py`).
+#
+# Every generator returns a `LangDAG` of about `n` nodes whose nodes run `work` (see `make_work`).
+# Edges are added in topological order, so `paradag`'s cycle check stays cheap on large graphs.
+
+from typing import Any, Callable, Dict, List, Tuple
+import random
+import time
+
+from langdag import LangDAG, Node
+
+Work = Callable[[Any, Dict, Dict], Any]
+
+
+def make_work(spec: str) -> Tuple[Work, float]:
+    """
+    Returns the transform of the benchmark nodes and its nominal duration in seconds:
+    `"noop"` returns right away, `"sleep:<ms>"` sleeps that many milliseconds (an I/O-bound node, e.g. an LLM call).
+    """
+    if spec == "noop":
+        return (lambda prompt, upstream_output, dag_state: 1), 0.0
+    if spec.startswith("sleep:"):
+        seconds = float(spec.split(":", 1)[1]) / 1000
+
+        def work(prompt, upstream_output, dag_state):
+            time.sleep(seconds)
+            return 1
+        return work, seconds
+    raise ValueError(f'work should be "noop" or "sleep:<ms>", got {spec!r}')
+
+
+def _nodes(dag: LangDAG, count: int, work: Work, prefix: str = "n") -> List[Node]:
+    nodes = [Node(node_id=f"{prefix}{k}", func_transform=work) for k in range(count)]
+    dag.add_node(*nodes)
+    return nodes
+
+
+def chain(n: int, work: Work) -> LangDAG:
+    """A single path of `n` nodes: no parallelism, measures the per-node cost of the scheduler."""
+    dag = LangDAG("bench")
+    nodes = _nodes(dag, n, work)
+    for a, b in zip(nodes, nodes[1:]):
+        dag.add_edge(a, b)
+    return dag
+
+
+def fan_out_in(n: int, work: Work) -> LangDAG:
+    """One source, `n - 2` independent nodes, one sink: maximal parallelism, one wide join."""
+    dag = LangDAG("bench")
+    source, *middle, sink = _nodes(dag, max(n, 3), work)
+    dag.add_edge(source, *middle)
+    for node in middle:
+        dag.add_edge(node, sink)
+    return dag
+
+
+def diamond_lattice(n: int, work: Work, width: int = 4) -> LangDAG:
+    """Layers of `width` nodes, every node connected to every node of the next layer (many shared descendants)."""
+    dag = LangDAG("bench")
+    nodes = _nodes(dag, max(n, width), work)
+    layers = [nodes[k:k + width] for k in range(0, len(nodes), width)]
+    for upper, lower in zip(layers, layers[1:]):
+        for a in upper:
+            dag.add_edge(a, *lower)
+    return dag
+
+
+def routing_tree(n: int, work: Work, fanout: int = 2) -> LangDAG:
+    """
+    A tree of routers: every inner node routes to one of its `fanout` children through conditional edges,
+    so only one path from the root to a leaf executes and every other branch is aborted.
+    """
+    dag = LangDAG("bench")
+    count = max(n, fanout + 1)
+
+    def route(prompt, upstream_output, dag_state):
+        work(prompt, upstream_output, dag_state)
+        return 0
+
+    nodes = [Node(node_id=f"n{k}", func_transform=route if k * fanout + 1 < count else work) for k in range(count)]
+    dag.add_node(*nodes)
+    for k in range(1, count):
+        parent = nodes[(k - 1) // fanout]
+        dag.add_conditional_edge(parent, (k - 1) % fanout, nodes[k])
+    return dag
+
+
+def random_layered(n: int, work: Work, width: int = 16, degree: int = 3, seed: int = 0) -> LangDAG:
+    """Layers of up to `width` nodes, each node depends on up to `degree` random nodes of earlier layers."""
+    rng = random.Random(seed)
+    dag = LangDAG("bench")
+    nodes = _nodes(dag, n, work)
+    placed: List[Node] = []
+    k = 0
+    while k < len(nodes):
+        layer = nodes[k:k + rng.randint(1, width)]
+        if placed:
+            for node in layer:
+                for upstream in rng.sample(placed, min(len(placed), rng.randint(1, degree))):
+                    dag.add_edge(upstream, node)
+        placed.extend(layer)
+        k += len(layer)
+    return dag
+
+
+GRAPHS: Dict[str, Callable[[int, Work], LangDAG]] = {
+    "chain": chain,
+    "fan_out_in": fan_out_in,
+    "diamond_lattice": diamond_lattice,
+    "routing_tree": routing_tree,
+    "random_layered": random_layered,
+}
@@ -1,11 +1,32 @@
-from typing import List, Set, Dict, Tuple, Optional, Any, Callable
+from typing import List, Set, Dict, FrozenSet, Tuple, Optional, Any, Callable
 from rich.tree import Tree
 
-from paradag import DAG, _call_method, _process_vertices
-from langdag.processor import SequentialProcessor
+from paradag import DAG, _call_method
+from paradag.error import VertexExecutionError
+from concurrent.futures import Executor, Future, wait, FIRST_COMPLETED
+import asyncio
+from contextvars import ContextVar, Token
+from contextlib import nullcontext
+from langdag.processor import SequentialProcessor, MultiProcessProcessor
 import time
-from langdag.utils import merge_dicts, show_tree
+from langdag.utils import merge_dicts, show_tree, call_sync, call_async
 from langdag.executor import LangExecutor
+from langdag.context import RunContext, NodeTiming, add_elapsed
+from langdag.plan import ExecutionPlan
+from langdag.cache import NodeCache, make_cache_key
+from langdag.events import events_enabled, log_event
+from langdag.stream import AttemptStream, NodeStream, aggregate_chunks, is_streaming_transform
+from langdag.retry import RetryPolicy, current_attempt
+from langdag.speculation import Speculation
+from langdag.incremental import IncrementalState
+from langdag.state import AttemptState, ScopedState, SharedState, StateIsolation, TrackedState
+from langdag.checkpoint import CheckpointStore
+from langdag.condition import Conditions, PretransformMemo
+from langdag.retention import OutputRetention
+from langdag import visualize
+from types import SimpleNamespace
+from langdag.resource import resources_available, try_acquire_resources, release_resources, acquire_resources, resources_wait_time
+import inspect
 from langdag.selector import FullSelector, MaxSelector
 from langdag.error import LangdagSyntaxError
 
@@ -31,6 +52,17 @@ log = logging.getLogger("rich")
 class Empty:
     pass
 
+
+_current_dag: ContextVar[Optional["LangDAG"]] = ContextVar("langdag_current_dag", default=None)
+
+class _CurrentDag:
+    '''
+    `LangDAG.current_dag`: the DAG of the innermost active `with LangDAG() as dag:` block 
+    in the current thread / asyncio task.
+    '''
+    def __get__(self, obj, objtype=None) -> Optional["LangDAG"]:
+        return _current_dag.get()
+
 class LangDAG(DAG):
     """A DAG for orchestrating large language model workflows
 
@@ -42,7 +74,7 @@ class LangDAG(DAG):
         dag_input (`Any`, *optional*`): 
             input for a dag, accessible to func_transform in every Node.
     """
-    current_dag : "LangDAG" = None
+    current_dag = _CurrentDag()
     
     def __init__(self, dag_input : Optional[ str | Any] = None):
         super().__init__()
@@ -51,15 +83,41 @@ class LangDAG(DAG):
                 "specs": {},
                 "output": None
                  }
+        self.__context_tokens: List[Token] = []
+        self.__plan: Optional[ExecutionPlan] = None
+        # Records of the last incremental run (`run_dag(..., incremental=True)`)
+        self.incremental: Optional[IncrementalState] = None
         
         
     def __enter__(self):
-        LangDAG.current_dag = self
+        self.__context_tokens.append(_current_dag.set(self))
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        LangDAG.current_dag = None
+        _current_dag.reset(self.__context_tokens.pop())
     
+    def add_vertex(self, *vertices):
+        super().add_vertex(*vertices)
+        self.__plan = None
+
+    def add_edge(self, v_from, *v_tos):
+        super().add_edge(v_from, *v_tos)
+        self.__plan = None
+
+    def remove_edge(self, v_from, v_to):
+        super().remove_edge(v_from, v_to)
+        self.__plan = None
+
+    def compile(self) -> ExecutionPlan:
+        """
+        Freeze the topology of this DAG (integer node ids, successors, initial indegrees and 
+        conditions on edges) into an `ExecutionPlan` that many runs can reuse. 
+        The plan is cached until a node or an edge is added or removed (here or in a sub-DAG).
+        """
+        if self.__plan is None or not self.__plan.is_current():
+            self.__plan = ExecutionPlan(self)
+        return self.__plan
+
     def __iadd__(self, other):
         if isinstance(other, list) or isinstance(other, tuple):
             if any(isinstance(x, Node) for x in other):
@@ -107,6 +165,15 @@ class LangDAG(DAG):
             raise LangdagSyntaxError(er)
 
 
+    def invalidate(self, *node_ids) -> None:
+        """
+        Execute these nodes (and the nodes depending on their outputs) again in the next incremental run,
+        e.g. when the result of an external tool they call changed.
+        """
+        if self.incremental is None:
+            self.incremental = IncrementalState()
+        self.incremental.invalidate(node_ids)
+
     def reset_all_nodes(self) -> None:
         """
         Reset all nodes (node.reset) in this dag to its original state (when instantialized)
@@ -114,12 +181,78 @@ class LangDAG(DAG):
         for node in self.vertices():
             node.reset()
 
-    def inspect_execution(self) -> Tree:
+    def inspect_execution(self, 
+                          context: Optional[RunContext] = None, 
+                          max_output_chars: Optional[int] = 200, 
+                          max_depth: Optional[int] = None) -> Tree:
         """
-        Print to console a rich.tree to show DAG execution (dag.inspect_execution)
+        Print to console a rich.tree to show DAG execution (dag.inspect_execution), 
+        of the run `context` if given, otherwise of the last run committed to the nodes.
+        Durations of nodes are shown, and nodes on the critical path (see `get_critical_path`) are highlighted.
+        A node with several upstream nodes is shown once, then referenced (`↪ node_id`).
+        Outputs are truncated to `max_output_chars` (None for no truncation), nodes below `max_depth` are summarized.
         """
-        return show_tree(self)
+        return show_tree(self, context, max_output_chars, max_depth)
+
+    def to_json(self, 
+                context: Optional[RunContext] = None, 
+                path: Optional[str] = None, 
+                max_output_chars: Optional[int] = None) -> str:
+        """
+        Returns the execution of the DAG as JSON (nodes with their state, output, error and timing, 
+        edges with their condition and whether it was met, the critical path), 
+        of the run `context` if given, otherwise of the last run committed to the nodes. Written to `path` if given.
+        """
+        return visualize.to_json(self, context, path, max_output_chars)
+
+    def to_dot(self, 
+               context: Optional[RunContext] = None, 
+               path: Optional[str] = None, 
+               max_output_chars: Optional[int] = 60) -> str:
+        """
+        Returns the execution of the DAG as a Graphviz DOT graph (render with `dot -Tsvg`), 
+        of the run `context` if given, otherwise of the last run committed to the nodes. Written to `path` if given.
+        """
+        return visualize.to_dot(self, context, path, max_output_chars)
     
+    def get_timings(self, context: Optional[RunContext] = None) -> Dict[Any, Dict]:
+        """
+        Returns the timing of every node (`ready`, `start`, `end` in seconds since the start of the run, 
+        `duration`, `queue_wait`, `hook_time` and `condition_time` in seconds) as `{node_id: timing}`, 
+        of the run `context` if given, otherwise of the last run committed to the nodes.
+        """
+        timings = {}
+        for node in self.compile().nodes:
+            timing = (context.state_of(node) if context else node).timing
+            if timing is not None:
+                timings[node.node_id] = timing.as_dict()
+        return timings
+
+    def get_critical_path(self, context: Optional[RunContext] = None) -> List:
+        """
+        Returns node_ids of the critical path of the run `context` (or of the last run committed to the nodes): 
+        starting from the node that ended last, repeatedly the upstream node that ended last, 
+        i.e. the chain of nodes that determined how long the run took.
+        """
+        plan = context.plan if context else self.compile()
+        ends = []
+        for node in plan.nodes:
+            timing = (context.state_of(node) if context else node).timing
+            ends.append(timing.end if timing is not None else None)
+
+        executed = [i for i, end in enumerate(ends) if end is not None]
+        if not executed:
+            return []
+        i = max(executed, key=lambda x: ends[x])
+        path = [i]
+        while True:
+            upstream = [j for j in plan.predecessors[i] if ends[j] is not None]
+            if not upstream:
+                break
+            i = max(upstream, key=lambda x: ends[x])
+            path.append(i)
+        return [plan.nodes[i].node_id for i in reversed(path)]
+
     def get_info(self) -> Dict:
         """
         Returns a dict contains attributes of the nodes in the DAG.
@@ -173,6 +306,44 @@ class Node():
             A function returns boolean that decides whether the `node_output` should be set as the final 
             output of the DAG (dag.dag_state["output"]) based on `prompt`, `upstream_output`, `node_output`, 
             and `execution_state`.
+        run_in_process (`bool`, *optional*, defaults to `False`):
+            When run with `MultiProcessProcessor`, run `func_transform` in a worker process, for CPU-bound nodes.
+        cache (`NodeCache`, *optional*, defaults to `None`):
+            A cache (e.g. `langdag.cache.MemoryCache()` or `langdag.cache.SqliteCache(path)`) of the node output. 
+            When given, `func_transform` is skipped if an output was cached for the same `node_id`, `prompt`, 
+            (filtered) `upstream_output` and values of `cache_keys` in dag_state.
+        cache_keys (`List`, *optional*, defaults to `None`):
+            Keys of dag_state that `func_transform` reads, their values are part of the cache key.
+        stream_input (`bool`, *optional*, defaults to `False`):
+            Receive a `NodeStream` of the output of upstream nodes with a generator `func_transform` 
+            (on unconditional edges), and start as soon as they produce their first chunk.
+        func_aggregate (`Callable`, *optional*, defaults to `None`):
+            A function that turns the list of chunks of a generator `func_transform` into the node output,
+            defaults to joining `str` or `bytes` chunks and to the list of chunks otherwise.
+        func_batch_transform (`Callable`, *optional*, defaults to `None`):
+            A function that transforms a list of (`prompt`, `upstream_output`, `dag_state`) tuples, one per input 
+            of `run_dag_batch`, into the list of node outputs, e.g. to call a batch embedding or LLM endpoint once.
+        duration_hint (`float`, *optional*, defaults to `None`):
+            Expected duration of the node in seconds, used by `CriticalPathSelector` to start long chains first.
+        resources (`List[str]`, *optional*, defaults to `None`):
+            Tags of the resources the node uses (e.g. `["openai"]`), limited with `langdag.resource.register_resource`.
+            The node waits while any of them is saturated, other nodes keep running.
+        retry_policy (`RetryPolicy`, *optional*, defaults to `None`):
+            Timeout, retries and hedging of the transform (`langdag.retry.RetryPolicy`), overrides the `retry_policy`
+            of `LangExecutor`. When the last attempt fails, `execution_state` is "failed" and `error` is the exception.
+        speculative (`bool`, *optional*, defaults to `False`):
+            Start the transform before the conditional upstream nodes finish, as soon as the other upstream nodes are
+            done (see `langdag.speculation.Speculation`). Its `upstream_output` then lacks the outputs of the
+            conditional upstream nodes, the result is used if the conditions are met and discarded otherwise.
+        reads (`List`, *optional*, defaults to `None`):
+            Keys of dag_state that `func_transform` reads, in a run with a `StateIsolation`. Reading any other key 
+            (but `"input"`, the keys of `writes` and `cache_keys`) raises a `StateAccessError`. Any key when `None`.
+        writes (`List`, *optional*, defaults to `None`):
+            Keys of dag_state that `func_transform` writes or deletes, in a run with a `StateIsolation`. Writing any
+            other key raises a `StateAccessError`. Any key when `None`.
+    
+    `func_desc`, `func_transform` and `func_set_dag_output_when` can be plain functions or `async def` functions.
+    `func_transform` can also be a generator or an async generator function, it streams its output chunk by chunk.
     """
     def __init__(
             self, 
@@ -182,7 +353,19 @@ class Node():
             spec: Optional[ Dict | Any] = None,
             func_desc: Optional[str | Dict | Any] = None,
             func_transform: Optional[Callable[[str, Dict, Dict], Any]] =None, 
-            func_set_dag_output_when: Optional[Callable[[str, Dict, Dict, Dict], bool]]=None
+            func_set_dag_output_when: Optional[Callable[[str, Dict, Dict, Dict], bool]]=None,
+            run_in_process: bool = False,
+            cache: Optional[NodeCache] = None,
+            cache_keys: Optional[List] = None,
+            stream_input: bool = False,
+            func_aggregate: Optional[Callable[[List], Any]] = None,
+            func_batch_transform: Optional[Callable[[List[Tuple[str, Dict, Dict]]], List]] = None,
+            duration_hint: Optional[float] = None,
+            resources: Optional[List[str]] = None,
+            retry_policy: Optional[RetryPolicy] = None,
+            speculative: bool = False,
+            reads: Optional[List] = None,
+            writes: Optional[List] = None
         ) -> None:
         self.node_id: str | int | Any = node_id
         self.node_desc: str | Any = node_desc
@@ -192,16 +375,35 @@ class Node():
         self.func_desc = func_desc
         self.func_transform = func_transform
         self.func_set_dag_output_when = func_set_dag_output_when
+        self.run_in_process = run_in_process
+        self.cache = cache
+        self.cache_keys = cache_keys
+        self.stream_input = stream_input
+        self.func_aggregate = func_aggregate
+        self.func_batch_transform = func_batch_transform
+        self.duration_hint = duration_hint
+        self.resources = resources
+        self.retry_policy = retry_policy
+        self.speculative = speculative
+        self.reads = reads
+        self.writes = writes
         self.upstream_output: Dict[Any, Any]  = {}
         self.node_output: Any = None 
         self.upstream_execution_state: Dict[Any, Any] = {}
         self.execution_state: str = "initialized"
+        self.cache_hit: Optional[bool] = None
+        self.timing: Optional[NodeTiming] = None
+        self.error: Optional[BaseException] = None
+        self.acceptance: Optional[Tuple[bool, Optional[FrozenSet]]] = None
+        self.speculation: Optional[Future] = None
 
         self.downstream_execution_condition_temp = Empty()
         self.downstream_execution_condition: Dict[Any, Any] = {}
 
         self.conditional_excecution: bool = False
         self.execution_condition: Dict[Any, Any] = {}
+        self.conditions_met: Dict[Any, bool] = {}
+        self.output_released: bool = False
 
         self.allow_execution_only_when_all_upstream_nodes_acceptable: bool = True
 
@@ -227,36 +429,449 @@ class Node():
         """
         self.spec = spec_dict
     
-    def set_desc(self) -> None:
+    def __run_state(self, context: Optional[RunContext] = None) -> Tuple[Any, Dict]:
+        """
+        Returns the run state of the node and the dag_state, from `context` if given, 
+        otherwise the node itself and the dag_state of `LangDAG.current_dag`.
+        """
+        if context is None:
+            return self, LangDAG.current_dag.dag_state
+        return context.state_of(self), context.dag_state_of(self)
+
+    def __scoped_state(self, dag_state: Dict) -> Dict:
+        """
+        Returns the `ScopedState` of the node if `dag_state` is a `SharedState` (a run with a `StateIsolation`), 
+        otherwise `dag_state` itself.
+        """
+        if not isinstance(dag_state, SharedState):
+            return dag_state
+        reads = self.reads
+        if reads is not None and self.cache_keys:
+            reads = [*reads, *self.cache_keys]
+        return dag_state.view(self.node_id, reads, self.writes)
+
+    @staticmethod
+    def __commit_state(scoped: Dict) -> None:
+        """
+        Apply the writes of a node that finished, buffered in its `ScopedState`.
+        """
+        if isinstance(scoped, ScopedState):
+            scoped.commit()
+
+    def __process_runner(self, context: Optional[RunContext] = None):
+        """
+        Returns the processor of the run if it should run `func_transform` in a worker process, otherwise None.
+        """
+        if (self.run_in_process 
+                and context is not None 
+                and hasattr(context.processor, 'submit_transform') 
+                and not is_streaming_transform(self.func_transform)):
+            return context.processor
+        return None
+
+    def set_desc(self, context: Optional[RunContext] = None) -> None:
         """
         A method accepts prompt, upstream_output, dag_state and use them to generate a dynamic description
         """
         if self.func_desc:
-            self.node_desc = self.func_desc(self.prompt, 
-                                            self.upstream_output, 
-                                            LangDAG.current_dag.dag_state)
+            state, dag_state = self.__run_state(context)
+            state.node_desc = call_sync(self.func_desc, 
+                                        self.prompt, 
+                                        state.upstream_output, 
+                                        dag_state)
+
+    async def aset_desc(self, context: Optional[RunContext] = None, thread_pool: Optional[Executor] = None) -> None:
+        """
+        Async version of `set_desc`, awaits `func_desc` if it is an `async def` function, 
+        otherwise runs it in `thread_pool`.
+        """
+        if self.func_desc:
+            state, dag_state = self.__run_state(context)
+            state.node_desc = await call_async(self.func_desc, 
+                                               self.prompt, 
+                                               state.upstream_output, 
+                                               dag_state, 
+                                               thread_pool=thread_pool)
 
-    def transform(self) -> None:
+    def __cached_output(self, state, dag_state: Dict) -> Tuple[Optional[str], bool]:
         """
-        A method accepts prompt, upstream_output, dag_state and use them to generate a node output
+        Look up the node output in `self.cache`, set `node_output` and `cache_hit` of `state`.
+        Returns the cache key (None if not cached) and whether it is a hit.
+        """
+        if self.cache is None or not (self.func_transform or self.func_batch_transform):
+            return None, False
+        key = make_cache_key(self.node_id, self.prompt, state.upstream_output, dag_state, self.cache_keys)
+        if key is None:
+            return None, False
+        hit, output = self.cache.get(key)
+        state.cache_hit = hit
+        if hit:
+            state.node_output = output
+            # A cached output of a streaming node is streamed as a single chunk
+            if getattr(state, "node_stream", None) is not None:
+                state.node_stream.put(output)
+        return key, hit
+
+    def __aggregate(self, chunks: List) -> Any:
+        return call_sync(self.func_aggregate, chunks) if self.func_aggregate else aggregate_chunks(chunks)
+
+    def __collect_stream(self, output, state) -> Any:
+        """
+        Consume a generator `output`, push its chunks to the stream of the run and return the aggregated output.
+        """
+        stream: Optional[NodeStream] = getattr(state, "node_stream", None)
+        chunks = []
+        for chunk in output:
+            chunks.append(chunk)
+            if stream is not None:
+                stream.put(chunk)
+        return self.__aggregate(chunks)
+
+    async def __acollect_stream(self, output, state) -> Any:
+        """
+        Async version of `__collect_stream`, for an async generator `output`.
+        """
+        stream: Optional[NodeStream] = getattr(state, "node_stream", None)
+        chunks = []
+        async for chunk in output:
+            chunks.append(chunk)
+            if stream is not None:
+                stream.put(chunk)
+        return self.__aggregate(chunks)
+
+    def __compute(self, state, dag_state: Dict, context: Optional[RunContext] = None) -> Any:
         """
+        Call the transform of the node once and return the output.
+        """
+        processor = self.__process_runner(context)
+        if self.func_transform and processor:
+            return processor.run_transform(self.func_transform, 
+                                           self.prompt, 
+                                           state.upstream_output, 
+                                           dag_state)
+        if self.func_transform:
+            output = call_sync(self.func_transform, 
+                               self.prompt, 
+                               state.upstream_output, 
+                               dag_state)
+            if inspect.isgenerator(output):
+                return self.__collect_stream(output, state)
+            if inspect.isasyncgen(output):
+                return call_sync(self.__acollect_stream, output, state)
+            return output
+        if self.func_batch_transform:
+            return call_sync(self.func_batch_transform, 
+                             [(self.prompt, state.upstream_output, dag_state)])[0]
+        return state.node_output
+
+    async def __acompute(self, state, dag_state: Dict, context: Optional[RunContext] = None, 
+                         thread_pool: Optional[Executor] = None) -> Any:
+        """
+        Async version of `__compute`.
+        """
+        processor = self.__process_runner(context)
+        if self.func_transform and processor:
+            future = processor.submit_transform(self.func_transform, self.prompt, state.upstream_output, dag_state)
+            try:
+                result = await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                processor.discard_transform(future)
+                raise
+            return processor.finish_transform(result, dag_state)
         if self.func_transform:
-            self.node_output = self.func_transform(self.prompt, 
-                                                   self.upstream_output, 
-                                                   LangDAG.current_dag.dag_state)
-        return self.node_output
+            if inspect.isasyncgenfunction(self.func_transform):
+                output = self.func_transform(self.prompt, state.upstream_output, dag_state)
+            else:
+                output = await call_async(self.func_transform, 
+                                          self.prompt, 
+                                          state.upstream_output, 
+                                          dag_state, 
+                                          thread_pool=thread_pool)
+            if inspect.isasyncgen(output):
+                return await self.__acollect_stream(output, state)
+            if inspect.isgenerator(output):
+                return await call_async(self.__collect_stream, output, state, thread_pool=thread_pool)
+            return output
+        if self.func_batch_transform:
+            outputs = await call_async(self.func_batch_transform, 
+                                       [(self.prompt, state.upstream_output, dag_state)], 
+                                       thread_pool=thread_pool)
+            return outputs[0]
+        return state.node_output
+
+    @staticmethod
+    def __attempt_state(state, dag_state: Dict) -> Tuple[SimpleNamespace, AttemptState]:
+        """
+        A scratch state and a buffered view of dag_state for one attempt of a `RetryPolicy`, so an attempt abandoned 
+        on timeout or after losing a hedge, still running in the background, neither writes to dag_state 
+        nor streams chunks.
+        """
+        stream: Optional[NodeStream] = getattr(state, "node_stream", None)
+        attempt = current_attempt()
+        if stream is not None and attempt is not None:
+            stream = AttemptStream(stream, attempt)
+        scratch = SimpleNamespace(upstream_output=state.upstream_output, node_output=state.node_output, node_stream=stream)
+        return scratch, AttemptState(dag_state)
+
+    def __compute_attempt(self, state, dag_state: Dict, 
+                          context: Optional[RunContext] = None) -> Tuple[Any, AttemptState]:
+        """
+        One attempt of `__compute` with a `RetryPolicy`, returns the output and the writes to dag_state to apply.
+        """
+        scratch, attempt_state = self.__attempt_state(state, dag_state)
+        return self.__compute(scratch, attempt_state, context), attempt_state
+
+    async def __acompute_attempt(self, state, dag_state: Dict, context: Optional[RunContext] = None, 
+                                 thread_pool: Optional[Executor] = None) -> Tuple[Any, AttemptState]:
+        """
+        Async version of `__compute_attempt`.
+        """
+        scratch, attempt_state = self.__attempt_state(state, dag_state)
+        return await self.__acompute(scratch, attempt_state, context, thread_pool), attempt_state
+
+    def __speculative_state(self, context: RunContext) -> Tuple[SimpleNamespace, Dict]:
+        """
+        A scratch state for a speculative transform: the outputs delivered so far, without the conditional upstream nodes.
+        In an incremental run, the dag_state is a `TrackedState` recording what the transform reads. 
+        In a run with a `StateIsolation`, it is a `ScopedState` of its own.
+        """
+        state, dag_state = self.__run_state(context)
+        upstream_output = {k: v for k, v in context.upstream_of(self).items() if k not in state.execution_condition}
+        upstream_output = _local_upstream(state, upstream_output)
+        dag_state = self.__scoped_state(dag_state)
+        if context.incremental is not None:
+            dag_state = context.incremental.track(dag_state)
+        return SimpleNamespace(upstream_output=upstream_output, node_output=None, node_stream=None), dag_state
+
+    def speculate(self, context: RunContext) -> Tuple[Any, Optional[TrackedState | ScopedState]]:
+        """
+        Call the transform before the conditional upstream nodes of the node finish, used by the scheduler 
+        for nodes with `speculative=True`. Nothing is written to the run state, the scheduler keeps the result 
+        in `speculation` of the run state, until the node runs (and uses it) or is aborted (and discards it).
+        Returns the output, and the view of dag_state the transform used: a `TrackedState` in an incremental run, 
+        a `ScopedState` holding its writes in a run with a `StateIsolation`, None otherwise.
+        """
+        scratch, dag_state = self.__speculative_state(context)
+        output = self.__compute(scratch, dag_state, context)
+        return output, dag_state if isinstance(dag_state, (TrackedState, ScopedState)) else None
+
+    async def aspeculate(self, context: RunContext, 
+                         thread_pool: Optional[Executor] = None) -> Tuple[Any, Optional[TrackedState | ScopedState]]:
+        """
+        Async version of `speculate`.
+        """
+        scratch, dag_state = self.__speculative_state(context)
+        output = await self.__acompute(scratch, dag_state, context, thread_pool)
+        return output, dag_state if isinstance(dag_state, (TrackedState, ScopedState)) else None
+
+    @staticmethod
+    def __take_speculation(state) -> Optional[Any]:
+        speculation = getattr(state, "speculation", None)
+        state.speculation = None
+        return speculation
+
+    def __speculative_output(self, state) -> Tuple[bool, Any]:
+        """
+        Returns whether the node has a result of a speculative transform (waiting for it if needed), and the result.
+        A failed or cancelled speculative transform is not used, the transform is then called again.
+        """
+        speculation = self.__take_speculation(state)
+        if speculation is None:
+            return False, None
+        try:
+            return True, speculation.result()
+        except Exception:
+            return False, None
+
+    async def __aspeculative_output(self, state) -> Tuple[bool, Any]:
+        """
+        Async version of `__speculative_output`.
+        """
+        speculation = self.__take_speculation(state)
+        if speculation is None:
+            return False, None
+        try:
+            return True, await (speculation if asyncio.isfuture(speculation) else asyncio.wrap_future(speculation))
+        except Exception:
+            return False, None
+        except asyncio.CancelledError:
+            # only a cancelled speculation falls back, not a cancelled run
+            if speculation.cancelled():
+                return False, None
+            raise
+
+    def __retry_options(self, state) -> Dict:
+        """
+        Options of `RetryPolicy.call` for the node: streaming transforms are not hedged, 
+        and not retried once they streamed a chunk downstream.
+        """
+        stream: Optional[NodeStream] = getattr(state, "node_stream", None)
+        return {
+            "hedge": not is_streaming_transform(self.func_transform),
+            "can_retry": (lambda: not stream.chunks) if stream is not None else None,
+        }
+
+    def __reused_output(self, incremental: IncrementalState, state, dag_state: Dict) -> bool:
+        """
+        In an incremental run, reuse the output of the last run if the inputs of the node did not change.
+        Returns whether it did.
+        """
+        reused, output = incremental.lookup(self, state.upstream_output, dag_state)
+        if not reused:
+            return False
+        state.node_output = output
+        speculation = self.__take_speculation(state)
+        if speculation is not None:
+            speculation.cancel()
+        # A reused output of a streaming node is streamed as a single chunk
+        if getattr(state, "node_stream", None) is not None:
+            state.node_stream.put(output)
+        return True
+
+    @staticmethod
+    def __merge_speculation(result: Tuple[Any, Optional[TrackedState | ScopedState]], dag_state: Dict, 
+                            scoped: Dict) -> Any:
+        """
+        Returns the output of a used speculative transform, adding what it read and wrote in an incremental run
+        to the `TrackedState` of the node, and the writes it buffered to the `ScopedState` of the node.
+        """
+        output, used = result
+        if isinstance(used, TrackedState):
+            if isinstance(dag_state, TrackedState):
+                dag_state.merge(used)
+            used = used.dag_state
+        if isinstance(used, ScopedState) and isinstance(scoped, ScopedState):
+            scoped.absorb(used)
+        return output
+
+    def __record_incremental(self, incremental: Optional[IncrementalState], state, dag_state: Dict) -> None:
+        if incremental is not None:
+            incremental.record(self, state.upstream_output, dag_state, state.node_output)
+
+    def transform(self, 
+                  context: Optional[RunContext] = None, 
+                  retry_policy: Optional[RetryPolicy] = None, 
+                  verbose: bool = False) -> None:
+        """
+        A method accepts prompt, upstream_output, dag_state and use them to generate a node output.
+        With a `retry_policy`, the transform is called with its timeout, retries and hedging, 
+        and the error of the last attempt is raised. Only the writes to dag_state of the attempt whose output 
+        is kept are applied, abandoned attempts (timed out, or lost a hedge) stop streaming chunks.
+        In a run with a `StateIsolation`, the writes to dag_state are applied when the node finishes, 
+        and discarded if it fails.
+        """
+        state, dag_state = self.__run_state(context)
+        dag_state = scoped = self.__scoped_state(dag_state)
+        incremental = context.incremental if context is not None else None
+        if incremental is not None:
+            if self.__reused_output(incremental, state, dag_state):
+                self.__commit_state(scoped)
+                return state.node_output
+            dag_state = incremental.track(dag_state)
+        key, hit = self.__cached_output(state, dag_state)
+        if hit:
+            self.__commit_state(scoped)
+            self.__record_incremental(incremental, state, dag_state)
+            return state.node_output
+        speculated, output = self.__speculative_output(state)
+        if speculated:
+            state.node_output = self.__merge_speculation(output, dag_state, scoped)
+        elif retry_policy is None:
+            state.node_output = self.__compute(state, dag_state, context)
+        else:
+            output, attempt_state = retry_policy.call(lambda: self.__compute_attempt(state, dag_state, context), 
+                                                      self.node_id, 
+                                                      verbose=verbose, 
+                                                      **self.__retry_options(state))
+            attempt_state.apply()
+            state.node_output = output
+        self.__commit_state(scoped)
+        if key is not None:
+            self.cache.set(key, state.node_output)
+        self.__record_incremental(incremental, state, dag_state)
+        return state.node_output
+
+    async def atransform(self, 
+                         context: Optional[RunContext] = None, 
+                         thread_pool: Optional[Executor] = None, 
+                         retry_policy: Optional[RetryPolicy] = None, 
+                         verbose: bool = False) -> None:
+        """
+        Async version of `transform`, awaits `func_transform` if it is an `async def` function, 
+        otherwise runs it in `thread_pool`.
+        """
+        state, dag_state = self.__run_state(context)
+        dag_state = scoped = self.__scoped_state(dag_state)
+        incremental = context.incremental if context is not None else None
+        if incremental is not None:
+            if self.__reused_output(incremental, state, dag_state):
+                self.__commit_state(scoped)
+                return state.node_output
+            dag_state = incremental.track(dag_state)
+        key, hit = self.__cached_output(state, dag_state)
+        if hit:
+            self.__commit_state(scoped)
+            self.__record_incremental(incremental, state, dag_state)
+            return state.node_output
+        speculated, output = await self.__aspeculative_output(state)
+        if speculated:
+            state.node_output = self.__merge_speculation(output, dag_state, scoped)
+        elif retry_policy is None:
+            state.node_output = await self.__acompute(state, dag_state, context, thread_pool)
+        else:
+            output, attempt_state = await retry_policy.acall(
+                lambda: self.__acompute_attempt(state, dag_state, context, thread_pool), 
+                self.node_id, 
+                verbose=verbose, 
+                **self.__retry_options(state))
+            attempt_state.apply()
+            state.node_output = output
+        self.__commit_state(scoped)
+        if key is not None:
+            self.cache.set(key, state.node_output)
+        self.__record_incremental(incremental, state, dag_state)
+        return state.node_output
+
+    def __fail(self, state, error: Exception) -> None:
+        """
+        Set the node to "failed" after the last attempt of its `RetryPolicy` failed with `error`.
+        """
+        state.execution_state = "failed"
+        state.error = error
+        state.node_output = None
 
-    def __set_dag_output(self) -> None:
+    def __func_set_dag_output_when(self, context: Optional[RunContext] = None) -> Optional[Callable]:
         """
-        A method accepts prompt, upstream_output, node_output, execution_state and use them to get a boolean to decide whether the node_output will to set as the final output of DAG
+        Terminating nodes of a run (or of a sub-DAG) set the DAG output when they are not aborted, 
+        other nodes use their own `func_set_dag_output_when`.
         """
-        if self.func_set_dag_output_when:
-            if  self.func_set_dag_output_when(self.prompt, 
-                                              self.upstream_output, 
-                                              self.node_output, 
-                                              self.execution_state):
-                LangDAG.current_dag.dag_state["output"] =  self.node_output
-                LangDAG.current_dag.dag_state["output_by_node_id"] =  self.node_id
+        if context is not None and context.plan.sets_output[context.plan.index[self]]:
+            return _set_dag_output_when_not_aborted
+        return self.func_set_dag_output_when
+
+    def __restore(self, state, context: Optional[RunContext] = None) -> bool:
+        """
+        In a resumed run, take the output of the node from the checkpoint if it finished in the run resumed.
+        Returns whether it did, the node is then not executed (the `dag_state` it left is restored already).
+        """
+        checkpoint = context.restored.get(self.node_id) if context is not None else None
+        if checkpoint is None:
+            return False
+        state.node_output = checkpoint.node_output
+        state.restored = True
+        state.execution_state = "finished"
+        # A restored output of a streaming node is streamed as a single chunk
+        if getattr(state, "node_stream", None) is not None:
+            state.node_stream.put(state.node_output)
+        return True
+
+    def __set_dag_output(self, state, dag_state: Dict, set_output: bool) -> None:
+        """
+        Set node_output as the final output of DAG when `set_output` (result of `func_set_dag_output_when`) is True
+        """
+        if set_output:
+            dag_state["output"] =  state.node_output
+            dag_state["output_by_node_id"] =  self.node_id
 
     def exec_if_any_upstream_acceptable(self) -> "Node":
         """
@@ -268,73 +883,257 @@ class Node():
 
         return self
         
-    def run_node(self, verbose=True, func_start_hook=None) -> None:
+    def __acceptance(self, state, upstream_output: Dict, 
+                     memo: Optional[PretransformMemo] = None) -> Tuple[bool, Optional[FrozenSet]]:
         """
-        Decide how node execute.
+        Decide whether the node is allowed to execute with `upstream_output`, conditions on conditional edges 
+        are evaluated once, with the predicates compiled by `dag.compile()`. Returns that decision and the ids 
+        of acceptable upstream nodes (None when the node has no conditional edges, all of them are kept).
         """
+        conditions = getattr(state, "conditions", None)
+        if conditions is None:
+            # a run without `RunContext`: conditions are merged on delivery, compile them now
+            conditions = Conditions(state.execution_condition if state.conditional_excecution else {})
+        # kept for `inspect_execution`, the upstream outputs may be released (`OutputRetention`) by then
+        state.conditions_met = {}
+        return conditions.evaluate(state.upstream_execution_state, 
+                                   upstream_output, 
+                                   self.allow_execution_only_when_all_upstream_nodes_acceptable, 
+                                   memo, 
+                                   state.conditions_met)
 
-        nodes_finished = [x[0] for x in self.upstream_execution_state.items() if x[1]=="finished"]   
+    def accept_or_abort(self, context: RunContext) -> bool:
+        """
+        Called by the scheduler when all upstream nodes of the node are done: returns True if the node is allowed 
+        to execute, otherwise sets it to "aborted" right away, so it is never dispatched.
+        """
+        state, _ = self.__run_state(context)
+        upstream_output = context.upstream_output.get(self) or {}
+        if context.output_refs is not None:
+            # outputs spilled to disk are read back for the conditions only, the others are read when the node runs
+            upstream_output = context.upstream_of(self, state.execution_condition)
+        state.acceptance = self.__acceptance(state, upstream_output, context.pretransform_memo)
+        allow_execution, nodes_acceptable = state.acceptance
+        if allow_execution:
+            return True
+        state.acceptance = None
+        state.execution_state = "aborted"
+        state.upstream_output = dict(upstream_output)
+        if nodes_acceptable is not None:
+            state.upstream_output = {k: v for k, v in upstream_output.items() if k in nodes_acceptable}
+        state.upstream_output = _local_upstream(state, state.upstream_output)
+        if getattr(state, "node_stream", None) is not None:
+            state.node_stream.close()
+        return False
 
-        if self.allow_execution_only_when_all_upstream_nodes_acceptable:
-            allow_execution_1 = all([x[1]=="finished" for x in self.upstream_execution_state.items()])
-            if allow_execution_1 == False:
-                allow_execution = False
-            else:
-                if self.conditional_excecution:
-                    allow_execution_2 =  all( x in self.upstream_output.items() for x in self.execution_condition.items())
-                else:
-                    allow_execution_2 = True
-                allow_execution = allow_execution_1 and allow_execution_2
-            
-        else:
-            allow_execution_1 = any([x[1]=="finished" for x in self.upstream_execution_state.items()])
-            if allow_execution_1 == False:
-                allow_execution = False
-            else:
-                if self.conditional_excecution:
-                    conditional_nodes_acceptable = [x[0] for x in self.execution_condition.items() if x in self.upstream_output.items()]
-                    unconditional_nodes_finished = [x for x in nodes_finished if x not in self.execution_condition.keys()]
-                    nodes_acceptable = conditional_nodes_acceptable + unconditional_nodes_finished
-                    allow_execution_2 = True if len(nodes_acceptable)>0 else False
-                else:
-                    allow_execution_2 = True
-                allow_execution = allow_execution_1 and allow_execution_2
+    def __accept_upstream(self, state, verbose=True) -> None:
+        """
+        Decide whether the node is allowed to execute (set `execution_state` to "aborted" if not),
+        and filter `upstream_output` to acceptable upstream nodes.
+        """
+        # decided by the scheduler already (see `accept_or_abort`)
+        acceptance = getattr(state, "acceptance", None)
+        if acceptance is None:
+            acceptance = self.__acceptance(state, state.upstream_output)
+        state.acceptance = None
+        allow_execution, nodes_acceptable = acceptance
 
         if not allow_execution:
-            self.execution_state = "aborted"
+            state.execution_state = "aborted"
 
-        if self.conditional_excecution:
-          
-            conditional_nodes_acceptable = [x[0] for x in self.execution_condition.items() if x in self.upstream_output.items()]
-            unconditional_nodes_finished = [x for x in nodes_finished if x not in self.execution_condition.keys()]
-            nodes_acceptable = conditional_nodes_acceptable + unconditional_nodes_finished
-            
-            self.upstream_output = { k:self.upstream_output[k] for k in self.upstream_output.keys() if  k in  nodes_acceptable}
+        if nodes_acceptable is not None:
+            state.upstream_output = {k: v for k, v in state.upstream_output.items() if k in nodes_acceptable}
+        state.upstream_output = _local_upstream(state, state.upstream_output)
 
         if verbose : 
             log.info("   (2) [bold yellow]->o[/] [bold yellow]%s[/] received upstream (filter acceptable): %s", 
                      self.node_id, 
-                     self.upstream_output, 
+                     state.upstream_output, 
                      extra={"markup": True})
-       
+
+    def run_node(self, 
+                 verbose=True, 
+                 func_start_hook=None, 
+                 context: Optional[RunContext] = None, 
+                 retry_policy: Optional[RetryPolicy] = None) -> None:
+        """
+        Decide how node execute.
+        When `context` is given, the run state is read from and written to `context` instead of the node.
+        `retry_policy` is used when the node has no `retry_policy` of its own.
+        """
+        state, dag_state = self.__run_state(context)
+        started = time.perf_counter()
+        self.__accept_upstream(state, verbose)
+        add_elapsed(state, "condition_time", started)
       
         # If aborted, will not do transform, etc.
-        if self.execution_state == "aborted":
+        if state.execution_state == "aborted":
+            pass
+        elif self.__restore(state, context):
             pass
         else:
             # move from report_start to here
             # because we need FILTERED upstream output to set node_desc
-            self.set_desc()
+            self.set_desc(context)
             
             if func_start_hook:
-                    func_start_hook(self.node_id, 
-                                    self.node_desc)
+                    started = time.perf_counter()
+                    call_sync(func_start_hook, 
+                              self.node_id, 
+                              state.node_desc)
+                    add_elapsed(state, "hook_time", started)
             # move end
 
-            self.transform()
-            self.__set_dag_output()
-            self.execution_state = "finished"
+            retry_policy = self.retry_policy or retry_policy
+            if retry_policy is None:
+                self.transform(context)
+            else:
+                try:
+                    self.transform(context, retry_policy, verbose)
+                except Exception as e:
+                    self.__fail(state, e)
+                    return
+            func_set_dag_output_when = self.__func_set_dag_output_when(context)
+            if func_set_dag_output_when:
+                started = time.perf_counter()
+                self.__set_dag_output(state, dag_state, call_sync(func_set_dag_output_when, 
+                                                                  self.prompt, 
+                                                                  state.upstream_output, 
+                                                                  state.node_output, 
+                                                                  state.execution_state))
+                add_elapsed(state, "condition_time", started)
+            state.execution_state = "finished"
+
+    async def arun_node(self, 
+                        verbose=True, 
+                        func_start_hook=None, 
+                        context: Optional[RunContext] = None, 
+                        thread_pool: Optional[Executor] = None, 
+                        retry_policy: Optional[RetryPolicy] = None) -> None:
+        """
+        Async version of `run_node`. `async def` callables are awaited on the running event loop, 
+        plain `func_desc` and `func_transform` are run in `thread_pool` (the loop's default executor when `None`), 
+        plain hooks and `func_set_dag_output_when` are called directly.
+        """
+        state, dag_state = self.__run_state(context)
+        started = time.perf_counter()
+        self.__accept_upstream(state, verbose)
+        add_elapsed(state, "condition_time", started)
+
+        if state.execution_state != "aborted" and not self.__restore(state, context):
+            await self.aset_desc(context, thread_pool)
+            
+            if func_start_hook:
+                started = time.perf_counter()
+                await call_async(func_start_hook, 
+                                 self.node_id, 
+                                 state.node_desc, 
+                                 offload=False)
+                add_elapsed(state, "hook_time", started)
+
+            retry_policy = self.retry_policy or retry_policy
+            if retry_policy is None:
+                await self.atransform(context, thread_pool)
+            else:
+                try:
+                    await self.atransform(context, thread_pool, retry_policy, verbose)
+                except Exception as e:
+                    self.__fail(state, e)
+                    return
+            func_set_dag_output_when = self.__func_set_dag_output_when(context)
+            if func_set_dag_output_when:
+                started = time.perf_counter()
+                self.__set_dag_output(state, dag_state, await call_async(func_set_dag_output_when, 
+                                                                         self.prompt, 
+                                                                         state.upstream_output, 
+                                                                         state.node_output, 
+                                                                         state.execution_state, 
+                                                                         offload=False))
+                add_elapsed(state, "condition_time", started)
+            state.execution_state = "finished"
         
+    def run_node_batch(self, 
+                       contexts: List[RunContext], 
+                       verbose=True, 
+                       func_start_hook=None, 
+                       retry_policy: Optional[RetryPolicy] = None) -> None:
+        """
+        Run the node in many runs at once (see `run_dag_batch`). Acceptance of upstream nodes and conditions 
+        are decided per run, then `func_batch_transform` is called once with the runs not aborted 
+        (and not served from `cache`). Without `func_batch_transform`, `run_node` is called for every run.
+        With a `retry_policy`, the batched call is retried as a whole and all its runs fail together.
+        """
+        if not self.func_batch_transform:
+            for context in contexts:
+                self.run_node(verbose, func_start_hook, context, retry_policy)
+            return
+        retry_policy = self.retry_policy or retry_policy
+
+        accepted = []
+        for context in contexts:
+            state, dag_state = self.__run_state(context)
+            started = time.perf_counter()
+            self.__accept_upstream(state, verbose)
+            add_elapsed(state, "condition_time", started)
+            if state.execution_state == "aborted":
+                continue
+            self.set_desc(context)
+            if func_start_hook:
+                started = time.perf_counter()
+                call_sync(func_start_hook, self.node_id, state.node_desc)
+                add_elapsed(state, "hook_time", started)
+            accepted.append((context, state, dag_state))
+
+        to_transform = []
+        for context, state, dag_state in accepted:
+            key, hit = self.__cached_output(state, dag_state)
+            if not hit:
+                to_transform.append((key, state, dag_state))
+        def call_batch(dag_states: List[Dict]):
+            outputs = call_sync(self.func_batch_transform, 
+                                [(self.prompt, state.upstream_output, dag_state) 
+                                 for (_, state, _), dag_state in zip(to_transform, dag_states)])
+            if len(outputs) != len(to_transform):
+                raise ValueError(f"func_batch_transform of node {self.node_id} returned {len(outputs)} outputs "
+                                 f"for {len(to_transform)} inputs")
+            return outputs
+
+        def call_batch_attempt():
+            # writes of the attempts are buffered, only those of the attempt kept are applied (see `AttemptState`)
+            attempt_states = [AttemptState(dag_state) for _, _, dag_state in to_transform]
+            return call_batch(attempt_states), attempt_states
+
+        if to_transform:
+            if retry_policy is None:
+                outputs = call_batch([dag_state for _, _, dag_state in to_transform])
+            else:
+                try:
+                    outputs, attempt_states = retry_policy.call(call_batch_attempt, self.node_id, verbose=verbose)
+                    for attempt_state in attempt_states:
+                        attempt_state.apply()
+                except Exception as e:
+                    for _, state, _ in to_transform:
+                        self.__fail(state, e)
+                    outputs = []
+            for (key, state, _), output in zip(to_transform, outputs):
+                state.node_output = output
+                if key is not None:
+                    self.cache.set(key, output)
+
+        for context, state, dag_state in accepted:
+            if state.execution_state == "failed":
+                continue
+            func_set_dag_output_when = self.__func_set_dag_output_when(context)
+            if func_set_dag_output_when:
+                started = time.perf_counter()
+                self.__set_dag_output(state, dag_state, call_sync(func_set_dag_output_when, 
+                                                                  self.prompt, 
+                                                                  state.upstream_output, 
+                                                                  state.node_output, 
+                                                                  state.execution_state))
+                add_elapsed(state, "condition_time", started)
+            state.execution_state = "finished"
+
     def __str__(self) -> str:
         return self.node_id
     
@@ -363,12 +1162,234 @@ class Node():
 
 
 
+def _local_upstream(state, upstream_output: Dict) -> Dict:
+    """
+    Returns `upstream_output` by the node_ids the node knows its upstream nodes by: the node_ids in its sub-DAG 
+    for the nodes of a sub-DAG (see `ExecutionPlan.upstream_alias`), `upstream_output` itself otherwise.
+    """
+    alias = getattr(state, "upstream_alias", None)
+    if alias is None:
+        return upstream_output
+    return {alias[k]: v for k, v in upstream_output.items() if k in alias}
+
+def _set_dag_output_when_not_aborted(prompt, upstream_output, node_output, execution_state) -> bool:
+    return execution_state != "aborted"
+
+
+class _Frontier():
+    """
+    Nodes of a run whose upstream nodes are all done (`vertices_zero_indegree`). When the last upstream node 
+    of a node is delivered, whether the node is acceptable is decided right away (`Node.accept_or_abort`): 
+    a node that is not is aborted without being dispatched (no worker, hooks or log lines), and the abort 
+    cascades through its successors in the same pass.
+    """
+    def __init__(self, plan: ExecutionPlan, executor, context: Optional[RunContext], 
+                 vertices_zero_indegree: Set, vertices_final: List) -> None:
+        self.plan = plan
+        self.executor = executor
+        self.context = context
+        self.indegree = list(plan.indegree)
+        self.vertices_zero_indegree = vertices_zero_indegree
+        self.vertices_final = vertices_final
+        # called with each node and whether it is accepted, when decided
+        self.on_decide: Optional[Callable[[Node, bool], None]] = None
+
+    def release(self, i: int) -> None:
+        """
+        Count one delivered upstream node of the node `i`.
+        """
+        self.indegree[i] -= 1
+        if self.indegree[i] > 0:
+            return
+        nodes, successors = self.plan.nodes, self.plan.successors
+        to_decide = [i]
+        while to_decide:
+            j = to_decide.pop()
+            vtx = nodes[j]
+            accepted = self.context is None or not hasattr(vtx, 'accept_or_abort') or vtx.accept_or_abort(self.context)
+            if self.on_decide:
+                self.on_decide(vtx, accepted)
+            if accepted:
+                self.vertices_zero_indegree.add(vtx)
+                continue
+            self.vertices_final.append(vtx)
+            for k in successors[j]:
+                _call_method(self.executor, 'deliver', vtx, nodes[k], {vtx.node_id: None}, self.context)
+                self.indegree[k] -= 1
+                if self.indegree[k] == 0:
+                    to_decide.append(k)
+            if self.context is not None:
+                self.context.release_inputs(vtx)
+
+class _Speculator():
+    """
+    Starts the transform of nodes with `speculative=True` as soon as all their unconditional upstream nodes finished,
+    before their conditional upstream nodes do, within the limits of `speculation`. A node accepted later uses 
+    the result (`Node.transform`), an aborted node discards it and its transform is cancelled where possible.
+    """
+    def __init__(self, plan: ExecutionPlan, context: Optional[RunContext], speculation: Optional[Speculation], 
+                 start: Callable[[Node], Any]) -> None:
+        self.plan = plan
+        self.context = context
+        self.speculation = speculation
+        self.start = start
+        self.started = 0
+        self.candidates: List[int] = []
+        if context is None or speculation is None:
+            return
+        for i, node in enumerate(plan.nodes):
+            if (getattr(node, "speculative", False) and plan.execution_condition[i] 
+                    and not getattr(node, "stream_input", False) and not plan.streaming[i]):
+                self.candidates.append(i)
+        # node_ids of the unconditional upstream nodes of each candidate
+        self.unconditional = {i: [plan.nodes[j].node_id for j in plan.predecessors[i] 
+                                  if plan.nodes[j].node_id not in plan.execution_condition[i]] 
+                              for i in self.candidates}
+
+    def start_eligible(self) -> None:
+        """
+        Start the speculative transform of candidates whose unconditional upstream nodes all finished.
+        """
+        for i in list(self.candidates):
+            if self.speculation.max_per_run is not None and self.started >= self.speculation.max_per_run:
+                return
+            vtx = self.plan.nodes[i]
+            state = self.context.state_of(vtx)
+            delivered = state.upstream_execution_state
+            if state.execution_state != "initialized" or len(delivered) == len(self.plan.predecessors[i]):
+                # decided already, speculation would not save anything
+                self.candidates.remove(i)
+                continue
+            if not all(delivered.get(node_id) == "finished" for node_id in self.unconditional[i]):
+                continue
+            incremental = self.context.incremental
+            if vtx.node_id in self.context.restored or (
+                    incremental is not None and incremental.likely_reused(vtx, self.context.dag_state_of(vtx))):
+                # the output of the resumed (or last incremental) run would be used instead
+                self.candidates.remove(i)
+                continue
+            if not self.speculation.try_start(vtx.node_id):
+                continue
+            self.candidates.remove(i)
+            self.started += 1
+            state.speculation = self.start(vtx)
+            state.speculation.add_done_callback(lambda _: self.speculation.release())
+            if events_enabled():
+                log_event("node_speculate", vtx.node_id)
+
+    def on_decide(self, vtx, accepted: bool) -> None:
+        state = self.context.state_of(vtx)
+        if state.speculation is None:
+            return
+        self.speculation.record(vtx.node_id, accepted)
+        if not accepted:
+            state.speculation.cancel()
+            state.speculation = None
+            if events_enabled():
+                log_event("node_speculation_discarded", vtx.node_id)
+
+
+def _cancel_speculations(context: RunContext) -> None:
+    """
+    Cancel the speculative transforms of a run that were not used, when the run stops on an error.
+    """
+    for vtx in context.plan.nodes:
+        state = context.state_of(vtx)
+        if getattr(state, "speculation", None) is not None:
+            state.speculation.cancel()
+            state.speculation = None
+
+
+class _StreamDispatch():
+    """
+    Delivers the output stream of streaming nodes of a run to their `stream_successors` (see `ExecutionPlan`)
+    on the first chunk, so those successors start before the streaming node finishes.
+    The scheduler waits on `starts` along with running nodes and passes every completed one to `on_started`.
+    """
+    def __init__(self, plan: ExecutionPlan, executor, context: Optional[RunContext], frontier: "_Frontier",
+                 wrap: Optional[Callable] = None) -> None:
+        self.plan = plan
+        self.executor = executor
+        self.context = context
+        self.frontier = frontier
+        self.wrap = wrap
+        # waitable of the first chunk -> node, node -> its not yet handled waitable
+        self.starts: Dict[Any, Node] = {}
+        self.pending: Dict[Node, Any] = {}
+        # integer ids of nodes whose stream is delivered to their `stream_successors`
+        self.streamed: Set[int] = set()
+
+    def watch(self, vtx) -> None:
+        """
+        Wait for the first chunk of `vtx` if it streams to successors or to the DAG output.
+        """
+        i = self.plan.index[vtx]
+        if self.context is None or not self.plan.streaming[i]:
+            return
+        if self.plan.stream_successors[i] or self.plan.is_terminal[i]:
+            started = self.context.state_of(vtx).node_stream.started
+            if self.wrap:
+                started = self.wrap(started)
+            self.starts[started] = vtx
+            self.pending[vtx] = started
+
+    def on_started(self, started) -> None:
+        vtx = self.starts.pop(started, None)
+        # a stream closed without any chunk is handled when the node finishes
+        if vtx is not None and started.result():
+            self.__start(vtx)
+
+    def on_finish(self, vtx) -> None:
+        if vtx in self.pending:
+            if self.context.state_of(vtx).execution_state in ("aborted", "failed"):
+                self.starts.pop(self.pending.pop(vtx), None)
+            else:
+                self.__start(vtx)
+
+    def is_streamed(self, vtx, i_to: int) -> bool:
+        """
+        Returns whether the stream of `vtx` is already delivered to the node `i_to`.
+        """
+        i = self.plan.index[vtx]
+        return i in self.streamed and i_to in self.plan.stream_successors[i]
+
+    def __start(self, vtx) -> None:
+        self.starts.pop(self.pending.pop(vtx), None)
+        i = self.plan.index[vtx]
+        stream = self.context.state_of(vtx).node_stream
+        if self.plan.is_terminal[i]:
+            self.context.pipe_output(stream)
+        if not hasattr(self.executor, 'deliver_stream'):
+            return
+        self.streamed.add(i)
+        for j in self.plan.stream_successors[i]:
+            self.executor.deliver_stream(vtx, self.plan.nodes[j], stream, self.context)
+            self.frontier.release(j)
+
+
+def _select_with_resources(selector, vertices_running: Set, vertices_idle: Set) -> Tuple[List, Set]:
+    '''
+    Select the nodes to run among the idle ones whose resources are available, and acquire their resources.
+    Returns the nodes to run and the nodes blocked by their resources.
+    '''
+    if not vertices_idle:
+        return [], set()
+    vertices_blocked = {vtx for vtx in vertices_idle if not resources_available(vtx)}
+    vertices_available = vertices_idle - vertices_blocked
+    vertices_to_run = selector.select(vertices_running, vertices_available) if vertices_available else []
+    # another run may have taken a resource since it was checked
+    vertices_acquired = [vtx for vtx in vertices_to_run if try_acquire_resources(vtx)]
+    vertices_blocked.update(vtx for vtx in vertices_to_run if vtx not in vertices_acquired)
+    return vertices_acquired, vertices_blocked
+
 def __raw_run(dag: LangDAG, 
               selector=FullSelector(), 
               processor=SequentialProcessor(), 
               executor=LangExecutor(), 
               slower: bool | int | float =False, 
-              progressbar: bool=True):
+              progressbar: bool=True,
+              context: Optional[RunContext] = None,
+              speculation: Optional[Speculation] = None):
     '''
     Rewritten `dag_run` function from `paradag` package.
     Run tasks according to DAG.
@@ -386,72 +1407,180 @@ def __raw_run(dag: LangDAG,
         slower (`Boolean`, *optional*, defaults to False): 
             When set to True, it slow down every node execution by 1 sec; When set to a number N, 
             it slow down every node execution by N sec.
+        context (`RunContext`, *optional*, defaults to None): 
+            Run-scoped state the nodes read from and write to.
+        speculation (`Speculation`, *optional*, defaults to None): 
+            Limits of speculative execution of nodes with `speculative=True`, no speculation when `None`.
     '''
 
-    indegree_dict = {}
-    for vtx in dag.vertices():
-        indegree_dict[vtx] = dag.indegree(vtx)
+    plan = context.plan if context else dag.compile()
+    nodes, successors, index = plan.nodes, plan.successors, plan.index
 
     vertices_final = []
     vertices_running = set()
-    vertices_zero_indegree = dag.all_starts()
+    if context is not None:
+        context.running = vertices_running
+    vertices_zero_indegree = {nodes[i] for i in plan.starts}
+    futures_running: Dict[Future, Node] = {}
+    frontier = _Frontier(plan, executor, context, vertices_zero_indegree, vertices_final)
+    streams = _StreamDispatch(plan, executor, context, frontier)
+    # speculative transforms need workers running alongside the scheduler
+    if not hasattr(processor, 'submit') or isinstance(processor, SequentialProcessor):
+        speculation = None
+    speculator = _Speculator(plan, context, speculation, lambda vtx: processor.submit(vtx.speculate, context))
+    frontier.on_decide = speculator.on_decide
+
+    def execute_func(param):
+        return _call_method(executor, 'execute', param)
+
+    def execute_with_resources(vtx, param):
+        try:
+            return execute_func(param)
+        finally:
+            release_resources(vtx)
+
+    def process_vertices(vertices_to_run, vertices_blocked):
+        """
+        Dispatch `vertices_to_run` and return the results of the nodes that finished so far 
+        (at least one unless nothing is running), so successors can be unlocked immediately.
+        """
+        if not hasattr(processor, 'submit'):
+            # `paradag` style processor
+            if not vertices_to_run and vertices_blocked:
+                time.sleep(resources_wait_time(vertices_blocked))
+            vertices_with_param = [(vtx, _call_method(executor, 'param', vtx, context)) for vtx in vertices_to_run]
+            try:
+                return processor.process(vertices_with_param, execute_func)
+            except VertexExecutionError:
+                _call_method(executor, 'abort', vertices_running)
+                _call_method(processor, 'abort')
+                raise
+            finally:
+                for vtx in vertices_to_run:
+                    release_resources(vtx)
+
+        for vtx in vertices_to_run:
+            futures_running[processor.submit(execute_with_resources, vtx, _call_method(executor, 'param', vtx, context))] = vtx
+            streams.watch(vtx)
+        timeout = getattr(processor, 'timeout', None)
+        if vertices_blocked:
+            # resources may be released by other runs, check them again in a while
+            retry_in = resources_wait_time(vertices_blocked)
+            if not futures_running:
+                time.sleep(retry_in)
+                return []
+            timeout = retry_in if timeout is None else min(timeout, retry_in)
+        if not futures_running:
+            return []
+
+        futures_done, _ = wait([*futures_running, *streams.starts],
+                               timeout=timeout,
+                               return_when=FIRST_COMPLETED)
+        for future in futures_done:
+            streams.on_started(future)
+        processed_results = []
+        for future in futures_done:
+            if future not in futures_running:
+                continue
+            vtx = futures_running.pop(future)
+            try:
+                processed_results.append((vtx, future.result()))
+            except Exception as e:
+                wait(futures_running)
+                _call_method(executor, 'abort', vertices_running)
+                raise VertexExecutionError(
+                    'Vertex "{0}" execution error: {1}'.format(vtx, e)) from e
+        return processed_results
 
-    # # <Modificaiton> add logic to handle dag input xxxxxxxxxxxxxx cancel
-    # for start_node in vertices_zero_indegree:
-    #     _call_method(executor, 'init_input_deliver', start_node, {"init_input": dag.dag_state["input"] } ) 
-    
     pb_columns = [*Progress.get_default_columns()[:-1], TimeElapsedColumn()]
-    ## </> 
 
-    with Progress(*pb_columns) as progress:  # Modification: add progress bar
-        task_num = len(dag.vertices()) # Modification: add progress bar
+    # a disabled `Progress` still prints a blank line, so silent runs do not create one
+    with Progress(*pb_columns) if progressbar else nullcontext() as progress:  # Modification: add progress bar
+        task_num = len(nodes) # Modification: add progress bar
         if progressbar:
             task = progress.add_task("[green]Processing...", total=100) # Modification: add progress bar
 
         while vertices_zero_indegree:
-            if slower:
-                if isinstance(slower, int) or isinstance(slower, float):
-                    time.sleep(slower)
-                else:
-                    time.sleep(1)
-
+            speculator.start_eligible()
             vertices_idle = vertices_zero_indegree-vertices_running
-            vertices_to_run = selector.select(vertices_running, vertices_idle)
-            _call_method(executor, 'report_start', vertices_to_run)
+            vertices_to_run, vertices_blocked = _select_with_resources(selector, vertices_running, vertices_idle)
+            if vertices_to_run:
+                if slower:
+                    if isinstance(slower, int) or isinstance(slower, float):
+                        time.sleep(slower)
+                    else:
+                        time.sleep(1)
 
-            vertices_running |= set(vertices_to_run)
-            _call_method(executor, 'report_running', vertices_running)
+                _call_method(executor, 'report_start', vertices_to_run)
 
-            processed_results = _process_vertices(
-                vertices_to_run, vertices_running, processor, executor)
-            _call_method(executor, 'report_finish', processed_results)
+                vertices_running |= set(vertices_to_run)
+                _call_method(executor, 'report_running', vertices_running)
 
-            vertices_processed = [result[0] for result in processed_results]
-            vertices_running -= set(vertices_processed)
+            # Modification: handle every finished node right away instead of waiting for the whole 
+            # selected batch, so successors are unlocked (and dispatched) as soon as possible.
+            for vtx, result in process_vertices(vertices_to_run, vertices_blocked):
+                _call_method(executor, 'report_finish', [(vtx, result)], context)
+                context.save_checkpoint(vtx)
+                result = context.spill_output(vtx, result)
 
-            vertices_final += vertices_processed
-            vertices_zero_indegree -= set(vertices_processed)
+                vertices_running.discard(vtx)
+                vertices_final.append(vtx)
+                vertices_zero_indegree.discard(vtx)
 
-            for vtx, result in processed_results:
-                for v_to in dag.successors(vtx):
-                    _call_method(executor, 'deliver', vtx, v_to, result) #  Modificaiton: add vtx
-                    indegree_dict[v_to] -= 1
-                    if indegree_dict[v_to] == 0:
-                        vertices_zero_indegree.add(v_to)
-            if progressbar:
-                progress.update(task, advance= 100 * 1/task_num  ) #  Modificaiton: add vtx
+                streams.on_finish(vtx)
+                for i in successors[index[vtx]]:
+                    if streams.is_streamed(vtx, i):
+                        continue
+                    v_to = nodes[i]
+                    _call_method(executor, 'deliver', vtx, v_to, result, context) #  Modificaiton: add vtx, context
+                    frontier.release(i)
+                context.release_inputs(vtx)
+                if progressbar:
+                    # aborted nodes are counted in `vertices_final` by `frontier`
+                    progress.update(task, completed= 100 * len(vertices_final)/task_num  ) #  Modificaiton: add vtx
         if progressbar:
             progress.update(task, description="[green]Finished", advance=100)
             
     return vertices_final
 
+def _start_checkpoint(context: RunContext, 
+                      checkpoint: Optional[CheckpointStore], 
+                      resume_from: Optional[str], 
+                      verbose: bool) -> None:
+    """
+    Checkpoint the run `context` to `checkpoint`, resuming the checkpointed run `resume_from` if given.
+    """
+    if checkpoint is None:
+        raise ValueError("resume_from needs the `checkpoint` store of the run to resume")
+    context.checkpoint = checkpoint
+    if resume_from is not None:
+        context.resume(checkpoint, resume_from)
+    if verbose:
+        log.info("Checkpointing run %s (%s nodes restored)", context.run_id, len(context.restored))
+
+def _start_incremental(dag: LangDAG, context: RunContext) -> None:
+    """
+    Make `context` an incremental run using the records of the last incremental run of `dag`.
+    """
+    if dag.incremental is None:
+        dag.incremental = IncrementalState()
+    context.incremental = dag.incremental
+    context.incremental.prepare(context.dag_state)
+
 def run_dag(dag: LangDAG, 
             selector=FullSelector(), 
             processor=SequentialProcessor(), 
             executor=LangExecutor(), 
             verbose: bool=True, 
             slower: bool | int | float =False, 
-            progressbar: bool=True):
+            progressbar: bool=True,
+            context: Optional[RunContext] = None,
+            speculation: Optional[Speculation] = None,
+            incremental: bool = False,
+            checkpoint: Optional[CheckpointStore] = None,
+            resume_from: Optional[str] = None,
+            retention: Optional[OutputRetention] = None,
+            isolation: Optional[StateIsolation] = None):
     '''
     Simply a wrapper around `__raw_run`, modified `dag_run` in paradag.
     It implictly set `func_set_dag_output_when` to terminating nodes, 
@@ -474,17 +1603,358 @@ def run_dag(dag: LangDAG,
             it slow down every node execution by N sec.
         progressbar (`Boolean`, *optional*, defaults to True): 
             When set to False, it disable progressbar.
+        context (`RunContext`, *optional*, defaults to None): 
+            Run-scoped state of this run. When not given, a new `RunContext` is created and its results are 
+            copied to the nodes and `dag.dag_state` after the run. When given, results are only kept in `context`, 
+            so the same DAG can be run by many threads simultaneously, each with its own `RunContext`.
+        speculation (`Speculation`, *optional*, defaults to None): 
+            Start nodes with `speculative=True` before their conditional upstream nodes finish, within the limits 
+            of this `langdag.speculation.Speculation`. Needs a concurrent processor (e.g. `MultiThreadProcessor()`).
+        incremental (`Boolean`, *optional*, defaults to False): 
+            Re-execute only the nodes whose inputs changed since the last incremental run of the DAG (their `prompt`, 
+            `func_transform`, upstream outputs, or the `dag_state` keys they read, including `"input"`), and the nodes 
+            depending on them. Other nodes reuse their last output. See `dag.incremental` and `dag.invalidate`.
+        checkpoint (`CheckpointStore`, *optional*, defaults to None): 
+            Persist the result of every node and the `dag_state` to this `langdag.checkpoint.CheckpointStore` 
+            (in the background) under `context.run_id`, so the run can be resumed if it fails or the process dies.
+        resume_from (`str`, *optional*, defaults to None): 
+            The run_id of a run checkpointed in `checkpoint` to resume: its `dag_state` is restored and its 
+            finished nodes are not executed again. New results are checkpointed under the same run_id.
+        retention (`OutputRetention`, *optional*, defaults to None): 
+            Release node outputs once all their downstream nodes consumed them, keep only the outputs of 
+            terminating nodes and spill large outputs to disk while they wait, see `langdag.retention.OutputRetention`.
+            By default every output is kept until the end of the run.
+        isolation (`StateIsolation`, *optional*, defaults to None): 
+            Give each node a snapshot of `dag_state` and apply its writes when it finishes, detecting keys written 
+            by nodes running in parallel, see `langdag.state.StateIsolation`. By default nodes share the `dag_state` 
+            dict and write it in place.
     '''
-    LangDAG.current_dag = dag
-    
-    for vtx in dag.all_terminals():
-        vtx.func_set_dag_output_when = lambda p, up, out, state: state != "aborted"
     if isinstance(processor, SequentialProcessor):
         selector = MaxSelector(1)
     if verbose == False:
         executor.verbose = False
-    res = __raw_run(dag, selector, processor, executor, slower, progressbar)
 
-    LangDAG.current_dag = None
+    commit = context is None
+    if commit:
+        context = RunContext(dag)
+    context.processor = processor
+    context.selector = selector
+    if isolation is not None:
+        context.isolate(isolation)
+    if checkpoint is not None or resume_from is not None:
+        _start_checkpoint(context, checkpoint, resume_from, verbose)
+    if incremental:
+        _start_incremental(dag, context)
+    if retention is not None:
+        context.retain(retention)
+    context.mark_started()
+    try:
+        res = __raw_run(dag, selector, processor, executor, slower, progressbar, context, speculation)
+    except BaseException as e:
+        _cancel_speculations(context)
+        context.close_output(e)
+        if checkpoint is not None:
+            # the caller may not survive the error, do not keep its checkpoints waiting
+            checkpoint.flush()
+        raise
+    finally:
+        context.close_retention()
+        if commit:
+            context.commit()
+    context.close_output()
+
+    return res
+
+async def __raw_arun(dag: LangDAG, 
+                     selector=FullSelector(), 
+                     executor=LangExecutor(), 
+                     thread_pool: Optional[Executor] = None, 
+                     progressbar: bool=True, 
+                     context: Optional[RunContext] = None, 
+                     speculation: Optional[Speculation] = None):
+    '''
+    Async counterpart of `__raw_run`, nodes run as tasks on the running event loop.
+    '''
+    plan = context.plan if context else dag.compile()
+    nodes, successors, index = plan.nodes, plan.successors, plan.index
+
+    vertices_final = []
+    vertices_running = set()
+    if context is not None:
+        context.running = vertices_running
+    vertices_zero_indegree = {nodes[i] for i in plan.starts}
+    tasks_running: Dict[asyncio.Future, Node] = {}
+    loop = asyncio.get_running_loop()
+    frontier = _Frontier(plan, executor, context, vertices_zero_indegree, vertices_final)
+    streams = _StreamDispatch(plan, executor, context, frontier, wrap=asyncio.wrap_future)
+    # speculative results are awaited by `Node.atransform`
+    if not hasattr(executor, 'aexecute'):
+        speculation = None
+    speculator = _Speculator(plan, context, speculation, 
+                             lambda vtx: asyncio.ensure_future(vtx.aspeculate(context, thread_pool)))
+    frontier.on_decide = speculator.on_decide
+
+    def execute_task(param):
+        if hasattr(executor, 'aexecute'):
+            return asyncio.ensure_future(executor.aexecute(param, thread_pool=thread_pool))
+        return loop.run_in_executor(thread_pool, executor.execute, param)
+
+    def release_when_done(vtx, task):
+        task.add_done_callback(lambda _: release_resources(vtx))
+        return task
+
+    pb_columns = [*Progress.get_default_columns()[:-1], TimeElapsedColumn()]
+
+    with Progress(*pb_columns) if progressbar else nullcontext() as progress:
+        task_num = len(nodes)
+        if progressbar:
+            task = progress.add_task("[green]Processing...", total=100)
+
+        while vertices_zero_indegree:
+            speculator.start_eligible()
+            vertices_idle = vertices_zero_indegree-vertices_running
+            vertices_to_run, vertices_blocked = _select_with_resources(selector, vertices_running, vertices_idle)
+            if vertices_to_run:
+                _call_method(executor, 'report_start', vertices_to_run)
+
+                vertices_running |= set(vertices_to_run)
+                _call_method(executor, 'report_running', vertices_running)
+
+                for vtx in vertices_to_run:
+                    task_running = execute_task(_call_method(executor, 'param', vtx, context))
+                    tasks_running[release_when_done(vtx, task_running)] = vtx
+                    streams.watch(vtx)
+
+            timeout = None
+            if vertices_blocked:
+                # resources may be released by other runs, check them again in a while
+                timeout = resources_wait_time(vertices_blocked)
+                if not tasks_running and not streams.starts:
+                    await asyncio.sleep(timeout)
+                    continue
+            tasks_done, _ = await asyncio.wait([*tasks_running, *streams.starts], timeout=timeout, 
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task_done in tasks_done:
+                streams.on_started(task_done)
+            for task_done in tasks_done:
+                if task_done not in tasks_running:
+                    continue
+                vtx = tasks_running.pop(task_done)
+                try:
+                    result = task_done.result()
+                except Exception as e:
+                    if tasks_running:
+                        await asyncio.wait(tasks_running)
+                    _call_method(executor, 'abort', vertices_running)
+                    raise VertexExecutionError(
+                        'Vertex "{0}" execution error: {1}'.format(vtx, e)) from e
+
+                if hasattr(executor, 'areport_finish'):
+                    await executor.areport_finish([(vtx, result)], context)
+                else:
+                    _call_method(executor, 'report_finish', [(vtx, result)], context)
+                context.save_checkpoint(vtx)
+                result = context.spill_output(vtx, result)
+
+                vertices_running.discard(vtx)
+                vertices_final.append(vtx)
+                vertices_zero_indegree.discard(vtx)
+
+                streams.on_finish(vtx)
+                for i in successors[index[vtx]]:
+                    if streams.is_streamed(vtx, i):
+                        continue
+                    v_to = nodes[i]
+                    _call_method(executor, 'deliver', vtx, v_to, result, context)
+                    frontier.release(i)
+                context.release_inputs(vtx)
+                if progressbar:
+                    progress.update(task, completed= 100 * len(vertices_final)/task_num  )
+        if progressbar:
+            progress.update(task, description="[green]Finished", advance=100)
+
+    return vertices_final
+
+async def arun_dag(dag: LangDAG, 
+                   selector=FullSelector(), 
+                   executor=LangExecutor(), 
+                   verbose: bool=True, 
+                   thread_pool: Optional[Executor] = None, 
+                   progressbar: bool=True, 
+                   context: Optional[RunContext] = None, 
+                   processor: Optional[MultiProcessProcessor] = None, 
+                   speculation: Optional[Speculation] = None, 
+                   incremental: bool = False, 
+                   checkpoint: Optional[CheckpointStore] = None, 
+                   resume_from: Optional[str] = None, 
+                   retention: Optional[OutputRetention] = None, 
+                   isolation: Optional[StateIsolation] = None):
+    '''
+    Async version of `run_dag`, a coroutine that runs the DAG on the running event loop.
+    Nodes run concurrently as asyncio tasks: `async def` callables (`func_transform`, `func_desc`, hooks, ...) 
+    are awaited on the event loop, plain `func_transform` and `func_desc` are offloaded to `thread_pool`.
+
+    Example:
+        await arun_dag(dag, selector=MaxSelector(4))
+
+    Args:
+        dag (`LangDAG`, *required*`): The DAG to run.
+        selector (*optional*, defaults to `FullSelector()`): 
+            Set to `FullSelector()` for unlimited concurrent execution, 
+            or use `MaxSelector(max_no)` to limit the maximum number of nodes executing concurrently to `max_no`.
+        executor (*optional*, defaults to `LangExecutor`): 
+            Should use LangExecutor in most cases unless you what to customize your own.
+        verbose (`Boolean`, *optional*, defaults to True): 
+            When set to False, it disable verbose logging.
+        thread_pool (`concurrent.futures.Executor`, *optional*, defaults to `None`): 
+            A bounded executor to run plain (not `async def`) functions in, 
+            when `None` the event loop's default executor is used.
+        progressbar (`Boolean`, *optional*, defaults to True): 
+            When set to False, it disable progressbar.
+        context (`RunContext`, *optional*, defaults to None): 
+            Run-scoped state of this run, same as in `run_dag`. Give each concurrent task its own `RunContext`.
+        processor (`MultiProcessProcessor`, *optional*, defaults to None): 
+            When given, `func_transform` of nodes with `run_in_process=True` runs in its worker processes.
+        speculation (`Speculation`, *optional*, defaults to None): 
+            Limits of speculative execution of nodes with `speculative=True`, same as in `run_dag`.
+        incremental (`Boolean`, *optional*, defaults to False): 
+            Re-execute only the nodes whose inputs changed since the last incremental run, same as in `run_dag`.
+        checkpoint (`CheckpointStore`, *optional*, defaults to None): 
+            Persist the result of every node, same as in `run_dag`.
+        resume_from (`str`, *optional*, defaults to None): 
+            The run_id of a checkpointed run to resume, same as in `run_dag`.
+        retention (`OutputRetention`, *optional*, defaults to None): 
+            Release node outputs once consumed, same as in `run_dag`.
+        isolation (`StateIsolation`, *optional*, defaults to None): 
+            Give each node a snapshot of `dag_state` and apply its writes when it finishes, same as in `run_dag`.
+    '''
+    if verbose == False:
+        executor.verbose = False
+
+    commit = context is None
+    if commit:
+        context = RunContext(dag)
+    context.processor = processor
+    context.selector = selector
+    if isolation is not None:
+        context.isolate(isolation)
+    if checkpoint is not None or resume_from is not None:
+        _start_checkpoint(context, checkpoint, resume_from, verbose)
+    if incremental:
+        _start_incremental(dag, context)
+    if retention is not None:
+        context.retain(retention)
+    context.mark_started()
+    try:
+        res = await __raw_arun(dag, selector, executor, thread_pool, progressbar, context, speculation)
+    except BaseException as e:
+        _cancel_speculations(context)
+        context.close_output(e)
+        if checkpoint is not None:
+            # the caller may not survive the error, do not keep its checkpoints waiting
+            checkpoint.flush()
+        raise
+    finally:
+        context.close_retention()
+        if commit:
+            context.commit()
+    context.close_output()
+
+    return res
+
+def run_dag_batch(dag: LangDAG, 
+                  inputs: List[Any], 
+                  processor=SequentialProcessor(), 
+                  executor=LangExecutor(), 
+                  verbose: bool=True, 
+                  progressbar: bool=True, 
+                  retention: Optional[OutputRetention] = None) -> List[RunContext]:
+    '''
+    Run the DAG over many inputs together, level by level: every node runs once for all inputs, 
+    so nodes with `func_batch_transform` make one batched call per node instead of one call per input. 
+    Conditional edges and acceptance of upstream nodes still apply to each input separately.
+
+    Example:
+        contexts = run_dag_batch(dag, ["query 1", "query 2", "query 3"])
+        outputs = [context.dag_state["output"] for context in contexts]
+
+    Args:
+        dag (`LangDAG`, *required*`): The DAG to run.
+        inputs (`List`, *required*`): 
+            The `dag_input` of each run.
+        processor (*optional*, defaults to `SequentialProcessor()`): 
+            Use langdag.processor.MultiThreadProcessor to run the nodes of the same level concurrently.
+        executor (*optional*, defaults to `LangExecutor`): 
+            Should use LangExecutor in most cases unless you what to customize your own.
+        verbose (`Boolean`, *optional*, defaults to True): 
+            When set to False, it disable verbose logging.
+        progressbar (`Boolean`, *optional*, defaults to True): 
+            When set to False, it disable progressbar.
+        retention (`OutputRetention`, *optional*, defaults to None): 
+            Release node outputs of each run once consumed, same as in `run_dag`.
+
+    Returns:
+        The `RunContext` of each input, in the order of `inputs`. Results are not copied to the nodes and `dag.dag_state`.
+    '''
+    if verbose == False:
+        executor.verbose = False
+
+    plan = dag.compile()
+    contexts = [RunContext(dag, dag_input=dag_input, plan=plan) for dag_input in inputs]
+    for context in contexts:
+        context.processor = processor
+        if retention is not None:
+            context.retain(retention)
+        context.mark_started()
+
+    def execute_func(vtx):
+        acquire_resources(vtx)
+        try:
+            return executor.execute_batch(vtx, contexts)
+        finally:
+            release_resources(vtx)
+
+    pb_columns = [*Progress.get_default_columns()[:-1], TimeElapsedColumn()]
+
+    try:
+        with Progress(*pb_columns) if progressbar else nullcontext() as progress:
+            if progressbar:
+                task = progress.add_task("[green]Processing...", total=100)
+
+            for level in plan.levels:
+                vertices = [plan.nodes[i] for i in level]
+                _call_method(executor, 'report_start', vertices)
+                futures = [processor.submit(execute_func, vtx) for vtx in vertices]
+                for i, vtx, future in zip(level, vertices, futures):
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        wait(futures)
+                        raise VertexExecutionError(
+                            'Vertex "{0}" execution error: {1}'.format(vtx, e)) from e
+
+                    for context, result in zip(contexts, results):
+                        _call_method(executor, 'report_finish', [(vtx, result)], context)
+                        result = context.spill_output(vtx, result)
+                        streaming = context.state_of(vtx).execution_state not in ("aborted", "failed")
+                        for j in plan.successors[i]:
+                            if streaming and j in plan.stream_successors[i]:
+                                executor.deliver_stream(vtx, plan.nodes[j], context.state_of(vtx).node_stream, context)
+                            else:
+                                _call_method(executor, 'deliver', vtx, plan.nodes[j], result, context)
+                        context.release_inputs(vtx)
+                    if progressbar:
+                        progress.update(task, advance= 100 * 1/len(plan))
+            if progressbar:
+                progress.update(task, description="[green]Finished", advance=100)
+    except BaseException as e:
+        for context in contexts:
+            context.close_output(e)
+        raise
+    finally:
+        for context in contexts:
+            context.close_retention()
+    for context in contexts:
+        context.close_output()
 
-    return res
\ No newline at end of file
+    return contexts
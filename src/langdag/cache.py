@@ -0,0 +1,155 @@
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger("rich")
+
+
+class NodeCache():
+    """
+    Base class of node output caches. Subclass it and implement `get`, `set` and `clear` for other backends.
+    """
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Returns `(True, value)` if `key` is cached and not expired, otherwise `(False, None)`.
+        """
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Cache `value` under `key`.
+        """
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        """
+        Remove all cached values.
+        """
+        raise NotImplementedError
+
+
+class MemoryCache(NodeCache):
+    """
+    An in-memory LRU cache of node outputs.
+
+    Args:
+        maxsize (`int`, *optional*, defaults to 1024):
+            Maximum number of cached outputs, the least recently used output is evicted first.
+        ttl (`int | float`, *optional*, defaults to `None`):
+            Seconds a cached output stays valid, never expires when `None`.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: Optional[int | float] = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.__data: OrderedDict = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        with self.__lock:
+            item = self.__data.get(key)
+            if item is None:
+                return False, None
+            expires_at, value = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.__data[key]
+                return False, None
+            self.__data.move_to_end(key)
+            return True, value
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.__lock:
+            self.__data[key] = (expires_at, value)
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__data.clear()
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+
+class SqliteCache(NodeCache):
+    """
+    An on-disk cache of node outputs in a local sqlite database, shared by runs and processes on the same host.
+    Outputs must be picklable.
+
+    Args:
+        path (`str`, *required*):
+            Path of the sqlite database file.
+        maxsize (`int`, *optional*, defaults to `None`):
+            Maximum number of cached outputs, the least recently used outputs are evicted first. Unbounded when `None`.
+        ttl (`int | float`, *optional*, defaults to `None`):
+            Seconds a cached output stays valid, never expires when `None`.
+    """
+    def __init__(self, path: str, maxsize: Optional[int] = None, ttl: Optional[int | float] = None) -> None:
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("CREATE TABLE IF NOT EXISTS langdag_cache "
+                            "(key TEXT PRIMARY KEY, value BLOB, expires_at REAL, accessed_at REAL)")
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        now = time.time()
+        with self.__lock:
+            row = self.__conn.execute("SELECT value, expires_at FROM langdag_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False, None
+            if row[1] is not None and row[1] < now:
+                self.__conn.execute("DELETE FROM langdag_cache WHERE key = ?", (key,))
+                return False, None
+            if self.maxsize is not None:
+                self.__conn.execute("UPDATE langdag_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return True, pickle.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl is not None else None
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.__lock:
+            self.__conn.execute("INSERT OR REPLACE INTO langdag_cache VALUES (?, ?, ?, ?)", (key, data, expires_at, now))
+            if self.maxsize is not None:
+                self.__conn.execute("DELETE FROM langdag_cache WHERE key IN (SELECT key FROM langdag_cache "
+                                    "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.maxsize,))
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__conn.execute("DELETE FROM langdag_cache")
+
+    def close(self) -> None:
+        """
+        Close the database connection.
+        """
+        self.__conn.close()
+
+
+def make_cache_key(node_id: Any,
+                   prompt: Any,
+                   upstream_output: Dict,
+                   dag_state: Dict,
+                   cache_keys: Optional[List] = None) -> Optional[str]:
+    """
+    Returns the cache key of a node execution, built from `node_id`, `prompt`, the (filtered) `upstream_output`
+    and the values of the `cache_keys` of `dag_state`. Returns `None` if they can not be pickled.
+    """
+    try:
+        data = pickle.dumps((node_id,
+                             prompt,
+                             sorted(upstream_output.items(), key=lambda x: repr(x[0])),
+                             [(k, dag_state.get(k)) for k in cache_keys or []]),
+                            pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        log.warning("Output of node %s is not cached, its inputs can not be pickled: %s", node_id, e)
+        return None
+    return hashlib.sha256(data).hexdigest()
@@ -0,0 +1,355 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import atexit
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import weakref
+
+log = logging.getLogger("rich")
+
+
+class NodeCheckpoint(NamedTuple):
+    '''The result of a node in a checkpointed run'''
+    node_id: Any
+    execution_state: str
+    node_output: Any
+    error: Optional[str] = None
+
+
+class CheckpointStore():
+    """
+    Base class of checkpoint stores, which persist the result of every node of a run (`execution_state`,
+    `node_output`) and the `dag_state` after it, so a run that failed or whose process died can be resumed with
+    `run_dag(..., checkpoint=store, resume_from=run_id)`: finished nodes are not executed again.
+
+    `save` pickles the result of the node and queues it with a shallow copy of `dag_state`, a background thread
+    pickles the latest `dag_state` of every run and writes the queued checkpoints in batches every `flush_interval`
+    seconds, so checkpointing adds neither the pickling of `dag_state` nor the disk to the run. Pending checkpoints are written by `flush`, `load`, `close`, when the store is
+    garbage collected and at interpreter exit; a killed process loses at most the last `flush_interval` seconds.
+
+    Subclasses implement `write`, `read`, `delete` and `run_ids`.
+
+    Args:
+        flush_interval (`float`, *optional*, defaults to 0.2):
+            Seconds between two batches of writes.
+    """
+    def __init__(self, flush_interval: float = 0.2) -> None:
+        self.flush_interval = flush_interval
+        self.__pending_nodes: List[Tuple[str, Any, Optional[bytes]]] = []
+        self.__pending_states: Dict[str, Dict] = {}
+        self.__condition = threading.Condition()
+        # held while a batch is written, so `flush` returns once the checkpoints are on disk
+        self.__write_lock = threading.Lock()
+        self.__writer: Optional[threading.Thread] = None
+        self.__closed = False
+        self.__warned = set()
+        _stores.add(self)
+
+    def save(self, run_id: str, checkpoint: NodeCheckpoint, dag_state: Dict) -> None:
+        """
+        Pickle the result of a node and queue it with the `dag_state` after it (a shallow copy is kept,
+        only the latest one of a run is pickled and written) for writing.
+        """
+        if self.__closed:
+            raise RuntimeError("The checkpoint store is closed")
+        node_data = self.__dumps_checkpoint(checkpoint)
+        with self.__condition:
+            if self.__closed:
+                raise RuntimeError("The checkpoint store is closed")
+            self.__pending_nodes.append((run_id, checkpoint.node_id, node_data))
+            self.__pending_states[run_id] = dict(dag_state)
+            if self.__writer is None:
+                self.__writer = threading.Thread(target=CheckpointStore.__write_loop,
+                                                 args=(weakref.ref(self), self.__condition, self.flush_interval),
+                                                 name="langdag-checkpoint", daemon=True)
+                self.__writer.start()
+
+    @staticmethod
+    def __write_loop(store_ref: "weakref.ref[CheckpointStore]", condition: threading.Condition,
+                     flush_interval: float) -> None:
+        # the store is only held weakly between two batches: the thread exits once it is closed or collected
+        while True:
+            with condition:
+                condition.wait(flush_interval)
+            store = store_ref()
+            if store is None:
+                return
+            store.flush()
+            if store.__closed:
+                return
+            del store
+
+    def flush(self) -> None:
+        """
+        Write the queued checkpoints now.
+        """
+        with self.__write_lock:
+            with self.__condition:
+                nodes, self.__pending_nodes = self.__pending_nodes, []
+                states, self.__pending_states = self.__pending_states, {}
+            if not nodes and not states:
+                return
+            try:
+                self.write(nodes, [(run_id, self.__dumps_state(dag_state)) for run_id, dag_state in states.items()])
+            except Exception as e:
+                log.warning("Checkpoints of %s nodes could not be written: %r", len(nodes), e)
+
+    def __warn_once(self, key, message: str, *args) -> None:
+        if key not in self.__warned:
+            self.__warned.add(key)
+            log.warning(message, *args)
+
+    def __dumps_checkpoint(self, checkpoint: NodeCheckpoint) -> Optional[bytes]:
+        try:
+            return pickle.dumps(checkpoint, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            self.__warn_once(("node", checkpoint.node_id),
+                             "Output of node %s can not be pickled, the node will run again on resume",
+                             checkpoint.node_id)
+            return None
+
+    def __dumps_state(self, dag_state: Dict) -> bytes:
+        payload = {}
+        for k, v in dag_state.items():
+            for retry in range(3):
+                try:
+                    payload[k] = pickle.dumps(v, pickle.HIGHEST_PROTOCOL)
+                    break
+                except RuntimeError:
+                    # a running node changed the value while it was pickled
+                    if retry == 2:
+                        self.__warn_once(("changing", k), "dag_state[%r] kept changing while checkpointed, it is skipped", k)
+                except Exception:
+                    self.__warn_once(("key", k), "dag_state[%r] can not be pickled, it is not checkpointed", k)
+                    break
+        return pickle.dumps(payload, pickle.HIGHEST_PROTOCOL)
+
+    def load(self, run_id: str) -> Tuple[Dict[Any, NodeCheckpoint], Optional[Dict]]:
+        """
+        Returns the checkpoints of the nodes of run `run_id` by node_id, and its last checkpointed `dag_state`
+        (None if the run has no checkpoint).
+        """
+        self.flush()
+        rows, state = self.read(run_id)
+        checkpoints = {}
+        for data in rows:
+            checkpoint = pickle.loads(data)
+            checkpoints[checkpoint.node_id] = checkpoint
+        if state is None:
+            return checkpoints, None
+        return checkpoints, {k: pickle.loads(v) for k, v in pickle.loads(state).items()}
+
+    def close(self) -> None:
+        """
+        Write the queued checkpoints and stop the background writer.
+        """
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+            writer = self.__writer
+        if writer is not None:
+            writer.join()
+        self.flush()
+
+    def __del__(self) -> None:
+        # a store dropped without `close` still writes its queued checkpoints
+        self.flush()
+
+    def write(self, nodes: List[Tuple[str, Any, Optional[bytes]]], states: List[Tuple[str, bytes]]) -> None:
+        """
+        Write a batch: `(run_id, node_id, pickled NodeCheckpoint)` of nodes (None when it could not be pickled,
+        any previous checkpoint of the node is then removed) and `(run_id, pickled dag_state)` of runs.
+        """
+        raise NotImplementedError
+
+    def read(self, run_id: str) -> Tuple[List[bytes], Optional[bytes]]:
+        """
+        Returns the pickled `NodeCheckpoint`s of run `run_id`, and its pickled `dag_state` or None.
+        """
+        raise NotImplementedError
+
+    def delete(self, run_id: str) -> None:
+        """
+        Remove the checkpoints of run `run_id`, e.g. after it completed.
+        """
+        raise NotImplementedError
+
+    def run_ids(self) -> List[str]:
+        """
+        Returns the ids of the runs with checkpoints.
+        """
+        raise NotImplementedError
+
+
+class SqliteCheckpointStore(CheckpointStore):
+    """
+    A checkpoint store in a local sqlite database, shared by processes on the same host.
+    A batch of checkpoints is written in a single transaction.
+
+    Args:
+        path (`str`, *required*):
+            Path of the sqlite database file.
+        flush_interval (`float`, *optional*, defaults to 0.2):
+            Seconds between two batches of writes.
+    """
+    def __init__(self, path: str, flush_interval: float = 0.2) -> None:
+        super().__init__(flush_interval)
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("CREATE TABLE IF NOT EXISTS langdag_checkpoint_nodes "
+                            "(run_id TEXT, node_key BLOB, checkpoint BLOB, saved_at REAL, PRIMARY KEY (run_id, node_key))")
+        self.__conn.execute("CREATE TABLE IF NOT EXISTS langdag_checkpoint_states "
+                            "(run_id TEXT PRIMARY KEY, dag_state BLOB, saved_at REAL)")
+
+    def write(self, nodes: List[Tuple[str, Any, Optional[bytes]]], states: List[Tuple[str, bytes]]) -> None:
+        now = time.time()
+        with self.__lock:
+            self.__conn.execute("BEGIN")
+            try:
+                for run_id, node_id, data in nodes:
+                    node_key = pickle.dumps(node_id, pickle.HIGHEST_PROTOCOL)
+                    if data is None:
+                        self.__conn.execute("DELETE FROM langdag_checkpoint_nodes WHERE run_id = ? AND node_key = ?",
+                                            (run_id, node_key))
+                    else:
+                        self.__conn.execute("INSERT OR REPLACE INTO langdag_checkpoint_nodes VALUES (?, ?, ?, ?)",
+                                            (run_id, node_key, data, now))
+                self.__conn.executemany("INSERT OR REPLACE INTO langdag_checkpoint_states VALUES (?, ?, ?)",
+                                        [(run_id, data, now) for run_id, data in states])
+            except BaseException:
+                self.__conn.execute("ROLLBACK")
+                raise
+            self.__conn.execute("COMMIT")
+
+    def read(self, run_id: str) -> Tuple[List[bytes], Optional[bytes]]:
+        with self.__lock:
+            rows = self.__conn.execute("SELECT checkpoint FROM langdag_checkpoint_nodes WHERE run_id = ? "
+                                       "ORDER BY saved_at", (run_id,)).fetchall()
+            state = self.__conn.execute("SELECT dag_state FROM langdag_checkpoint_states WHERE run_id = ?",
+                                        (run_id,)).fetchone()
+        return [row[0] for row in rows], state[0] if state else None
+
+    def delete(self, run_id: str) -> None:
+        self.flush()
+        with self.__lock:
+            self.__conn.execute("DELETE FROM langdag_checkpoint_nodes WHERE run_id = ?", (run_id,))
+            self.__conn.execute("DELETE FROM langdag_checkpoint_states WHERE run_id = ?", (run_id,))
+
+    def run_ids(self) -> List[str]:
+        self.flush()
+        with self.__lock:
+            return [row[0] for row in self.__conn.execute("SELECT run_id FROM langdag_checkpoint_states")]
+
+    def close(self) -> None:
+        super().close()
+        with self.__lock:
+            self.__conn.close()
+
+
+class FileCheckpointStore(CheckpointStore):
+    """
+    A checkpoint store in a local directory, with one append-only file of node checkpoints per run
+    (`<run_id>.ckpt`) and one file of its latest `dag_state` (`<run_id>.state`), replaced atomically.
+    A checkpoint cut short by a crash is ignored when the run is loaded.
+
+    Args:
+        directory (`str`, *required*):
+            Directory of the checkpoint files, created if needed.
+        flush_interval (`float`, *optional*, defaults to 0.2):
+            Seconds between two batches of writes.
+        fsync (`bool`, *optional*, defaults to `False`):
+            Sync every batch to disk, so checkpoints also survive a power loss (slower).
+    """
+    SUFFIX = ".ckpt"
+    STATE_SUFFIX = ".state"
+
+    def __init__(self, directory: str, flush_interval: float = 0.2, fsync: bool = False) -> None:
+        super().__init__(flush_interval)
+        self.directory = directory
+        self.fsync = fsync
+        self.__lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, run_id: str, suffix: str = SUFFIX) -> str:
+        if not run_id or os.sep in run_id or (os.altsep and os.altsep in run_id) or run_id in (".", ".."):
+            raise ValueError(f"run_id {run_id!r} can not be used as a file name")
+        return os.path.join(self.directory, run_id + suffix)
+
+    def write(self, nodes: List[Tuple[str, Any, Optional[bytes]]], states: List[Tuple[str, bytes]]) -> None:
+        records: Dict[str, List[Tuple]] = {}
+        for run_id, node_id, data in nodes:
+            records.setdefault(run_id, []).append(("node", node_id, data))
+        with self.__lock:
+            for run_id, items in records.items():
+                with open(self.__path(run_id), "ab") as f:
+                    for item in items:
+                        pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+            for run_id, data in states:
+                path = self.__path(run_id, self.STATE_SUFFIX)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+                os.replace(path + ".tmp", path)
+
+    def read(self, run_id: str) -> Tuple[List[bytes], Optional[bytes]]:
+        path = self.__path(run_id)
+        nodes: Dict[Any, Optional[bytes]] = {}
+        state = None
+        with self.__lock:
+            if not os.path.exists(path):
+                return [], None
+            with open(path, "rb") as f:
+                while True:
+                    try:
+                        kind, node_id, data = pickle.load(f)
+                    except EOFError:
+                        break
+                    except Exception:
+                        log.warning("Checkpoint file %s ends with an incomplete record, it is ignored", path)
+                        break
+                    if kind == "state":
+                        # written by earlier versions, before `<run_id>.state`
+                        state = data
+                    else:
+                        # the latest checkpoint of a node wins
+                        nodes.pop(node_id, None)
+                        nodes[node_id] = data
+            state_path = self.__path(run_id, self.STATE_SUFFIX)
+            if os.path.exists(state_path):
+                with open(state_path, "rb") as f:
+                    state = f.read()
+        return [data for data in nodes.values() if data is not None], state
+
+    def delete(self, run_id: str) -> None:
+        self.flush()
+        with self.__lock:
+            for suffix in (self.SUFFIX, self.STATE_SUFFIX):
+                try:
+                    os.remove(self.__path(run_id, suffix))
+                except FileNotFoundError:
+                    pass
+
+    def run_ids(self) -> List[str]:
+        self.flush()
+        return sorted({name[:-len(suffix)] for name in os.listdir(self.directory)
+                       for suffix in (self.SUFFIX, self.STATE_SUFFIX) if name.endswith(suffix)})
+
+
+_stores: "weakref.WeakSet[CheckpointStore]" = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_stores() -> None:
+    '''Write the checkpoints still queued when the interpreter exits'''
+    for store in list(_stores):
+        store.flush()
@@ -0,0 +1,235 @@
+from typing import Any, Callable, Dict, FrozenSet, Optional, Tuple
+from collections import OrderedDict
+import logging
+import threading
+from langdag.utils import Subset, Superset, Emptyset, NonEmptyset, PretransformSet, NotPretransformSet
+
+# A compiled condition: called with an upstream output and the `PretransformMemo` of the run (or None)
+Predicate = Callable[[Any, Optional["PretransformMemo"]], bool]
+
+# Outputs the special condition classes compare element by element, other outputs are compared as a whole
+_COLLECTIONS = (list, tuple, set)
+
+
+class PretransformMemo():
+    """
+    Results of the `func` of `PretransformSet` / `NotPretransformSet` conditions per upstream output in a run,
+    so a router whose output is tested by many edges with the same `func` calls it once. Outputs are compared
+    by identity, the `maxsize` most recent results are kept (and the outputs with them, until the run ends).
+    """
+    def __init__(self, maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self.__data: OrderedDict = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def call(self, func: Callable[[Any], Any], value: Any) -> Any:
+        """
+        Returns `func(value)`, calling `func` only if it was not called with this very `value` already.
+        """
+        key = (id(func), id(value))
+        with self.__lock:
+            item = self.__data.get(key)
+            # the entry keeps `func` and `value` alive, so their ids can not be reused while it exists
+            if item is not None and item[0] is func and item[1] is value:
+                self.__data.move_to_end(key)
+                return item[2]
+        result = func(value)
+        with self.__lock:
+            self.__data[key] = (func, value, result)
+            while len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+        return result
+
+
+def _builtin(value: Any) -> bool:
+    '''Whether `value == condition` of a builtin `value` is decided by the condition (it has no own `__eq__` for it)'''
+    return type(value).__module__ == "builtins"
+
+
+def _try_frozenset(items) -> Optional[FrozenSet]:
+    try:
+        return frozenset(items)
+    except TypeError:
+        return None
+
+
+def _in(x: Any, collection) -> bool:
+    try:
+        return x in collection
+    except TypeError:
+        # an unhashable `x` in a set
+        return any(x is y or x == y for y in collection)
+
+
+def _equals(condition: Any) -> Predicate:
+    # same test as `(node_id, condition) in upstream_output.items()`
+    return lambda value, memo=None: value is condition or value == condition
+
+
+def _superset(condition: Superset) -> Predicate:
+    items = tuple(condition)
+    hashed = _try_frozenset(items)
+
+    def predicate(value, memo=None):
+        if not _builtin(value):
+            return value == condition
+        if isinstance(value, set) and hashed is not None:
+            return hashed <= value
+        if isinstance(value, _COLLECTIONS):
+            return all(_in(x, value) for x in items)
+        return all(x is value or x == value for x in items)
+    return predicate
+
+
+def _subset(condition: Subset) -> Predicate:
+    items = tuple(condition)
+    hashed = _try_frozenset(items)
+
+    def contains(x):
+        if hashed is not None:
+            try:
+                return x in hashed
+            except TypeError:
+                pass
+        return x in items
+
+    def predicate(value, memo=None):
+        if not _builtin(value):
+            return value == condition
+        if isinstance(value, _COLLECTIONS):
+            return all(contains(x) for x in value)
+        return contains(value)
+    return predicate
+
+
+def _emptyset(condition: Emptyset) -> Predicate:
+    def predicate(value, memo=None):
+        if not _builtin(value):
+            return value == condition
+        return value is None or (isinstance(value, _COLLECTIONS) and len(value) == 0)
+    return predicate
+
+
+def _non_emptyset(condition: NonEmptyset) -> Predicate:
+    def predicate(value, memo=None):
+        if not _builtin(value):
+            return value == condition
+        return value is not None and not (isinstance(value, _COLLECTIONS) and len(value) == 0)
+    return predicate
+
+
+def _pretransform(condition, negate: bool) -> Predicate:
+    func = condition.func
+    matches = compile_condition(condition.data)
+    name = type(condition).__name__
+
+    def predicate(value, memo=None):
+        if not _builtin(value):
+            return value == condition
+        try:
+            return matches(memo.call(func, value) if memo is not None else func(value), memo) != negate
+        except Exception as e:
+            logging.warning('%s() Error occured!', name)
+            logging.warning(e)
+            return negate
+    return predicate
+
+
+_COMPILERS = {
+    Superset: _superset,
+    Subset: _subset,
+    Emptyset: _emptyset,
+    NonEmptyset: _non_emptyset,
+}
+
+
+def compile_condition(condition: Any) -> Predicate:
+    """
+    Returns a predicate of an upstream output (and the `PretransformMemo` of the run), True when `condition`
+    (of a conditional edge) is met. It gives the same result as `upstream_output == condition`, without copying
+    the output for the special condition classes of `langdag.utils`, and with the `func` of `PretransformSet` /
+    `NotPretransformSet` called once per upstream output when a memo is given.
+    Subclasses of the special classes are compared with `==`.
+    """
+    kind = type(condition)
+    if kind in _COMPILERS:
+        return _COMPILERS[kind](condition)
+    if kind in (PretransformSet, NotPretransformSet):
+        return _pretransform(condition, kind is NotPretransformSet)
+    return _equals(condition)
+
+
+class Conditions():
+    """
+    The conditions on the conditional edges into a node, compiled once (by `dag.compile()`) into a predicate
+    per upstream node_id, to decide whether the node is acceptable with O(1) lookups by upstream node_id.
+
+    Args:
+        execution_condition (`Dict`, *required*):
+            The conditions as `{upstream node_id: condition}`.
+    """
+    def __init__(self, execution_condition: Dict[Any, Any]) -> None:
+        self.execution_condition = execution_condition
+        self.predicates: Dict[Any, Predicate] = {
+            node_id: compile_condition(condition) for node_id, condition in execution_condition.items()}
+
+    def evaluate(self,
+                 upstream_execution_state: Dict[Any, str],
+                 upstream_output: Dict[Any, Any],
+                 all_acceptable: bool = True,
+                 memo: Optional[PretransformMemo] = None,
+                 met: Optional[Dict[Any, bool]] = None) -> Tuple[bool, Optional[FrozenSet]]:
+        """
+        Decide whether the node is allowed to execute, every condition evaluated once.
+        Returns that decision and the ids of acceptable upstream nodes (None without conditional edges,
+        all upstream nodes are then kept).
+
+        Args:
+            upstream_execution_state (`Dict`, *required*):
+                `execution_state` of the upstream nodes delivered so far, by node_id.
+            upstream_output (`Dict`, *required*):
+                Outputs of the upstream nodes, by node_id.
+            all_acceptable (`bool`, *optional*, defaults to `True`):
+                Whether all upstream nodes must be acceptable, otherwise any one is enough.
+            memo (`PretransformMemo`, *optional*, defaults to `None`):
+                Results of pretransform functions in the run.
+            met (`Dict`, *optional*, defaults to `None`):
+                Filled with whether the condition of each evaluated conditional edge is met, by upstream node_id.
+        """
+        predicates = self.predicates
+        finished = 0
+        unconditional_finished = []
+        for node_id, execution_state in upstream_execution_state.items():
+            # "streaming": a streaming upstream node delivered its `NodeStream` before it finished
+            if execution_state == "finished" or execution_state == "streaming":
+                finished += 1
+                if node_id not in predicates:
+                    unconditional_finished.append(node_id)
+
+        if not predicates:
+            if all_acceptable:
+                return finished == len(upstream_execution_state), None
+            return finished > 0, None
+
+        conditional_acceptable = []
+        for node_id, predicate in predicates.items():
+            if node_id not in upstream_output:
+                continue
+            accepted = bool(predicate(upstream_output[node_id], memo))
+            if met is not None:
+                met[node_id] = accepted
+            if accepted:
+                conditional_acceptable.append(node_id)
+        nodes_acceptable = frozenset(conditional_acceptable).union(unconditional_finished)
+        if all_acceptable:
+            allow_execution = (finished == len(upstream_execution_state)
+                               and len(conditional_acceptable) == len(predicates))
+        else:
+            allow_execution = finished > 0 and len(nodes_acceptable) > 0
+        return allow_execution, nodes_acceptable
+
+    def __bool__(self) -> bool:
+        return bool(self.predicates)
+
+    def __repr__(self) -> str:
+        return f"Conditions({self.execution_condition!r})"
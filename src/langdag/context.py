@@ -0,0 +1,383 @@
+from typing import Dict, Any, Optional
+import copy
+import logging
+import threading
+import time
+import uuid
+from langdag.plan import ExecutionPlan
+from langdag.checkpoint import CheckpointStore, NodeCheckpoint
+from langdag.condition import Conditions, PretransformMemo
+from langdag.stream import NodeStream
+from langdag.retention import OutputRefs, OutputRetention, SpilledOutput
+from langdag.state import SharedState, StateIsolation
+
+log = logging.getLogger("rich")
+
+# Key of the `dag_state` of the sub-DAGs in checkpointed `dag_state`s, by node_id of their input node
+_SUBDAG_STATES = "__subdag_states__"
+
+# Keys of `dag_state` templates whose value can not be copied, warned about once
+_shared_template_keys = set()
+
+
+def _copy_template(dag_state: Dict) -> Dict:
+    '''
+    A copy of the `dag_state` a DAG is built with, for one run: mutable values (lists, dicts...) are deep copied,
+    so the writes of a run reach neither the template nor the other runs.
+    '''
+    state = {}
+    for k, v in dag_state.items():
+        if k in ("output", "output_by_node_id"):
+            continue
+        try:
+            state[k] = copy.deepcopy(v)
+        except Exception:
+            if k not in _shared_template_keys:
+                _shared_template_keys.add(k)
+                log.warning("dag_state[%r] can not be copied, it is shared by all the runs of the DAG", k)
+            state[k] = v
+    return state
+
+
+# Attributes of a `Node` that change during a run, they are kept in a `NodeState` per run.
+RUN_ATTRIBUTES = (
+    "node_desc",
+    "upstream_output",
+    "node_output",
+    "upstream_execution_state",
+    "execution_state",
+    "conditional_excecution",
+    "execution_condition",
+    "conditions_met",
+    "output_released",
+    "cache_hit",
+    "timing",
+    "error",
+)
+
+_commit_lock = threading.Lock()
+
+
+class NodeTiming():
+    """
+    Timing of a node in a run, as `time.perf_counter()` values: when the node became ready (its last upstream 
+    node delivered), started and ended executing, plus the time spent in hooks and in evaluating conditions
+    (acceptance of upstream nodes and `func_set_dag_output_when`).
+    """
+    __slots__ = ("origin", "ready", "start", "end", "hook_time", "condition_time")
+
+    def __init__(self, origin: float) -> None:
+        self.origin = origin
+        self.ready: Optional[float] = None
+        self.start: Optional[float] = None
+        self.end: Optional[float] = None
+        self.hook_time: float = 0.0
+        self.condition_time: float = 0.0
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+    @property
+    def queue_wait(self) -> Optional[float]:
+        """Seconds between the node becoming ready and starting to execute."""
+        if self.start is None:
+            return None
+        return self.start - (self.ready if self.ready is not None else self.origin)
+
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        """
+        Returns the timing in seconds, `ready`, `start` and `end` are relative to the start of the run.
+        """
+        def offset(t):
+            return None if t is None else t - self.origin
+        return {
+            "ready": offset(self.ready if self.ready is not None else (self.origin if self.start is not None else None)),
+            "start": offset(self.start),
+            "end": offset(self.end),
+            "duration": self.duration,
+            "queue_wait": self.queue_wait,
+            "hook_time": self.hook_time,
+            "condition_time": self.condition_time,
+        }
+
+    def __repr__(self) -> str:
+        return f"NodeTiming({self.as_dict()})"
+
+
+def add_elapsed(state, attr: str, since: float) -> None:
+    """
+    Add the seconds elapsed since `since` to the `attr` ("hook_time" or "condition_time") of the timing of `state`.
+    """
+    timing = getattr(state, "timing", None)
+    if timing is not None:
+        setattr(timing, attr, getattr(timing, attr) + time.perf_counter() - since)
+
+
+class NodeState():
+    """
+    Run-scoped state of a node, it has the same run attributes as `Node`
+    (`node_desc`, `upstream_output`, `node_output`, `upstream_execution_state`, `execution_state`, ...).
+    """
+    def __init__(self, 
+                 node, 
+                 execution_condition: Optional[Dict[Any, Any]] = None, 
+                 origin: Optional[float] = None, 
+                 conditions: Optional[Conditions] = None, 
+                 upstream_alias: Optional[Dict[Any, Any]] = None) -> None:
+        self.node_id = node.node_id
+        self.node_desc = node.node_desc
+        self.upstream_output: Dict[Any, Any] = {}
+        self.node_output: Any = None
+        self.upstream_execution_state: Dict[Any, Any] = {}
+        self.execution_state: str = "initialized"
+        self.conditional_excecution: bool = bool(execution_condition)
+        self.execution_condition: Dict[Any, Any] = execution_condition or {}
+        # `execution_condition` compiled into predicates (see `ExecutionPlan.conditions`)
+        self.conditions: Optional[Conditions] = conditions
+        # Whether the condition of each conditional edge into the node was met, by upstream node_id, 
+        # recorded when evaluated (the upstream outputs may be released before the run is inspected)
+        self.conditions_met: Dict[Any, bool] = {}
+        # Whether `node_output` was released once consumed (`OutputRetention(keep="terminal")`)
+        self.output_released: bool = False
+        # For nodes of sub-DAGs, the node_id each upstream node is given to the node as (see `ExecutionPlan.upstream_alias`)
+        self.upstream_alias: Optional[Dict[Any, Any]] = upstream_alias
+        self.cache_hit: Optional[bool] = None
+        # The exception of the last attempt when the node "failed" (see `langdag.retry.RetryPolicy`)
+        self.error: Optional[BaseException] = None
+        # Whether the node may execute and its acceptable upstream nodes, when decided by the scheduler
+        self.acceptance = None
+        # Result (a future) of the speculative transform of a node with `speculative=True`, until it is used or discarded
+        self.speculation = None
+        # Whether the output was restored from the checkpoint of a resumed run instead of executing the node
+        self.restored: bool = False
+        self.timing: NodeTiming = NodeTiming(origin if origin is not None else time.perf_counter())
+        # Chunks of the node output during the run, for nodes with a generator `func_transform`
+        self.node_stream: Optional[NodeStream] = None
+
+    def get_info(self) -> Dict:
+        """
+        Returns a dict containing run attributes of the node.
+        """
+        return {k: getattr(self, k) for k in RUN_ATTRIBUTES}
+
+
+class RunContext():
+    """
+    State of a single DAG run: node states, `dag_state` and outputs delivered to downstream nodes.
+    A `LangDAG` can serve many simultaneous runs (threads or asyncio tasks), each with its own `RunContext`
+    and its own copy of the `dag_state` the DAG is built with.
+
+    Example:
+        context = RunContext(dag, dag_input=user_query)
+        run_dag(dag, context=context)
+        print(context.dag_state["output"])
+
+    `context.output_stream` is a `NodeStream` of the DAG output: chunks of the first terminating node that streams
+    its output, or the DAG output as a single chunk. It can be iterated by another thread or task while the DAG runs.
+
+    Args:
+        dag (`LangDAG`, *required*`):
+            The DAG to run.
+        dag_input (`Any`, *optional*`):
+            Input of this run, defaults to the `dag_input` the DAG is created with.
+        plan (`ExecutionPlan`, *optional*`):
+            Compiled plan of the DAG, defaults to `dag.compile()`.
+        run_id (`str`, *optional*`):
+            Id of this run in a `CheckpointStore`, defaults to a random id.
+    """
+    def __init__(self, dag, dag_input: Optional[Any] = None, plan: Optional[ExecutionPlan] = None, 
+                 run_id: Optional[str] = None) -> None:
+        self.dag = dag
+        self.run_id: str = run_id or uuid.uuid4().hex
+        self.plan: ExecutionPlan = plan or dag.compile()
+        self.started_at: float = time.perf_counter()
+        self.dag_state: Dict[Any, Any] = {**_copy_template(dag.dag_state), "output": None}
+        if dag_input is not None:
+            self.dag_state["input"] = dag_input
+        self.node_states: Dict[Any, NodeState] = {
+            node: NodeState(node, self.plan.execution_condition[i], self.started_at, self.plan.conditions[i], 
+                            self.plan.upstream_alias[i]) 
+            for i, node in enumerate(self.plan.nodes)}
+        for i, node in enumerate(self.plan.nodes):
+            if self.plan.streaming[i]:
+                self.node_states[node].node_stream = NodeStream(node.node_id)
+        self.output_stream = NodeStream("output")
+        self.__output_piped = False
+        self.upstream_output: Dict[Any, Dict] = {}
+        # The processor running this run, e.g. `MultiProcessProcessor` runs nodes with `run_in_process=True`
+        self.processor = None
+        # The selector of the run, bounds the concurrent elements of `langdag.mapnode.MapNode`
+        self.selector = None
+        # The nodes of the run running now (set by the scheduler), they take their slots of the selector
+        self.running = None
+        # `IncrementalState` of the DAG in an incremental run (`run_dag(..., incremental=True)`)
+        self.incremental = None
+        # Results of the functions of `PretransformSet` conditions, per upstream output of this run
+        self.pretransform_memo = PretransformMemo()
+        # Where the results of nodes are checkpointed (`run_dag(..., checkpoint=store)`)
+        self.checkpoint: Optional[CheckpointStore] = None
+        # Checkpoints of the nodes that finished in the run this one resumes, by node_id
+        self.restored: Dict[Any, NodeCheckpoint] = {}
+        # Reference counts of node outputs, when they are released once consumed (`run_dag(..., retention=...)`)
+        self.output_refs: Optional[OutputRefs] = None
+        # `dag_state` of the sub-DAGs (`langdag.subdag.SubDag`) of the run, by integer id of their input node
+        self.subdag_states: Dict[int, Dict] = {}
+        self.__restored_subdag_states: Dict[Any, Dict] = {}
+
+    def state_of(self, node) -> NodeState:
+        """
+        Returns the `NodeState` of `node` in this run.
+        """
+        return self.node_states[node]
+
+    def dag_state_of(self, node) -> Dict:
+        """
+        Returns the `dag_state` used by `node`: the `dag_state` of the run, or of the sub-DAG `node` belongs to.
+        """
+        scope = self.plan.scope[self.plan.index[node]]
+        if scope is None:
+            return self.dag_state
+        return self.subdag_state(scope)
+
+    def subdag_state(self, i: int) -> Dict:
+        """
+        Returns the `dag_state` of the sub-DAG whose input node is the node `i` (an integer id of the plan), 
+        created with the output of the input node as `"input"` when first used (or restored in a resumed run).
+        """
+        dag_state = self.subdag_states.get(i)
+        if dag_state is None:
+            node = self.plan.nodes[i]
+            dag_state = self.__restored_subdag_states.get(node.node_id)
+            if dag_state is None:
+                dag_input = self.node_states[node].node_output
+                if isinstance(dag_input, SpilledOutput):
+                    dag_input = dag_input.load()
+                dag_state = node.initial_state(dag_input)
+            if isinstance(self.dag_state, SharedState):
+                dag_state = SharedState(dag_state, on_conflict=self.dag_state.on_conflict)
+            dag_state = self.subdag_states.setdefault(i, dag_state)
+        return dag_state
+
+    def is_terminal(self, node) -> bool:
+        """
+        Returns whether `node` is a terminating node of the DAG.
+        """
+        return self.plan.is_terminal[self.plan.index[node]]
+
+    def mark_started(self) -> None:
+        """
+        Record the start of the run, node timings are relative to it.
+        """
+        self.started_at = time.perf_counter()
+        for state in self.node_states.values():
+            state.timing.origin = self.started_at
+
+    def pipe_output(self, stream: NodeStream) -> None:
+        """
+        Forward `stream` (of a terminating node) to `output_stream`, unless another stream is already forwarded.
+        """
+        if not self.__output_piped:
+            self.__output_piped = True
+            stream.pipe(self.output_stream)
+
+    def close_output(self, error: Optional[BaseException] = None) -> None:
+        """
+        Close `output_stream` at the end of the run. If no terminating node streamed its output, 
+        the DAG output is put as a single chunk.
+        """
+        if not self.__output_piped and error is None and self.dag_state.get("output") is not None:
+            self.output_stream.put(self.dag_state["output"])
+        self.output_stream.close(error)
+
+    def resume(self, checkpoint: CheckpointStore, run_id: str) -> None:
+        """
+        Continue the run `run_id` checkpointed in `checkpoint`: its `dag_state` is restored, and the nodes that 
+        finished in it reuse their output instead of executing again.
+        """
+        checkpoints, dag_state = checkpoint.load(run_id)
+        self.run_id = run_id
+        if dag_state is not None:
+            dag_state = dict(dag_state)
+            self.__restored_subdag_states = dag_state.pop(_SUBDAG_STATES, None) or {}
+            self.dag_state.update(dag_state)
+        self.restored = {node_id: x for node_id, x in checkpoints.items() if x.execution_state == "finished"}
+
+    def save_checkpoint(self, node) -> None:
+        """
+        Queue the result of `node` and the current `dag_state` for writing to `checkpoint`, if the run has one.
+        """
+        if self.checkpoint is None:
+            return
+        state = self.node_states[node]
+        if getattr(state, "restored", False):
+            return
+        error = repr(state.error) if state.error is not None else None
+        dag_state = self.dag_state
+        if self.subdag_states:
+            dag_state = {**dag_state, _SUBDAG_STATES: {
+                self.plan.nodes[i].node_id: dict(x) for i, x in list(self.subdag_states.items())}}
+        self.checkpoint.save(self.run_id, 
+                             NodeCheckpoint(node.node_id, state.execution_state, state.node_output, error), 
+                             dag_state)
+
+    def isolate(self, isolation: StateIsolation) -> None:
+        """
+        Make `dag_state` a `SharedState`, so each node reads a snapshot of it and its writes are applied 
+        when it finishes, as set by `isolation`.
+        """
+        if not isinstance(self.dag_state, SharedState):
+            self.dag_state = SharedState(self.dag_state, on_conflict=isolation.on_conflict)
+
+    def retain(self, retention: OutputRetention) -> None:
+        """
+        Release node outputs once consumed by all their downstream nodes, as set by `retention`.
+        """
+        self.output_refs = OutputRefs(retention, self)
+
+    def upstream_of(self, node, keys=None) -> Dict:
+        """
+        Returns a copy of the outputs delivered to `node` so far, outputs spilled to disk are read back 
+        (only those of the upstream node_ids `keys` if given).
+        """
+        upstream_output = self.upstream_output.get(node) or {}
+        if self.output_refs is None:
+            return dict(upstream_output)
+        return self.output_refs.load(upstream_output, keys)
+
+    def spill_output(self, node, result: Dict) -> Dict:
+        """
+        Called when `node` finished, returns the result to deliver to its downstream nodes 
+        (see `langdag.retention.OutputRefs.spill`).
+        """
+        if self.output_refs is None:
+            return result
+        return self.output_refs.spill(node, result)
+
+    def release_inputs(self, node) -> None:
+        """
+        Called when `node` is done, release the outputs it was the last to consume (see `OutputRetention`).
+        """
+        if self.output_refs is not None:
+            self.output_refs.consumed(node)
+
+    def close_retention(self) -> None:
+        """
+        Remove the outputs still spilled to disk at the end of the run.
+        """
+        if self.output_refs is not None:
+            self.output_refs.close()
+
+    def commit(self) -> None:
+        """
+        Copy node states and `dag_state` of this run to the nodes and the DAG,
+        so they can be read from `node.node_output`, `dag.dag_state` etc. after the run.
+        """
+        with _commit_lock:
+            for node, state in self.node_states.items():
+                for attr in RUN_ATTRIBUTES:
+                    setattr(node, attr, getattr(state, attr))
+            self.dag.dag_state.clear()
+            self.dag.dag_state.update(self.dag_state)
@@ -1,5 +1,7 @@
-from typing import Optional, Dict, Any, Callable
+from typing import Optional, Dict, List, Any, Callable
 from langdag import Node
+from langdag.cache import NodeCache
+from langdag.retry import RetryPolicy
 
 def make_node(  node_id: Optional[str] = None, 
                 node_desc: Optional[str | Dict | Any] = None,
@@ -7,6 +9,18 @@ def make_node(  node_id: Optional[str] = None,
                 spec: Optional[str | Dict | Any] = None,
                 func_desc: Optional[str | Dict | Any] = None,
                 func_set_dag_output_when: Optional[Callable[[str, Dict, Dict, Dict], bool]]=None,
+                run_in_process: bool = False,
+                cache: Optional[NodeCache] = None,
+                cache_keys: Optional[List] = None,
+                stream_input: bool = False,
+                func_aggregate: Optional[Callable[[List], Any]] = None,
+                func_batch_transform: Optional[Callable[[List], List]] = None,
+                duration_hint: Optional[float] = None,
+                resources: Optional[List[str]] = None,
+                retry_policy: Optional[RetryPolicy] = None,
+                speculative: bool = False,
+                reads: Optional[List] = None,
+                writes: Optional[List] = None,
                 ):
     """
     Use the `@make_node()` decorator above a transforming function to create a node from that function. 
@@ -17,6 +31,9 @@ def make_node(  node_id: Optional[str] = None,
     with the node's transformation logic, the `@make_node()` decorator has the same functionality as the `Node()` class. 
     It accepts the same parameters as `Node()`, except it uses the decorated function as `func_transform`, and the 
     `node_id` defaults to the name of the decorated function if not explicitly set.
+
+    The decorated function can be a plain function, an `async def` function, or a (async) generator function 
+    that streams its output.
     """
     def decorator(func_transform: Callable[[str, Dict, Dict], Any]):
         node = Node(
@@ -26,7 +43,19 @@ def make_node(  node_id: Optional[str] = None,
                 spec=spec,
                 func_desc=func_desc,
                 func_transform=func_transform,
-                func_set_dag_output_when=func_set_dag_output_when
+                func_set_dag_output_when=func_set_dag_output_when,
+                run_in_process=run_in_process,
+                cache=cache,
+                cache_keys=cache_keys,
+                stream_input=stream_input,
+                func_aggregate=func_aggregate,
+                func_batch_transform=func_batch_transform,
+                duration_hint=duration_hint,
+                resources=resources,
+                retry_policy=retry_policy,
+                speculative=speculative,
+                reads=reads,
+                writes=writes
         )
         return node
     return decorator
@@ -4,4 +4,28 @@ class ConflictConditionsError(Exception):
 
 
 class LangdagSyntaxError(Exception):
-    '''Exception when syntax not support'''
\ No newline at end of file
+    '''Exception when syntax not support'''
+
+class NodeTimeoutError(TimeoutError):
+    '''Exception when an attempt of a node exceeds the timeout of its `RetryPolicy`'''
+
+class StateConflictError(Exception):
+    '''Exception when nodes running in parallel write the same `dag_state` key, with `StateIsolation(on_conflict="raise")`'''
+
+class StateAccessError(Exception):
+    '''Exception when a node reads or writes a `dag_state` key it did not declare in `reads` or `writes`'''
+
+class MapElementError(Exception):
+    '''Exception of an element of a `MapNode` whose `func_map` failed, kept in the results with `on_error="keep"`'''
+    def __init__(self, node_id, index: int, item, error: BaseException) -> None:
+        super().__init__(f'Element {index} of map node "{node_id}" failed: {error!r}')
+        self.node_id = node_id
+        self.index = index
+        self.item = item
+        self.error = error
+
+    def __reduce__(self):
+        return (MapElementError, (self.node_id, self.index, self.item, self.error))
+
+class ServerOverloadedError(Exception):
+    '''Exception when a `DagServer` rejects a request because its queue is full, or sheds it after `queue_timeout`'''
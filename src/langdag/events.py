@@ -0,0 +1,98 @@
+from typing import Any, Optional
+import json
+import logging
+import reprlib
+import sys
+import threading
+
+# Logger of structured node events (`LangExecutor(log_format="json")`)
+event_log = logging.getLogger("langdag.events")
+
+_handler_lock = threading.Lock()
+
+
+class Payload():
+    """
+    A lazily formatted, truncated representation of a (possibly large) payload such as `node_output`.
+    Nothing is formatted until a log handler actually renders the record, and the representation is
+    bounded with `reprlib`, so a multi-kilobyte LLM response is never fully repr-ed.
+
+    Args:
+        obj (`Any`, *required*):
+            The payload.
+        limit (`int`, *optional*, defaults to `None`):
+            Maximum number of characters, no truncation when `None`.
+    """
+    __slots__ = ("obj", "limit")
+
+    def __init__(self, obj: Any, limit: Optional[int] = None) -> None:
+        self.obj = obj
+        self.limit = limit
+
+    def __str__(self) -> str:
+        if self.limit is None:
+            return str(self.obj)
+        if isinstance(self.obj, str):
+            text = self.obj
+        else:
+            text = _repr_of(self.limit).repr(self.obj)
+        if len(text) > self.limit:
+            return f"{text[:self.limit]}...(+{len(text) - self.limit} chars)"
+        return text
+
+    __repr__ = __str__
+
+
+def _repr_of(limit: int) -> reprlib.Repr:
+    bounded = reprlib.Repr()
+    bounded.maxstring = bounded.maxother = max(limit, 8)
+    bounded.maxlong = max(limit, 8)
+    bounded.maxlevel = 3
+    return bounded
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats node events as JSON lines: `{"ts": ..., "level": ..., "event": ..., "node_id": ..., ...}`.
+    Fields of an event are passed in `extra={"langdag": {...}}`, payloads (`Payload`) are rendered truncated.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        line = {"ts": round(record.created, 6), "level": record.levelname, "event": record.getMessage()}
+        for k, v in getattr(record, "langdag", {}).items():
+            line[k] = v if isinstance(v, (bool, int, float, type(None))) else str(v)
+        if record.exc_info:
+            line["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(line, ensure_ascii=False)
+
+
+def enable_json_logging(stream=None, level: int | str = logging.INFO) -> logging.Handler:
+    """
+    Write node events of `langdag.events` as JSON lines to `stream` (defaults to `sys.stderr`).
+    Called by `LangExecutor(log_format="json")` when `langdag.events` has no handler yet.
+    Returns the handler.
+    """
+    with _handler_lock:
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(JsonLinesFormatter())
+        event_log.addHandler(handler)
+        event_log.setLevel(level)
+        event_log.propagate = False
+    return handler
+
+
+def events_enabled() -> bool:
+    """
+    Returns whether structured node events are written, i.e. a handler is attached to `langdag.events`
+    (`enable_json_logging` or `LangExecutor(log_format="json")`). For events logged outside of `LangExecutor`,
+    which otherwise would reach the console handler of the root logger.
+    """
+    return bool(event_log.handlers) and event_log.isEnabledFor(logging.INFO)
+
+
+def log_event(event: str, node_id: Any, **fields) -> None:
+    """
+    Log a structured node event to `langdag.events`. Does nothing (not even building the record)
+    when the logger is not enabled for INFO.
+    """
+    if event_log.isEnabledFor(logging.INFO):
+        event_log.info(event, extra={"langdag": {"node_id": node_id, **fields}})
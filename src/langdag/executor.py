@@ -1,7 +1,11 @@
 from typing import List, Set, Dict, Tuple, Optional, Any, Callable
-import copy
-from langdag.utils import merge_dicts
+from concurrent.futures import Executor
+import time
+from langdag.utils import merge_dicts, call_sync, call_async
 from langdag.error import ConflictConditionsError
+from langdag.context import RunContext, add_elapsed
+from langdag.events import Payload, event_log, enable_json_logging, log_event
+from langdag.retry import RetryPolicy
 from rich import print
 
 import logging
@@ -30,48 +34,205 @@ class LangExecutor:
         func_finish_hook (`Callable`, *optional*, defaults to `None`):
             A function accepts node_id, node_desc, execution_state, node_output and do something 
             customizable before a node execute.
+        func_cache_hook (`Callable`, *optional*, defaults to `None`):
+            A function accepts node_id, node_desc, cache_hit (`True` for a hit, `False` for a miss), called after 
+            a node with a `cache` finishes.
+        log_format (`str`, *optional*, defaults to `"rich"`):
+            `"rich"` prints colored log lines to the console, `"json"` logs structured node events
+            (node_id, state, duration, truncated payloads) to the `langdag.events` logger, as JSON lines
+            to stderr unless a handler is already attached (see `langdag.events.JsonLinesFormatter`).
+        max_payload_chars (`int`, *optional*, defaults to `None`):
+            Truncate `upstream_output` and `node_output` in log lines to this many characters,
+            defaults to 200 with `log_format="json"` and no truncation with `"rich"`.
+        retry_policy (`RetryPolicy`, *optional*, defaults to `None`):
+            Timeout, retries and hedging of nodes without a `retry_policy` of their own (see `langdag.retry.RetryPolicy`).
+            Without any policy, an exception of a node stops the run.
+
+        Hooks can be plain functions or `async def` functions.
  """
     def __init__(
             self,
             verbose: bool = True,
             func_start_hook: Optional[Callable[[str, str], Any]] = None,
             func_finish_hook: Optional[Callable[[str, str, Dict, Any], Any]] = None,
+            func_cache_hook: Optional[Callable[[str, str, bool], Any]] = None,
+            log_format: str = "rich",
+            max_payload_chars: Optional[int] = None,
+            retry_policy: Optional[RetryPolicy] = None,
         ) -> None:
+        if log_format not in ("rich", "json"):
+            raise ValueError(f'log_format should be "rich" or "json", got {log_format!r}')
         self.__upstream_output: Dict = {}
         self.verbose = verbose
         self.func_start_hook = func_start_hook
         self.func_finish_hook= func_finish_hook
+        self.func_cache_hook = func_cache_hook
+        self.log_format = log_format
+        self.retry_policy = retry_policy
+        self.max_payload_chars = max_payload_chars if max_payload_chars or log_format == "rich" else 200
+        if log_format == "json" and not event_log.handlers:
+            enable_json_logging()
+
+    @property
+    def _rich(self) -> bool:
+        '''Whether to print rich log lines'''
+        return self.verbose and self.log_format == "rich"
+
+    @property
+    def _json(self) -> bool:
+        '''Whether to log structured node events'''
+        return self.verbose and self.log_format == "json"
+
+    def __payload(self, obj) -> Payload:
+        return Payload(obj, self.max_payload_chars)
+
+    @staticmethod
+    def __mark(state, attr: str, value: float):
+        '''Record `value` as the `attr` ("ready", "start" or "end") of the timing of `state`'''
+        timing = getattr(state, "timing", None)
+        if timing is not None:
+            setattr(timing, attr, value)
 
-    def param(self, vertex):
+    def __log_executed(self, vertex, state, started: float, error: Optional[BaseException] = None):
+        self.__mark(state, "end", time.perf_counter())
+        if self._json:
+            log_event("node_error" if error else "node_executed", 
+                      vertex.node_id, 
+                      state=state.execution_state, 
+                      duration_ms=round((time.perf_counter() - started) * 1000, 3), 
+                      upstream_output=self.__payload(state.upstream_output), 
+                      node_output=self.__payload(state.node_output), 
+                      cache_hit=state.cache_hit, 
+                      error=repr(error) if error else None)
+
+    def __run_state(self, vertex, context: Optional[RunContext] = None):
+        '''Returns the run state of `vertex` and the upstream outputs delivered so far (per run if `context` is given)'''
+        if context is None:
+            return vertex, self.__upstream_output
+        return context.state_of(vertex), context.upstream_output
+
+    def __upstream_of(self, vertex, context: Optional[RunContext] = None) -> Dict:
+        '''Returns a copy of the upstream outputs delivered to `vertex`'''
+        if context is not None:
+            return context.upstream_of(vertex)
+        # without a run context, the outputs are consumed here, so they do not pile up across runs
+        return self.__upstream_output.pop(vertex, None) or {}
+
+    def param(self, vertex, context: Optional[RunContext] = None):
         node_itself = vertex
-        node_upstream_output = copy.copy(self.__upstream_output.get(vertex, None)) or {}
-        return (node_itself, node_upstream_output)
+        node_upstream_output = self.__upstream_of(vertex, context)
+        return (node_itself, node_upstream_output, context)
 
     def execute(self, param):
-        node_itself, node_upstream_output = param
-        node_itself.upstream_output = node_upstream_output
+        node_itself, node_upstream_output, context = param
+        state, _ = self.__run_state(node_itself, context)
+        state.upstream_output = node_upstream_output
 
-        
+        if self._rich : 
+            log.info("   (2) [bold yellow]->o[/] [bold yellow]%s[/] received upstream: %s", 
+                     node_itself.node_id, self.__payload(node_upstream_output), 
+                     extra={"markup": True})
+
+        started = time.perf_counter()
+        self.__mark(state, "start", started)
+        try:
+            node_itself.run_node(verbose = self._rich, 
+                                 func_start_hook=self.func_start_hook, 
+                                 context=context, 
+                                 retry_policy=self.retry_policy)
+        except BaseException as e:
+            self.__close_stream(state, e)
+            self.__log_executed(node_itself, state, started, e)
+            raise
+        self.__close_stream(state, state.error)
+        self.__log_executed(node_itself, state, started, state.error)
+
+        if self._rich : 
+            log.info("     (3) [bold yellow]o->[/] [bold yellow]%s[/] output: %s", 
+                     node_itself.node_id, 
+                     self.__payload(state.node_output), 
+                     extra={"markup": True})
+
+        return {node_itself.node_id : state.node_output}
+
+    async def aexecute(self, param, thread_pool: Optional[Executor] = None):
+        '''Async version of `execute`, used by `arun_dag`'''
+        node_itself, node_upstream_output, context = param
+        state, _ = self.__run_state(node_itself, context)
+        state.upstream_output = node_upstream_output
 
-        if self.verbose : 
+        if self._rich : 
             log.info("   (2) [bold yellow]->o[/] [bold yellow]%s[/] received upstream: %s", 
-                     node_itself.node_id, node_upstream_output, 
+                     node_itself.node_id, self.__payload(node_upstream_output), 
                      extra={"markup": True})
 
-        node_itself.run_node(verbose = self.verbose, func_start_hook=self.func_start_hook)
+        started = time.perf_counter()
+        self.__mark(state, "start", started)
+        try:
+            await node_itself.arun_node(verbose = self._rich,
+                                        func_start_hook=self.func_start_hook,
+                                        context=context,
+                                        thread_pool=thread_pool,
+                                        retry_policy=self.retry_policy)
+        except BaseException as e:
+            self.__close_stream(state, e)
+            self.__log_executed(node_itself, state, started, e)
+            raise
+        self.__close_stream(state, state.error)
+        self.__log_executed(node_itself, state, started, state.error)
 
-        if self.verbose : 
+        if self._rich : 
             log.info("     (3) [bold yellow]o->[/] [bold yellow]%s[/] output: %s", 
                      node_itself.node_id, 
-                     node_itself.node_output, 
+                     self.__payload(state.node_output), 
                      extra={"markup": True})
 
-        return {node_itself.node_id : node_itself.node_output}
+        return {node_itself.node_id : state.node_output}
     
+    def execute_batch(self, vertex, contexts: List[RunContext]) -> List[Dict]:
+        '''Execute `vertex` in many runs at once, used by `run_dag_batch`. Returns the result of each run.'''
+        states = []
+        for context in contexts:
+            state, _ = self.__run_state(vertex, context)
+            state.upstream_output = self.__upstream_of(vertex, context)
+            states.append(state)
+
+        if self._rich :
+            log.info("   (2) [bold yellow]->o[/] [bold yellow]%s[/] received upstream of %s inputs",
+                     vertex.node_id, len(contexts),
+                     extra={"markup": True})
+
+        started = time.perf_counter()
+        for state in states:
+            self.__mark(state, "start", started)
+        try:
+            vertex.run_node_batch(contexts, 
+                                  verbose=self._rich, 
+                                  func_start_hook=self.func_start_hook, 
+                                  retry_policy=self.retry_policy)
+        except BaseException as e:
+            for state in states:
+                self.__close_stream(state, e)
+                self.__log_executed(vertex, state, started, e)
+            raise
+        for state in states:
+            self.__close_stream(state, state.error)
+            self.__log_executed(vertex, state, started, state.error)
+
+        return [{vertex.node_id : state.node_output} for state in states]
+
+    @staticmethod
+    def __close_stream(state, error: Optional[BaseException] = None):
+        '''Close the output stream of a streaming node, so downstream nodes iterating it stop waiting'''
+        if getattr(state, "node_stream", None) is not None:
+            state.node_stream.close(error)
+
     def report_start(self, vertices):
         '''Report the start state'''
         for vertex in vertices:
-            if self.verbose : 
+            if self._json:
+                log_event("node_start", vertex.node_id)
+            if self._rich : 
                 log.info("[dim]━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━[/] \n(1) [bold red]%s START[/]", 
                          vertex, 
                          extra={"markup": True})
@@ -79,31 +240,96 @@ class LangExecutor:
             # if self.func_start_hook:
             #     self.func_start_hook(vertex.node_id, vertex.node_desc)
 
-    def report_finish(self, vertices_result: Tuple):
+    def __log_finish(self, vertex, state, node_output):
+        if self._json:
+            error = getattr(state, "error", None)
+            log_event("node_finish", vertex.node_id, state=state.execution_state, cache_hit=state.cache_hit, 
+                      error=repr(error) if error else None, restored=getattr(state, "restored", False))
+        if self._rich:
+            if state.cache_hit is not None:
+                log.info("       (4) [bold yellow]%s[/] cache %s", 
+                         vertex.node_id, 
+                         "[bold green]hit[/]" if state.cache_hit else "[bold red]miss[/]", 
+                         extra={"markup": True})
+            if getattr(state, "restored", False):
+                log.info('       (4) [bold yellow]√[/] [bold yellow]%s[/] restored from checkpoint, Output: %s', 
+                         vertex.node_id, self.__payload(node_output), 
+                         extra={"markup": True})
+            elif state.execution_state == "failed":
+                log.info('      (4) [bold red]! %s failed:[/] %r', 
+                         vertex.node_id, 
+                         state.error, 
+                         extra={"markup": True})
+            elif state.execution_state != "aborted":
+                log.info('       (4) [bold yellow]√[/] [bold yellow]%s[/] finished: Execution state `%s`, Output: %s', 
+                         vertex.node_id, state.execution_state, self.__payload(node_output), 
+                         extra={"markup": True})
+            else:
+                log.info('      (4) [bold purple]X %s aborted![/]', 
+                         vertex.node_id, 
+                         extra={"markup": True})
+
+    def report_finish(self, vertices_result: Tuple, context: Optional[RunContext] = None):
         for vertex, node_output in vertices_result:
-            if self.verbose:
-                if vertex.execution_state != "aborted":
-                    log.info('       (4) [bold yellow]√[/] [bold yellow]{0}[/] finished: Execution state `{1}`, Output: {2}'.format(vertex.node_id, vertex.execution_state, node_output), extra={"markup": True})
-                else:
-                    log.info(f'      (4) [bold purple]X {vertex.node_id} aborted![/]', 
-                             extra={"markup": True})
+            state, _ = self.__run_state(vertex, context)
+            self.__log_finish(vertex, state, node_output)
+            if getattr(state, "restored", False):
+                # hooks of restored nodes were called in the run resumed
+                continue
 
+            started = time.perf_counter()
+            if self.func_cache_hook and state.cache_hit is not None:
+                call_sync(self.func_cache_hook, vertex.node_id, state.node_desc, state.cache_hit)
             if self.func_finish_hook:
-                self.func_finish_hook(vertex.node_id, vertex.node_desc, vertex.execution_state, node_output)
+                call_sync(self.func_finish_hook, vertex.node_id, state.node_desc, state.execution_state, node_output)
+            if self.func_cache_hook or self.func_finish_hook:
+                add_elapsed(state, "hook_time", started)
 
-    def deliver(self, vertex, v_to, result: Dict):
-        if v_to.node_id in vertex.downstream_execution_condition.keys():
-            v_to.conditional_excecution = True
+    async def areport_finish(self, vertices_result: Tuple, context: Optional[RunContext] = None):
+        '''Async version of `report_finish`, awaits `func_finish_hook` if it is an `async def` function'''
+        for vertex, node_output in vertices_result:
+            state, _ = self.__run_state(vertex, context)
+            self.__log_finish(vertex, state, node_output)
+            if getattr(state, "restored", False):
+                # hooks of restored nodes were called in the run resumed
+                continue
+
+            started = time.perf_counter()
+            if self.func_cache_hook and state.cache_hit is not None:
+                await call_async(self.func_cache_hook, vertex.node_id, state.node_desc, state.cache_hit, offload=False)
+            if self.func_finish_hook:
+                await call_async(self.func_finish_hook, vertex.node_id, state.node_desc, state.execution_state, node_output, 
+                                 offload=False)
+            if self.func_cache_hook or self.func_finish_hook:
+                add_elapsed(state, "hook_time", started)
+
+    def deliver(self, vertex, v_to, result: Dict, context: Optional[RunContext] = None):
+        state, _ = self.__run_state(vertex, context)
+        state_to, upstream_output = self.__run_state(v_to, context)
+        # With a `context`, conditions are already resolved in its compiled plan (dag.compile())
+        if context is None and v_to.node_id in vertex.downstream_execution_condition.keys():
+            state_to.conditional_excecution = True
             if isinstance(vertex.downstream_execution_condition[v_to.node_id], list):
                 raise ConflictConditionsError(f'Conflict conditional edges from {vertex.node_id} to {v_to.node_id}', 
                                               vertex.downstream_execution_condition[v_to.node_id])
-            v_to.execution_condition = merge_dicts(v_to.execution_condition, 
-                                                   vertex.downstream_execution_condition[v_to.node_id])
+            state_to.execution_condition = merge_dicts(state_to.execution_condition, 
+                                                       vertex.downstream_execution_condition[v_to.node_id])
         
-        v_to.upstream_execution_state.update({vertex.node_id: vertex.execution_state})
+        state_to.upstream_execution_state.update({vertex.node_id: state.execution_state})
+        self.__mark(state_to, "ready", time.perf_counter())
         
         if result != {vertex.node_id: None}:
-            if self.__upstream_output.get(v_to, None):
-                self.__upstream_output[v_to].update(result)
+            if upstream_output.get(v_to, None):
+                upstream_output[v_to].update(result)
             else:
-                self.__upstream_output[v_to] = result
+                upstream_output[v_to] = dict(result)
+
+    def deliver_stream(self, vertex, v_to, stream, context: Optional[RunContext] = None):
+        '''Deliver the output stream of `vertex` to `v_to` (with `stream_input=True`) before `vertex` finishes'''
+        state_to, upstream_output = self.__run_state(v_to, context)
+        state_to.upstream_execution_state.update({vertex.node_id: "streaming"})
+        self.__mark(state_to, "ready", time.perf_counter())
+        if upstream_output.get(v_to, None):
+            upstream_output[v_to][vertex.node_id] = stream
+        else:
+            upstream_output[v_to] = {vertex.node_id: stream}
@@ -0,0 +1,124 @@
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional, Set, Tuple
+import threading
+from langdag.cache import make_cache_key
+from langdag.state import TrackedState, _MISSING
+
+
+class NodeRecord(NamedTuple):
+    '''What a node read and produced the last time it executed'''
+    key: str
+    # key of the prompt and the dag_state values read, without upstream outputs
+    state_key: str
+    func: Optional[Callable]
+    reads: Tuple
+    writes: Dict[Any, Any]
+    deletes: Tuple
+    output: Any
+
+
+class IncrementalState():
+    """
+    Dependencies and outputs of the nodes of a DAG in its last incremental run (`run_dag(..., incremental=True)`),
+    kept in `dag.incremental`. In the next incremental run, a node whose `prompt`, `func_transform`,
+    (filtered) `upstream_output` and values of the `dag_state` keys it read (including `"input"`) did not change
+    reuses its last output, and its writes to `dag_state` are replayed, instead of executing. Nodes whose output
+    changes invalidate their downstream nodes through their `upstream_output`.
+    """
+    def __init__(self) -> None:
+        self.records: Dict[Any, NodeRecord] = {}
+        # node_ids to execute again in the next incremental run, whatever their inputs
+        self.dirty: Set[Any] = set()
+        # node_ids executed (not reused) in the last incremental run
+        self.executed: Set[Any] = set()
+        # dag_state keys written by nodes of the last run: value before the run, value after
+        self.__before: Dict[Any, Any] = {}
+        self.__after: Dict[Any, Any] = {}
+        self.__lock = threading.Lock()
+
+    def invalidate(self, node_ids: Iterable[Any]) -> None:
+        """
+        Execute these nodes again in the next incremental run, e.g. when an external tool result changed.
+        """
+        with self.__lock:
+            self.dirty.update(node_ids)
+
+    def clear(self) -> None:
+        """
+        Forget all records, the next incremental run executes every node.
+        """
+        with self.__lock:
+            self.records.clear()
+            self.dirty.clear()
+
+    def prepare(self, dag_state: Dict) -> None:
+        """
+        Called at the start of an incremental run with its `dag_state`: keys written by nodes in the last run get
+        back the value they had before it (unless changed since), so nodes read the same `dag_state` as last time.
+        """
+        with self.__lock:
+            for k, after in self.__after.items():
+                if dag_state.get(k, _MISSING) is not after:
+                    continue
+                if self.__before[k] is _MISSING:
+                    dag_state.pop(k, None)
+                else:
+                    dag_state[k] = self.__before[k]
+            self.__before.clear()
+            self.__after.clear()
+            self.executed = set()
+
+    def __on_write(self, key, before, after) -> None:
+        with self.__lock:
+            self.__before.setdefault(key, before)
+            self.__after[key] = after
+
+    def lookup(self, node, upstream_output: Dict, dag_state: Dict) -> Tuple[bool, Any]:
+        """
+        Returns whether `node` can reuse its last output, and that output. On reuse, its writes are replayed to `dag_state`.
+        """
+        record = self.records.get(node.node_id)
+        if record is None or node.node_id in self.dirty or record.func is not node.func_transform:
+            return False, None
+        key = make_cache_key(node.node_id, node.prompt, upstream_output, dag_state, record.reads)
+        if key is None or key != record.key:
+            return False, None
+        for k, v in record.writes.items():
+            self.__on_write(k, dag_state.get(k, _MISSING), v)
+            dag_state[k] = v
+        for k in record.deletes:
+            if k in dag_state:
+                self.__on_write(k, dag_state[k], _MISSING)
+                del dag_state[k]
+        return True, record.output
+
+    def likely_reused(self, node, dag_state: Dict) -> bool:
+        """
+        Returns whether `node` will reuse its last output unless its upstream outputs changed, used to skip
+        speculative transforms that would be discarded.
+        """
+        record = self.records.get(node.node_id)
+        if record is None or node.node_id in self.dirty or record.func is not node.func_transform:
+            return False
+        return make_cache_key(node.node_id, node.prompt, {}, dag_state, record.reads) == record.state_key
+
+    def track(self, dag_state: Dict) -> TrackedState:
+        """
+        Returns the view of `dag_state` to give to the transform of a node executing, recording its reads and writes.
+        """
+        return TrackedState(dag_state, on_write=self.__on_write)
+
+    def record(self, node, upstream_output: Dict, tracked: TrackedState, output: Any) -> None:
+        """
+        Record the inputs (as read through `tracked`) and the output of `node` that just executed.
+        """
+        reads = tuple(tracked.reads)
+        key = make_cache_key(node.node_id, node.prompt, upstream_output, tracked.reads, reads)
+        state_key = make_cache_key(node.node_id, node.prompt, {}, tracked.reads, reads)
+        with self.__lock:
+            self.executed.add(node.node_id)
+            self.dirty.discard(node.node_id)
+            if key is None:
+                self.records.pop(node.node_id, None)
+                return
+            self.records[node.node_id] = NodeRecord(key, state_key, node.func_transform, reads, dict(tracked.writes),
+                                                    tuple(tracked.deletes), output)
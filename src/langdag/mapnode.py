@@ -0,0 +1,271 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextvars import ContextVar
+import asyncio
+
+from langdag import LangDAG, Node, arun_dag
+from langdag.context import RunContext
+from langdag.error import LangdagSyntaxError, MapElementError
+from langdag.events import events_enabled, log_event
+from langdag.executor import LangExecutor
+from langdag.retry import RetryPolicy
+from langdag.utils import call_async
+
+_ON_ERROR = ("keep", "skip", "raise")
+
+# Slots of the selector left to the elements of a `MapNode` and thread pool of the run it transforms in
+_map_run: ContextVar[Tuple[Optional[int], Optional[Executor]]] = ContextVar("langdag_map_run", default=(None, None))
+
+
+def selector_limit(selector) -> Optional[int]:
+    '''
+    Returns the maximum number of nodes `selector` runs concurrently (`MaxSelector`, `CriticalPathSelector`),
+    None when unlimited (`FullSelector`) or unknown.
+    '''
+    for name in ("max_cocurrent", "max_concurrent"):
+        limit = getattr(selector, name, None)
+        if limit is not None:
+            return limit
+    return None
+
+
+class MapNode(Node):
+    """
+    A node mapping `func_map` over a list known only at runtime (e.g. the documents found by an upstream node):
+    every element runs as its own sub-execution, in parallel, and the node output is the list of their results,
+    in the order of the elements, for the downstream (reduce) nodes.
+
+    At most `max_concurrency` elements run at the same time, and never more than the selector of the run allows
+    nodes (`MaxSelector(N)`) minus the other nodes running when the map starts, so a long list does not flood
+    a rate-limited API.
+    A failed element does not fail the others: it is retried with `element_retry_policy`, then kept in the results
+    as a `MapElementError` (`on_error="keep"`), left out (`"skip"`), or fails the node (`"raise"`).
+
+    Example:
+        with LangDAG(query) as dag:
+            search = Node("search", func_transform=find_documents)
+            summarize = MapNode("summarize",
+                                func_map=lambda prompt, document, upstream_output, dag_state: summarize(document),
+                                max_concurrency=8)
+            merge = Node("merge", func_transform=lambda prompt, upstream_output, dag_state:
+                         "\\n".join(upstream_output["summarize"]))
+            dag += search
+            dag += summarize
+            dag += merge
+            search >> summarize >> merge
+
+    Args:
+        node_id (`Any`, *required*`):
+            A unique identifier for the node.
+        func_map (`Callable | LangDAG`, *required*`):
+            A function of `prompt`, an element, `upstream_output` and `dag_state` returning the result of the element,
+            or a `LangDAG` run with the element as `dag_input` (its output is the result of the element).
+        func_items (`Callable`, *optional*, defaults to `None`):
+            A function of `prompt`, `upstream_output` and `dag_state` returning the elements. By default,
+            the output of the upstream node, or `dag_state["input"]` if there is none.
+        max_concurrency (`int`, *optional*, defaults to `None`):
+            Maximum number of elements running concurrently, only bounded by the selector of the run when `None`.
+        on_error (`str`, *optional*, defaults to `"keep"`):
+            What to do with a failed element: `"keep"` its `MapElementError` in the results, `"skip"` it,
+            or `"raise"` its `MapElementError`, failing the node (the elements not started yet are cancelled).
+        element_retry_policy (`RetryPolicy`, *optional*, defaults to `None`):
+            Timeout, retries and hedging of each element, logged as `"<node_id>[<index>]"`.
+        node_desc, prompt, spec, func_desc, func_set_dag_output_when, cache, cache_keys, duration_hint, resources,
+        retry_policy, speculative, reads, writes:
+            Same as in `Node`. `retry_policy` retries the whole map, `element_retry_policy` the failed elements.
+
+    `func_map` and `func_items` can be plain functions, run in the thread pool of the run (the `thread_pool` of
+    `arun_dag`, the worker threads of a `MultiThreadProcessor`, or a pool of `max_concurrency` threads of the node
+    without one), or `async def` functions, awaited on an event loop. With a `MultiThreadProcessor(max_workers=N)`,
+    the node waits for its elements in one of the N worker threads.
+    """
+    def __init__(
+            self,
+            node_id: str,
+            func_map: Callable[[Any, Any, Dict, Dict], Any] | LangDAG,
+            func_items: Optional[Callable[[Any, Dict, Dict], List]] = None,
+            max_concurrency: Optional[int] = None,
+            on_error: str = "keep",
+            element_retry_policy: Optional[RetryPolicy] = None,
+            node_desc: Optional[str | Dict | Any] = None,
+            prompt: Optional[str | Dict | Any] = None,
+            spec: Optional[Dict | Any] = None,
+            func_desc: Optional[str | Dict | Any] = None,
+            func_set_dag_output_when: Optional[Callable[[str, Dict, Dict, Dict], bool]] = None,
+            cache=None,
+            cache_keys: Optional[List] = None,
+            duration_hint: Optional[float] = None,
+            resources: Optional[List[str]] = None,
+            retry_policy: Optional[RetryPolicy] = None,
+            speculative: bool = False,
+            reads: Optional[List] = None,
+            writes: Optional[List] = None
+        ) -> None:
+        if on_error not in _ON_ERROR:
+            raise ValueError(f'on_error should be "keep", "skip" or "raise", got {on_error!r}')
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f'max_concurrency should be at least 1, got {max_concurrency!r}')
+        super().__init__(node_id,
+                         node_desc=node_desc,
+                         prompt=prompt,
+                         spec=spec,
+                         func_desc=func_desc,
+                         func_set_dag_output_when=func_set_dag_output_when,
+                         cache=cache,
+                         cache_keys=cache_keys,
+                         duration_hint=duration_hint,
+                         resources=resources,
+                         retry_policy=retry_policy,
+                         speculative=speculative,
+                         reads=reads,
+                         writes=writes)
+        self.func_map = func_map
+        self.func_items = func_items
+        self.max_concurrency = max_concurrency
+        self.on_error = on_error
+        self.element_retry_policy = element_retry_policy
+
+    @property
+    def func_map(self) -> Callable[[Any, Any, Dict, Dict], Any] | LangDAG:
+        return self.__func_map
+
+    @func_map.setter
+    def func_map(self, func_map: Callable[[Any, Any, Dict, Dict], Any] | LangDAG) -> None:
+        if not callable(func_map) and not isinstance(func_map, LangDAG):
+            raise LangdagSyntaxError(f'func_map of {self.node_id} should be a function or a `LangDAG`')
+        self.__func_map = func_map
+        # a new `func_transform` for every `func_map`, so an incremental run does not reuse outputs of the old one
+        self.func_transform = self.__fan_out
+
+    def concurrency(self, items: int, selector_bound: Optional[int] = None) -> int:
+        """
+        Returns how many of `items` elements run concurrently,
+        with `selector_bound` the number of nodes the selector of the run allows.
+        """
+        bounds = [bound for bound in (self.max_concurrency, selector_bound) if bound is not None]
+        return max(1, min([items, *bounds]))
+
+    def __default_items(self, upstream_output: Dict, dag_state: Dict) -> Any:
+        if not upstream_output:
+            return dag_state["input"]
+        if len(upstream_output) == 1:
+            return next(iter(upstream_output.values()))
+        raise LangdagSyntaxError(f'MapNode {self.node_id} has several upstream nodes, set `func_items` to select the elements')
+
+    async def __map_element(self, index: int, item: Any, prompt: Any, upstream_output: Dict, dag_state: Dict,
+                            thread_pool: Executor) -> Any:
+        """
+        Returns the result of `func_map` for one element, with `element_retry_policy`.
+        """
+        func_map = self.func_map
+        if isinstance(func_map, LangDAG):
+            async def run_element():
+                context = RunContext(func_map, dag_input=item)
+                await arun_dag(func_map, executor=LangExecutor(verbose=False), progressbar=False,
+                               thread_pool=thread_pool, context=context)
+                return context.dag_state["output"]
+        else:
+            def run_element():
+                return call_async(func_map, prompt, item, upstream_output, dag_state, thread_pool=thread_pool)
+        if self.element_retry_policy is None:
+            return await run_element()
+        return await self.element_retry_policy.acall(run_element, f"{self.node_id}[{index}]")
+
+    async def __fan_out(self, prompt: Any, upstream_output: Dict, dag_state: Dict) -> List:
+        """
+        `func_transform` of the node: run `func_map` for every element, bounded, and return the results in order.
+        """
+        if self.func_items is None:
+            items = self.__default_items(upstream_output, dag_state)
+        else:
+            items = await call_async(self.func_items, prompt, upstream_output, dag_state)
+        items = list(items or [])
+        if not items:
+            return []
+        selector_bound, run_thread_pool = _map_run.get()
+        limit = self.concurrency(len(items), selector_bound)
+        slots = asyncio.Semaphore(limit)
+        failed = asyncio.Event()
+
+        async def map_element(index: int, item: Any, thread_pool: Executor) -> Any:
+            async with slots:
+                if failed.is_set():
+                    # `on_error="raise"`: an element failed, do not start the others
+                    raise asyncio.CancelledError()
+                try:
+                    return await self.__map_element(index, item, prompt, upstream_output, dag_state, thread_pool)
+                except Exception as e:
+                    if events_enabled():
+                        log_event("map_element_failed", self.node_id, index=index, error=repr(e))
+                    if self.on_error == "raise":
+                        failed.set()
+                    return MapElementError(self.node_id, index, item, e)
+
+        async def map_elements(thread_pool: Executor) -> List:
+            tasks = [asyncio.ensure_future(map_element(index, item, thread_pool)) for index, item in enumerate(items)]
+            try:
+                return await asyncio.gather(*tasks, return_exceptions=True)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        if run_thread_pool is not None:
+            results = await map_elements(run_thread_pool)
+        else:
+            with ThreadPoolExecutor(max_workers=limit, thread_name_prefix="langdag-map") as thread_pool:
+                results = await map_elements(thread_pool)
+        errors = [result for result in results if isinstance(result, MapElementError)]
+        if errors and self.on_error == "raise":
+            raise errors[0] from errors[0].error
+        if self.on_error == "skip":
+            return [result for result in results if not isinstance(result, MapElementError)]
+        return results
+
+    def __map_run(self, context: Optional[RunContext], thread_pool: Optional[Executor]):
+        selector_bound = selector_limit(getattr(context, "selector", None))
+        running = getattr(context, "running", None)
+        if selector_bound is not None and running:
+            # the other running nodes keep their slots, the node itself runs one of the elements
+            selector_bound -= len(running) - (self in running)
+        return _map_run.set((selector_bound, thread_pool))
+
+    @staticmethod
+    def __processor_pool(context: Optional[RunContext]) -> Optional[Executor]:
+        return getattr(getattr(context, "processor", None), "thread_pool", None)
+
+    def transform(self, context: Optional[RunContext] = None, retry_policy: Optional[RetryPolicy] = None,
+                  verbose: bool = False) -> Any:
+        """
+        Same as `Node.transform`, with the elements bounded by the selector of the run
+        and run in the worker threads of its processor.
+        """
+        token = self.__map_run(context, self.__processor_pool(context))
+        try:
+            return super().transform(context, retry_policy, verbose)
+        finally:
+            _map_run.reset(token)
+
+    async def atransform(self, context: Optional[RunContext] = None, thread_pool: Optional[Executor] = None,
+                         retry_policy: Optional[RetryPolicy] = None, verbose: bool = False) -> Any:
+        """
+        Async version of `transform`.
+        """
+        token = self.__map_run(context, thread_pool)
+        try:
+            return await super().atransform(context, thread_pool, retry_policy, verbose)
+        finally:
+            _map_run.reset(token)
+
+    def speculate(self, context: RunContext):
+        token = self.__map_run(context, self.__processor_pool(context))
+        try:
+            return super().speculate(context)
+        finally:
+            _map_run.reset(token)
+
+    async def aspeculate(self, context: RunContext, thread_pool: Optional[Executor] = None):
+        token = self.__map_run(context, thread_pool)
+        try:
+            return await super().aspeculate(context, thread_pool)
+        finally:
+            _map_run.reset(token)
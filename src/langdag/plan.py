@@ -0,0 +1,125 @@
+from typing import Dict, Optional, Tuple, Any
+from langdag.error import ConflictConditionsError
+from langdag.stream import is_streaming_transform
+from langdag.condition import Conditions
+
+
+def resolve_conditions(node, upstream_nodes) -> Dict[Any, Any]:
+    """
+    Returns the conditions on the edges from `upstream_nodes` into `node`, as `{upstream node_id: condition}`.
+    """
+    conditions = {}
+    for vertex in upstream_nodes:
+        if node.node_id in vertex.downstream_execution_condition.keys():
+            if isinstance(vertex.downstream_execution_condition[node.node_id], list):
+                raise ConflictConditionsError(f'Conflict conditional edges from {vertex.node_id} to {node.node_id}',
+                                              vertex.downstream_execution_condition[node.node_id])
+            conditions.update(vertex.downstream_execution_condition[node.node_id])
+    return conditions
+
+
+class ExecutionPlan():
+    """
+    A compiled, reusable execution plan of a `LangDAG` (created by `dag.compile()`).
+    Topology is frozen into integer node ids, so a run only copies `indegree` and indexes into the tuples below.
+
+    Attributes:
+        nodes (`Tuple[Node]`): nodes of the DAG, the position of a node is its integer id.
+        index (`Dict[Node, int]`): integer id of each node.
+        successors (`Tuple[Tuple[int]]`): integer ids of the successors of each node.
+        predecessors (`Tuple[Tuple[int]]`): integer ids of the predecessors of each node.
+        indegree (`Tuple[int]`): initial indegree of each node.
+        starts (`Tuple[int]`): integer ids of the starting nodes.
+        terminals (`Tuple[int]`): integer ids of the terminating nodes.
+        is_terminal (`Tuple[bool]`): whether each node is a terminating node.
+        levels (`Tuple[Tuple[int]]`): integer ids of the nodes in topological generations, a node only depends on
+            nodes of earlier levels.
+        execution_condition (`Tuple[Dict]`): conditions on the edges into each node, as `{upstream node_id: condition}`.
+        conditions (`Tuple[Conditions]`): the conditions on the edges into each node compiled into predicates.
+        streaming (`Tuple[bool]`): whether each node streams its output (generator `func_transform`).
+        stream_successors (`Tuple[Tuple[int]]`): integer ids of the successors each node streams its output to,
+            i.e. successors with `stream_input=True` on unconditional edges.
+        sets_output (`Tuple[bool]`): whether each node sets the output of its DAG when not aborted, i.e. it terminates
+            the DAG or the sub-DAG it belongs to.
+        upstream_alias (`Tuple[Optional[Dict]]`): for the nodes of sub-DAGs, the node_id each upstream node_id is 
+            given to the node as (see `langdag.subdag.SubDag`), upstream nodes not in it are not given. None for 
+            other nodes.
+        scope (`Tuple[Optional[int]]`): for the nodes of sub-DAGs, the integer id of the input node of the sub-DAG 
+            whose `dag_state` they use, None for nodes using the `dag_state` of the run.
+        sub_input (`Tuple[Optional[int]]`): for `SubDag` nodes, the integer id of their input node.
+        subplans (`Tuple[Tuple[SubDag, ExecutionPlan]]`): the plans of the sub-DAGs expanded in this plan.
+
+    Nodes of sub-DAGs (`langdag.subdag.SubDag`) are expanded into the plan, so they are scheduled like the others.
+    """
+    def __init__(self, dag) -> None:
+        # read the graph of `paradag` directly, `dag.successors` validates the node against a copy of all nodes
+        graph, graph_reverse = dag._DAG__data._dagData__graph, dag._DAG__data._dagData__graph_reverse
+        from langdag.subdag import SubDag, expand_subdags
+        expansion = None
+        if any(isinstance(node, SubDag) for node in graph):
+            expansion = expand_subdags(dag, graph, graph_reverse)
+            graph, graph_reverse = expansion.graph, expansion.graph_reverse
+        nodes = tuple(graph)
+        index = {node: i for i, node in enumerate(nodes)}
+
+        self.nodes: Tuple = nodes
+        self.index: Dict[Any, int] = index
+        self.successors: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(index[v_to] for v_to in graph[node]) for node in nodes)
+        self.predecessors: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(index[v_from] for v_from in graph_reverse[node]) for node in nodes)
+        self.indegree: Tuple[int, ...] = tuple(len(x) for x in self.predecessors)
+        self.starts: Tuple[int, ...] = tuple(i for i, x in enumerate(self.indegree) if x == 0)
+        self.terminals: Tuple[int, ...] = tuple(i for i, x in enumerate(self.successors) if not x)
+        self.is_terminal: Tuple[bool, ...] = tuple(not x for x in self.successors)
+        self.levels: Tuple[Tuple[int, ...], ...] = self.__topological_levels()
+        preset = expansion.execution_condition if expansion is not None else {}
+        self.execution_condition: Tuple[Dict[Any, Any], ...] = tuple(
+            preset[node] if node in preset else resolve_conditions(node, [nodes[j] for j in self.predecessors[i]]) 
+            for i, node in enumerate(nodes))
+        self.conditions: Tuple[Conditions, ...] = tuple(Conditions(x) for x in self.execution_condition)
+        self.streaming: Tuple[bool, ...] = tuple(is_streaming_transform(node.func_transform) for node in nodes)
+        self.stream_successors: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(j for j in self.successors[i] 
+                  if getattr(nodes[j], "stream_input", False) and node.node_id not in self.execution_condition[j]) 
+            if self.streaming[i] else () 
+            for i, node in enumerate(nodes))
+        if expansion is None:
+            self.sets_output: Tuple[bool, ...] = self.is_terminal
+            self.upstream_alias: Tuple[Optional[Dict[Any, Any]], ...] = (None,) * len(nodes)
+            self.scope: Tuple[Optional[int], ...] = (None,) * len(nodes)
+            self.sub_input: Tuple[Optional[int], ...] = (None,) * len(nodes)
+            self.subplans: Tuple = ()
+        else:
+            def ids(mapping):
+                return tuple(index[mapping[node]] if node in mapping else None for node in nodes)
+            self.sets_output = tuple(expansion.sets_output.get(node, self.is_terminal[i]) for i, node in enumerate(nodes))
+            self.upstream_alias = tuple(expansion.upstream_alias.get(node) for node in nodes)
+            self.scope = ids(expansion.scope)
+            self.sub_input = ids(expansion.sub_input)
+            self.subplans = tuple(expansion.subplans)
+
+    def is_current(self) -> bool:
+        """
+        Returns whether the plans of the sub-DAGs expanded in this plan are still the plans of their DAGs, 
+        i.e. no node or edge was added to or removed from them since.
+        """
+        return all(subdag.dag.compile() is plan for subdag, plan in self.subplans)
+
+    def __topological_levels(self) -> Tuple[Tuple[int, ...], ...]:
+        indegree = list(self.indegree)
+        levels = []
+        level = self.starts
+        while level:
+            levels.append(level)
+            next_level = []
+            for i in level:
+                for j in self.successors[i]:
+                    indegree[j] -= 1
+                    if indegree[j] == 0:
+                        next_level.append(j)
+            level = tuple(next_level)
+        return tuple(levels)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
@@ -1 +1,317 @@
-from paradag import SequentialProcessor, MultiThreadProcessor
\ No newline at end of file
+from typing import Any, Callable, Dict, Optional
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+import importlib
+import logging
+import os
+import pickle
+import sys
+import threading
+from langdag.utils import call_sync
+
+log = logging.getLogger("rich")
+
+
+class SequentialProcessor():
+    """
+    A processor runs node executions one by one in the calling thread.
+
+    `submit` runs the execution right away and returns an already completed `Future`,
+    so the scheduler handles every node as soon as it finishes.
+    """
+
+    def submit(self, func: Callable, *args) -> Future:
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def process(self, vertices_with_param, execute_func):
+        '''Process vertices in sequence (compatible with `paradag` processors)'''
+        return [(vtx, self.submit(execute_func, param).result()) for vtx, param in vertices_with_param]
+
+
+class MultiThreadProcessor():
+    """
+    A processor runs node executions concurrently in a pool of worker threads.
+
+    Worker threads are created lazily and kept warm between nodes and between runs.
+
+    Args:
+        max_workers (`int`, *optional*, defaults to `None`):
+            Maximum number of worker threads. When `None`, the pool is unbounded and concurrency
+            is governed by the selector only (e.g. `MaxSelector(N)`).
+        timeout (`int | float`, *optional*, defaults to `None`):
+            Maximum seconds the scheduler waits for the next node to finish before it checks again.
+    """
+    def __init__(self, max_workers: Optional[int] = None, timeout: Optional[int | float] = None) -> None:
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.__pool: Optional[ThreadPoolExecutor] = None
+        self.__lock = threading.Lock()
+
+    def __get_pool(self) -> ThreadPoolExecutor:
+        if self.__pool is None:
+            with self.__lock:
+                if self.__pool is None:
+                    self.__pool = ThreadPoolExecutor(max_workers=self.max_workers or sys.maxsize,
+                                                     thread_name_prefix="langdag")
+        return self.__pool
+
+    @property
+    def thread_pool(self) -> ThreadPoolExecutor:
+        '''The pool of worker threads, also used by the nodes running work of their own (e.g. `MapNode` elements)'''
+        return self.__get_pool()
+
+    def submit(self, func: Callable, *args) -> Future:
+        return self.__get_pool().submit(func, *args)
+
+    def process(self, vertices_with_param, execute_func):
+        '''Process vertices in parallel and wait for all of them (compatible with `paradag` processors)'''
+        futures = [(vtx, self.submit(execute_func, param)) for vtx, param in vertices_with_param]
+        return [(vtx, future.result(timeout=self.timeout)) for vtx, future in futures]
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Shut down the worker threads. The pool is re-created on the next `submit`.
+        """
+        with self.__lock:
+            if self.__pool is not None:
+                self.__pool.shutdown(wait=wait)
+                self.__pool = None
+
+
+class _SharedMemoryOutput():
+    '''Handle of a large bytes-like or numpy array output placed in shared memory by a worker process'''
+    def __init__(self, name: str, size: int, kind: str, shape=None, dtype=None) -> None:
+        self.name = name
+        self.size = size
+        self.kind = kind
+        self.shape = shape
+        self.dtype = dtype
+
+
+def _to_shared_memory(output: Any, threshold: int) -> Any:
+    '''Put a large bytes-like or numpy array `output` into shared memory (runs in the worker process)'''
+    if isinstance(output, (bytes, bytearray, memoryview)):
+        data, kind, shape, dtype = memoryview(output).cast("B"), type(output).__name__, None, None
+    else:
+        numpy = sys.modules.get("numpy")
+        if numpy is None or not isinstance(output, numpy.ndarray):
+            return output
+        data, kind, shape, dtype = memoryview(numpy.ascontiguousarray(output)).cast("B"), "ndarray", output.shape, output.dtype.str
+    if data.nbytes < threshold:
+        return output
+
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(create=True, size=data.nbytes, track=False)
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+        if os.name == "posix":
+            # the parent process unlinks the block, the resource tracker must not unlink it (and warn) when the worker exits
+            resource_tracker.unregister(shm._name, "shared_memory")
+    shm.buf[:data.nbytes] = data
+    handle = _SharedMemoryOutput(shm.name, data.nbytes, kind, shape, dtype)
+    shm.close()
+    return handle
+
+
+def _from_shared_memory(handle: _SharedMemoryOutput) -> Any:
+    '''Copy an output out of shared memory and release the block (runs in the parent process)'''
+    shm = shared_memory.SharedMemory(name=handle.name)
+    try:
+        if handle.kind == "ndarray":
+            import numpy
+            return numpy.ndarray(handle.shape, dtype=numpy.dtype(handle.dtype), buffer=shm.buf).copy()
+        data = bytes(shm.buf[:handle.size])
+        return bytearray(data) if handle.kind == "bytearray" else data
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _release_shared_memory(result) -> None:
+    '''Release the shared memory block of a worker process result whose output is never read'''
+    output = result[0]
+    if isinstance(output, _SharedMemoryOutput):
+        try:
+            shm = shared_memory.SharedMemory(name=output.name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+def _transform_in_process(func_transform, prompt, upstream_output, dag_state_payload: Dict[Any, bytes], threshold: int):
+    '''
+    Run `func_transform` in a worker process. 
+    Returns the output and the changes made to dag_state: (output, changed keys and values, deleted keys).
+    '''
+    dag_state = {k: pickle.loads(v) for k, v in dag_state_payload.items()}
+    output = call_sync(func_transform, prompt, upstream_output, dag_state)
+
+    changed = {}
+    for k, v in dag_state.items():
+        if k not in dag_state_payload or pickle.dumps(v, pickle.HIGHEST_PROTOCOL) != dag_state_payload[k]:
+            changed[k] = v
+    deleted = [k for k in dag_state_payload if k not in dag_state]
+    return _to_shared_memory(output, threshold), changed, deleted
+
+
+class _NodeTransformRef():
+    '''
+    Picklable reference to the `func_transform` of a node defined at module level with `@make_node()`, 
+    where the module-level name refers to the node instead of the function.
+    '''
+    def __init__(self, module: str, name: str) -> None:
+        self.module = module
+        self.name = name
+
+    def __call__(self, *args):
+        return getattr(importlib.import_module(self.module), self.name).func_transform(*args)
+
+
+def _picklable_transform(func_transform: Callable) -> Callable:
+    module = sys.modules.get(getattr(func_transform, "__module__", None))
+    name = getattr(func_transform, "__qualname__", "")
+    if getattr(getattr(module, name, None), "func_transform", None) is func_transform:
+        return _NodeTransformRef(module.__name__, name)
+    return func_transform
+
+
+def _warm_up():
+    return os.getpid()
+
+
+class MultiProcessProcessor(MultiThreadProcessor):
+    """
+    A processor runs node executions concurrently like `MultiThreadProcessor`, and runs `func_transform` of 
+    nodes created with `run_in_process=True` in a warm pool of worker processes, so CPU-bound nodes are not 
+    serialized by the GIL. Other nodes (e.g. LLM calls) still run in worker threads.
+
+    `func_transform` of those nodes, their `prompt`, `upstream_output`, `dag_state` and output must be picklable 
+    (e.g. `func_transform` is a module-level function). `dag_state` keys that cannot be pickled are not sent to 
+    the worker process. Changes made to `dag_state` in the worker process are merged back after the node finishes. 
+    Large `bytes`, `bytearray` and numpy array outputs are returned through shared memory instead of being pickled.
+
+    Args:
+        max_processes (`int`, *optional*, defaults to `None`):
+            Maximum number of worker processes, defaults to the number of CPUs.
+        max_workers (`int`, *optional*, defaults to `None`):
+            Maximum number of worker threads, same as `MultiThreadProcessor`.
+        shared_memory_threshold (`int`, *optional*, defaults to 1 MiB):
+            Outputs of at least this many bytes are returned through shared memory.
+        mp_context (*optional*, defaults to `None`):
+            A `multiprocessing` context (e.g. `multiprocessing.get_context("spawn")`) to start worker processes with.
+        timeout (`int | float`, *optional*, defaults to `None`):
+            Same as `MultiThreadProcessor`.
+    """
+    def __init__(self, 
+                 max_processes: Optional[int] = None, 
+                 max_workers: Optional[int] = None, 
+                 shared_memory_threshold: int = 1024 * 1024, 
+                 mp_context=None, 
+                 timeout: Optional[int | float] = None) -> None:
+        super().__init__(max_workers=max_workers, timeout=timeout)
+        self.max_processes = max_processes
+        self.shared_memory_threshold = shared_memory_threshold
+        self.mp_context = mp_context
+        self.__process_pool: Optional[ProcessPoolExecutor] = None
+        self.__process_lock = threading.Lock()
+        self.__unpicklable_keys = set()
+
+    def __get_process_pool(self) -> ProcessPoolExecutor:
+        if self.__process_pool is None:
+            with self.__process_lock:
+                if self.__process_pool is None:
+                    self.__process_pool = ProcessPoolExecutor(max_workers=self.max_processes, mp_context=self.mp_context)
+        return self.__process_pool
+
+    def warm_up(self) -> None:
+        """
+        Start all worker processes now instead of on the first node that runs in a process.
+        """
+        pool = self.__get_process_pool()
+        for future in [pool.submit(_warm_up) for _ in range(self.max_processes or os.cpu_count() or 1)]:
+            future.result()
+
+    def submit_transform(self, func_transform: Callable, prompt, upstream_output: Dict, dag_state: Dict) -> Future:
+        """
+        Submit `func_transform` to a worker process, pass the result of the returned `Future` 
+        to `finish_transform` to get the node output.
+        """
+        dag_state_payload = {}
+        for k, v in dag_state.items():
+            try:
+                dag_state_payload[k] = pickle.dumps(v, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                if k not in self.__unpicklable_keys:
+                    self.__unpicklable_keys.add(k)
+                    log.warning("dag_state[%r] can not be pickled, it is not sent to worker processes", k)
+        process_future = self.__get_process_pool().submit(_transform_in_process, 
+                                                          _picklable_transform(func_transform), 
+                                                          prompt, 
+                                                          upstream_output, 
+                                                          dag_state_payload, 
+                                                          self.shared_memory_threshold)
+        # the returned future is cancelled when its node is (timeout, cancelled speculation, failed run) while
+        # the worker process still runs: the shared memory block of its output is then released here
+        future = Future()
+
+        def deliver(process_future: Future) -> None:
+            if process_future.cancelled():
+                future.cancel()
+            elif process_future.exception() is not None:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(process_future.exception())
+            elif future.set_running_or_notify_cancel():
+                future.set_result(process_future.result())
+            else:
+                _release_shared_memory(process_future.result())
+
+        future.add_done_callback(lambda future: future.cancelled() and process_future.cancel())
+        process_future.add_done_callback(deliver)
+        return future
+
+    def discard_transform(self, future: Future) -> None:
+        """
+        Release a `Future` of `submit_transform` whose result will not be passed to `finish_transform`.
+        """
+        if not future.cancel() and not future.exception():
+            _release_shared_memory(future.result())
+
+    def finish_transform(self, result, dag_state: Dict) -> Any:
+        """
+        Merge the dag_state changes made in the worker process and return the node output.
+        """
+        output, changed, deleted = result
+        dag_state.update(changed)
+        for k in deleted:
+            dag_state.pop(k, None)
+        if isinstance(output, _SharedMemoryOutput):
+            output = _from_shared_memory(output)
+        return output
+
+    def run_transform(self, func_transform: Callable, prompt, upstream_output: Dict, dag_state: Dict) -> Any:
+        """
+        Run `func_transform` in a worker process and return the node output.
+        """
+        future = self.submit_transform(func_transform, prompt, upstream_output, dag_state)
+        try:
+            result = future.result()
+        except BaseException:
+            self.discard_transform(future)
+            raise
+        return self.finish_transform(result, dag_state)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Shut down the worker threads and processes. They are re-created when needed.
+        """
+        super().shutdown(wait=wait)
+        with self.__process_lock:
+            if self.__process_pool is not None:
+                self.__process_pool.shutdown(wait=wait)
+                self.__process_pool = None
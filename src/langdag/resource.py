@@ -0,0 +1,192 @@
+from typing import Dict, Iterable, List, Optional
+import logging
+import threading
+import time
+
+log = logging.getLogger("rich")
+
+# Seconds a scheduler waits before retrying nodes blocked by a resource that other runs hold
+POLL_INTERVAL = 0.05
+
+
+class Resource():
+    """
+    A shared resource nodes use (an LLM API, a vector DB, local CPU...), limiting how many nodes tagged with it
+    run at the same time and how often they start (token bucket). Limits apply to all runs in the process.
+
+    Args:
+        name (`str`, *required*):
+            Tag of the resource, as listed in `resources` of a node.
+        max_concurrent (`int`, *optional*, defaults to `None`):
+            Maximum number of nodes using the resource at the same time, unlimited when `None`.
+        rate (`float`, *optional*, defaults to `None`):
+            Maximum number of node starts per `per` seconds, unlimited when `None`.
+        per (`float`, *optional*, defaults to 60):
+            Period of `rate` in seconds, e.g. `rate=500, per=60` for 500 requests per minute.
+        burst (`float`, *optional*, defaults to `None`):
+            Maximum number of starts at once after the resource has been idle, defaults to `rate`.
+    """
+    def __init__(self,
+                 name: str,
+                 max_concurrent: Optional[int] = None,
+                 rate: Optional[float] = None,
+                 per: float = 60.0,
+                 burst: Optional[float] = None) -> None:
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.rate = rate
+        self.per = per
+        self.burst = burst if burst is not None else rate
+        self.in_use = 0
+        self.__tokens = self.burst
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __refill(self, now: float) -> None:
+        if self.rate is not None:
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate / self.per)
+        self.__updated = now
+
+    def available(self) -> bool:
+        """
+        Returns whether a node can start using the resource now.
+        """
+        with self.__lock:
+            self.__refill(time.monotonic())
+            return self.__available()
+
+    def __available(self) -> bool:
+        if self.max_concurrent is not None and self.in_use >= self.max_concurrent:
+            return False
+        return self.rate is None or self.__tokens >= 1
+
+    def try_acquire(self) -> bool:
+        """
+        Start using the resource if it is available (takes a slot and a token), returns whether it did.
+        """
+        with self.__lock:
+            self.__refill(time.monotonic())
+            if not self.__available():
+                return False
+            self.in_use += 1
+            if self.rate is not None:
+                self.__tokens -= 1
+            return True
+
+    def release(self, refund: bool = False) -> None:
+        """
+        Stop using the resource. With `refund`, the token taken by `try_acquire` is given back (the node did not start).
+        """
+        with self.__lock:
+            self.in_use -= 1
+            if refund and self.rate is not None:
+                self.__tokens = min(self.burst, self.__tokens + 1)
+
+    def wait_time(self) -> float:
+        """
+        Returns the seconds until a token is available, or `POLL_INTERVAL` if all slots are in use.
+        """
+        with self.__lock:
+            self.__refill(time.monotonic())
+            if self.max_concurrent is not None and self.in_use >= self.max_concurrent:
+                return POLL_INTERVAL
+            if self.rate is None or self.__tokens >= 1:
+                return 0.0
+            return (1 - self.__tokens) * self.per / self.rate
+
+    def __repr__(self) -> str:
+        return (f"Resource({self.name!r}, max_concurrent={self.max_concurrent}, rate={self.rate}, "
+                f"per={self.per}, in_use={self.in_use})")
+
+
+_registry: Dict[str, Resource] = {}
+_registry_lock = threading.Lock()
+_warned = set()
+
+
+def register_resource(name: str,
+                      max_concurrent: Optional[int] = None,
+                      rate: Optional[float] = None,
+                      per: float = 60.0,
+                      burst: Optional[float] = None) -> Resource:
+    """
+    Declare the limits of the resource `name` for the whole process (see `Resource`) and return it.
+    Registering a name again replaces its limits.
+
+    Example:
+        register_resource("openai", max_concurrent=8, rate=500, per=60)
+        node = Node(..., resources=["openai"])
+    """
+    with _registry_lock:
+        resource = Resource(name, max_concurrent, rate, per, burst)
+        old = _registry.get(name)
+        if old is not None:
+            resource.in_use = old.in_use
+        _registry[name] = resource
+        return resource
+
+
+def get_resource(name: str) -> Optional[Resource]:
+    """
+    Returns the registered resource `name`, or None (unlimited) if it is not registered.
+    """
+    resource = _registry.get(name)
+    if resource is None and name not in _warned:
+        _warned.add(name)
+        log.warning("Resource %r is not registered with `register_resource`, it is not limited", name)
+    return resource
+
+
+def resources_of(node) -> List[Resource]:
+    """
+    Returns the registered resources a node is tagged with.
+    """
+    names: Optional[Iterable[str]] = getattr(node, "resources", None)
+    if not names:
+        return []
+    return [x for x in (get_resource(name) for name in names) if x is not None]
+
+
+def resources_available(node) -> bool:
+    """
+    Returns whether all resources of `node` are available now.
+    """
+    return all(x.available() for x in resources_of(node))
+
+
+def try_acquire_resources(node) -> bool:
+    """
+    Acquire all resources of `node` or none of them, returns whether they are acquired.
+    """
+    acquired = []
+    for resource in resources_of(node):
+        if not resource.try_acquire():
+            for x in acquired:
+                x.release(refund=True)
+            return False
+        acquired.append(resource)
+    return True
+
+
+def acquire_resources(node) -> None:
+    """
+    Acquire all resources of `node`, waiting until they are available.
+    """
+    while not try_acquire_resources(node):
+        time.sleep(resources_wait_time([node]))
+
+
+def release_resources(node) -> None:
+    """
+    Release the resources of `node` acquired by `try_acquire_resources` or `acquire_resources`.
+    """
+    for resource in resources_of(node):
+        resource.release()
+
+
+def resources_wait_time(nodes: Iterable) -> float:
+    """
+    Returns the seconds until one of `nodes` blocked by its resources may be able to start.
+    """
+    waits = [max((x.wait_time() for x in resources_of(node)), default=0.0) for node in nodes]
+    return max(min(waits, default=POLL_INTERVAL), 0.001)
@@ -0,0 +1,217 @@
+from typing import Any, Dict, Iterable, List, Optional
+import logging
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import uuid
+
+log = logging.getLogger("rich")
+
+_KEEP = ("terminal", "all")
+
+
+def estimate_size(obj: Any, depth: int = 3) -> int:
+    """
+    Returns a cheap estimate of the size of `obj` in bytes: the length of strings and bytes,
+    summed over the items of lists, tuples, sets and dicts down to `depth` levels.
+    """
+    if isinstance(obj, (str, bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, memoryview):
+        return obj.nbytes
+    size = sys.getsizeof(obj, 0)
+    if depth <= 0:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(estimate_size(k, depth - 1) + estimate_size(v, depth - 1) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(estimate_size(x, depth - 1) for x in obj)
+    return size
+
+
+class SpilledOutput():
+    """
+    A node output written to a file while it waits for the downstream nodes consuming it (see `OutputRetention`).
+    It stands for the output in the run state until they all consumed it, then the file is removed.
+    """
+    __slots__ = ("path", "nbytes")
+
+    def __init__(self, path: str, nbytes: int) -> None:
+        self.path = path
+        self.nbytes = nbytes
+
+    def load(self) -> Any:
+        """
+        Returns the output read back from the file.
+        """
+        with open(self.path, "rb") as f:
+            return pickle.load(f)
+
+    def discard(self) -> None:
+        """
+        Remove the file.
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __repr__(self) -> str:
+        return f"SpilledOutput({self.path!r}, {self.nbytes} bytes)"
+
+
+class OutputRetention():
+    """
+    How long a run keeps node outputs (`run_dag(..., retention=OutputRetention())`).
+
+    Without it, every node keeps the outputs of its upstream nodes (`upstream_output`) and its own `node_output`
+    until the run ends, and they are copied to the nodes after it, so a DAG passing large documents or images holds
+    all of them at once. With it, outputs are reference counted: once every downstream node of a node executed
+    or was aborted, the output is dropped from the run (the `upstream_output` of the downstream nodes and the
+    outputs delivered to them), and with `keep="terminal"` also from the `node_output` of the node.
+
+    Example:
+        retention = OutputRetention(keep="terminal", spill_bytes=1_000_000)
+        run_dag(dag, processor=MultiThreadProcessor(), retention=retention)
+
+    Args:
+        keep (`str`, *optional*, defaults to `"terminal"`):
+            `"terminal"`: only terminating nodes keep their `node_output`, the output of other nodes is set to `None`
+            once consumed. `"all"`: every node keeps its `node_output`, only the copies held for downstream nodes
+            are dropped.
+        spill_bytes (`int`, *optional*, defaults to `None`):
+            With `keep="terminal"`, outputs of non-terminating nodes of at least this many bytes (pickled) are
+            written to a file until consumed, instead of staying in memory while their downstream nodes wait.
+            They are read back when a downstream node needs them. No spilling when `None`.
+        spill_dir (`str`, *optional*, defaults to `None`):
+            Directory of the spilled outputs, a temporary directory per run (removed at its end) when `None`.
+    """
+    def __init__(self, keep: str = "terminal", spill_bytes: Optional[int] = None,
+                 spill_dir: Optional[str] = None) -> None:
+        if keep not in _KEEP:
+            raise ValueError(f'keep should be "terminal" or "all", got {keep!r}')
+        if spill_bytes is not None and keep != "terminal":
+            raise ValueError('spill_bytes needs keep="terminal", outputs kept in memory can not be spilled')
+        self.keep = keep
+        self.spill_bytes = spill_bytes
+        self.spill_dir = spill_dir
+
+
+class OutputRefs():
+    """
+    Reference counts of the node outputs of a run with an `OutputRetention`: the number of downstream nodes of each
+    node that did not consume its output yet. Kept in `context.output_refs`.
+
+    Args:
+        retention (`OutputRetention`, *required*):
+            What to keep.
+        context (`RunContext`, *required*):
+            The run.
+    """
+    def __init__(self, retention: OutputRetention, context) -> None:
+        self.retention = retention
+        self.context = context
+        plan = context.plan
+        self.refs: List[int] = [len(successors) for successors in plan.successors]
+        self.done: List[bool] = [False] * len(plan.nodes)
+        self.spilled: Dict[int, SpilledOutput] = {}
+        self.spilled_bytes = 0
+        self.__directory: Optional[str] = None
+        self.__own_directory = False
+
+    def __spill_path(self) -> str:
+        if self.__directory is None:
+            if self.retention.spill_dir is None:
+                self.__directory = tempfile.mkdtemp(prefix="langdag-spill-")
+                self.__own_directory = True
+            else:
+                os.makedirs(self.retention.spill_dir, exist_ok=True)
+                self.__directory = self.retention.spill_dir
+        return os.path.join(self.__directory, f"{self.context.run_id}-{uuid.uuid4().hex}.pkl")
+
+    def spill(self, node, result: Dict) -> Dict:
+        """
+        Called when `node` finished, before its output is delivered: write a large output to a file and return
+        the result to deliver (with the `SpilledOutput` in place of the output when spilled).
+        """
+        limit = self.retention.spill_bytes
+        i = self.context.plan.index[node]
+        state = self.context.state_of(node)
+        output = state.node_output
+        if (limit is None or self.refs[i] == 0 or output is None or isinstance(output, SpilledOutput)
+                or state.execution_state != "finished" or estimate_size(output) < limit):
+            return result
+        try:
+            data = pickle.dumps(output, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return result
+        if len(data) < limit:
+            return result
+        path = self.__spill_path()
+        try:
+            with open(path, "wb") as f:
+                f.write(data)
+        except OSError as e:
+            log.warning("Output of node %s could not be spilled to %s: %r", node.node_id, path, e)
+            return result
+        spilled = SpilledOutput(path, len(data))
+        self.spilled[i] = spilled
+        self.spilled_bytes += len(data)
+        state.node_output = spilled
+        return {node.node_id: spilled}
+
+    def load(self, upstream_output: Dict, keys: Optional[Iterable] = None) -> Dict:
+        """
+        Returns a copy of `upstream_output` with the spilled outputs read back (only those of `keys` if given).
+        """
+        upstream_output = dict(upstream_output)
+        if not self.spilled:
+            return upstream_output
+        for node_id, output in upstream_output.items():
+            if isinstance(output, SpilledOutput) and (keys is None or node_id in keys):
+                upstream_output[node_id] = output.load()
+        return upstream_output
+
+    def consumed(self, node) -> None:
+        """
+        Called when `node` is done (executed, or aborted): drop its `upstream_output` and the outputs delivered
+        to it, and release the outputs of its upstream nodes that every downstream node consumed.
+        """
+        context = self.context
+        plan = context.plan
+        j = plan.index[node]
+        if self.done[j]:
+            return
+        self.done[j] = True
+        context.state_of(node).upstream_output = {}
+        context.upstream_output.pop(node, None)
+        for i in plan.predecessors[j]:
+            self.refs[i] -= 1
+            if self.refs[i] == 0 and self.done[i]:
+                self.__release(i)
+        # every downstream node consumed its output stream before it finished
+        if self.refs[j] == 0 and plan.successors[j]:
+            self.__release(j)
+
+    def __release(self, i: int) -> None:
+        spilled = self.spilled.pop(i, None)
+        if spilled is not None:
+            spilled.discard()
+        if self.retention.keep == "terminal" and not self.context.plan.is_terminal[i]:
+            state = self.context.state_of(self.context.plan.nodes[i])
+            state.node_output = None
+            state.node_stream = None
+            state.output_released = True
+
+    def close(self) -> None:
+        """
+        Remove the files of outputs still spilled (a run that failed), and the temporary spill directory.
+        """
+        for spilled in self.spilled.values():
+            spilled.discard()
+        self.spilled.clear()
+        if self.__own_directory and self.__directory is not None:
+            shutil.rmtree(self.__directory, ignore_errors=True)
+            self.__directory = None
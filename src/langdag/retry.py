@@ -0,0 +1,345 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from contextvars import ContextVar
+import asyncio
+import contextvars
+import logging
+import queue
+import random
+import threading
+import time
+from langdag.error import NodeTimeoutError
+from langdag.events import events_enabled, log_event
+
+log = logging.getLogger("rich")
+
+# The attempt of a `RetryPolicy` calling the current function
+_current_attempt: ContextVar[Optional["Attempt"]] = ContextVar("langdag_retry_attempt", default=None)
+
+
+class Attempt():
+    """
+    One call of a function by a `RetryPolicy`. It is `abandoned` when the policy stops waiting for it (it timed out,
+    or another attempt won the hedge): a plain function keeps running in the background, and should not change 
+    anything visible from then on.
+    """
+    def __init__(self) -> None:
+        self.__abandoned = threading.Event()
+        # held by `abandon`, hold it to do something only if the attempt is not abandoned meanwhile
+        self.lock = threading.Lock()
+
+    @property
+    def abandoned(self) -> bool:
+        return self.__abandoned.is_set()
+
+    def abandon(self) -> None:
+        with self.lock:
+            self.__abandoned.set()
+
+
+def current_attempt() -> Optional[Attempt]:
+    '''Returns the attempt of the `RetryPolicy` calling the current function, None outside of one'''
+    return _current_attempt.get()
+
+
+class _AttemptPool():
+    """
+    At most `max_threads` daemon threads running the attempts of a `RetryPolicy` with a timeout or hedging,
+    started when needed and kept. Daemon threads, so an attempt hanging forever does not keep the process alive.
+    """
+    def __init__(self, max_threads: int) -> None:
+        self.max_threads = max_threads
+        self.__queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.__threads = 0
+        self.__idle = 0
+        self.__lock = threading.Lock()
+
+    def submit(self, func: Callable[[], Any]) -> Future:
+        future = Future()
+        with self.__lock:
+            self.__queue.put((future, func))
+            if self.__idle == 0 and self.__threads < self.max_threads:
+                self.__threads += 1
+                threading.Thread(target=self.__work, name=f"langdag-retry-{self.__threads}", daemon=True).start()
+        return future
+
+    def __work(self) -> None:
+        while True:
+            with self.__lock:
+                self.__idle += 1
+            future, func = self.__queue.get()
+            with self.__lock:
+                self.__idle -= 1
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                future.set_exception(e)
+
+
+class RetryPolicy():
+    """
+    How a node calls its transform: a timeout per attempt, retries with exponential backoff and jitter,
+    and hedging (a duplicate call started when the first one is slow, the first result wins).
+    When the last attempt fails, the node ends in the "failed" `execution_state` instead of failing the run.
+
+    Example:
+        policy = RetryPolicy(timeout=30, retries=2, hedge_after="p95")
+        node = Node(..., retry_policy=policy)
+        run_dag(dag, executor=LangExecutor(retry_policy=RetryPolicy(retries=1)))  # default of all nodes
+
+    Args:
+        timeout (`float`, *optional*, defaults to `None`):
+            Seconds an attempt may take (including its hedged duplicate), no timeout when `None`.
+        retries (`int`, *optional*, defaults to 0):
+            Number of attempts after the first one.
+        backoff (`float`, *optional*, defaults to 0.5):
+            Delay before the first retry in seconds, doubled for every next retry.
+        max_backoff (`float`, *optional*, defaults to 30):
+            Maximum delay between attempts in seconds.
+        jitter (`float`, *optional*, defaults to 0.5):
+            Fraction of the delay that is randomized, so retries of many runs do not hit an API at the same time.
+        hedge_after (`float | str`, *optional*, defaults to `None`):
+            Start a duplicate call when an attempt has not finished after this many seconds, or after
+            a percentile of the durations of previous attempts of the node (e.g. `"p95"`). No hedging when `None`.
+        hedge_min_samples (`int`, *optional*, defaults to 10):
+            Number of durations needed before a percentile `hedge_after` is used.
+        retry_on (`Tuple[Type[BaseException]]`, *optional*, defaults to `(Exception,)`):
+            Exceptions that are retried, others fail the node right away.
+        max_threads (`int`, *optional*, defaults to 32):
+            Maximum number of threads running the attempts of plain functions with a `timeout` or hedging, 
+            attempts wait for a free thread beyond that (their timeout included).
+
+    Plain functions keep running in the background after a timeout or after losing a hedge (threads can not be
+    cancelled), `async def` functions are cancelled. Such an attempt is `abandoned` (see `current_attempt`): 
+    a node discards its writes to dag_state and its chunks. Hedged transforms should be safe to call twice.
+    """
+    def __init__(self,
+                 timeout: Optional[float] = None,
+                 retries: int = 0,
+                 backoff: float = 0.5,
+                 max_backoff: float = 30.0,
+                 jitter: float = 0.5,
+                 hedge_after: Optional[float | str] = None,
+                 hedge_min_samples: int = 10,
+                 retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+                 max_threads: int = 32) -> None:
+        if isinstance(hedge_after, str) and not (hedge_after.startswith("p") and hedge_after[1:].isdigit()):
+            raise ValueError(f'hedge_after should be a number of seconds or a percentile like "p95", got {hedge_after!r}')
+        self.timeout = timeout
+        self.retries = max(retries, 0)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.hedge_after = hedge_after
+        self.hedge_min_samples = hedge_min_samples
+        self.retry_on = retry_on
+        self.max_threads = max(max_threads, 1)
+        self.__durations: Dict[Any, deque] = {}
+        self.__lock = threading.Lock()
+        self.__pool: Optional[_AttemptPool] = None
+
+    def delay(self, attempt: int) -> float:
+        """
+        Returns the seconds to wait before the retry number `attempt` (starting at 1).
+        """
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return delay * (1 - self.jitter * random.random())
+
+    def record(self, node_id: Any, duration: float) -> None:
+        """
+        Record the duration of a successful attempt of `node_id`, used by a percentile `hedge_after`.
+        """
+        with self.__lock:
+            self.__durations.setdefault(node_id, deque(maxlen=100)).append(duration)
+
+    def hedge_delay(self, node_id: Any) -> Optional[float]:
+        """
+        Returns the seconds after which a duplicate of an attempt of `node_id` is started, None for no hedging.
+        """
+        if self.hedge_after is None or isinstance(self.hedge_after, (int, float)):
+            return self.hedge_after
+        with self.__lock:
+            durations = sorted(self.__durations.get(node_id, ()))
+        if len(durations) < self.hedge_min_samples:
+            return None
+        percentile = int(self.hedge_after[1:])
+        return durations[min(len(durations) - 1, len(durations) * percentile // 100)]
+
+    def __retry_in(self, node_id: Any, attempt: int, error: BaseException, can_retry, verbose: bool) -> Optional[float]:
+        '''Returns the delay before retrying after `error`, or None if it should not be retried'''
+        if attempt > self.retries or not isinstance(error, self.retry_on) or (can_retry and not can_retry()):
+            return None
+        delay = self.delay(attempt)
+        if events_enabled():
+            log_event("node_retry", node_id, attempt=attempt, delay=round(delay, 3), error=repr(error))
+        if verbose:
+            log.warning("Node %s attempt %s failed: %r, retrying in %.2fs", node_id, attempt, error, delay)
+        return delay
+
+    def call(self, func: Callable[[], Any], node_id: Any, hedge: bool = True,
+             can_retry: Optional[Callable[[], bool]] = None, verbose: bool = False) -> Any:
+        """
+        Call `func` with the policy, returns its result or raises the error of the last attempt.
+
+        Args:
+            func (`Callable`, *required*):
+                The function to call, without arguments.
+            node_id (`Any`, *required*):
+                The node calling, for the durations of a percentile `hedge_after` and for logging.
+            hedge (`bool`, *optional*, defaults to `True`):
+                Whether hedging is allowed (not for streaming transforms).
+            can_retry (`Callable`, *optional*, defaults to `None`):
+                Returns whether a failed attempt can be retried.
+            verbose (`bool`, *optional*, defaults to `False`):
+                Log retries to the console.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return self.__attempt(func, node_id, hedge)
+            except BaseException as e:
+                delay = self.__retry_in(node_id, attempt, e, can_retry, verbose)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    def __start(self, func: Callable[[], Any], attempts: Dict[Future, Attempt]) -> None:
+        """
+        Run `func` as a new attempt in a thread of the policy (with the current context variables),
+        so it can be abandoned. The future result is `(result, duration)`.
+        """
+        if self.__pool is None:
+            with self.__lock:
+                if self.__pool is None:
+                    self.__pool = _AttemptPool(self.max_threads)
+        attempt = Attempt()
+        ctx = contextvars.copy_context()
+
+        def run():
+            _current_attempt.set(attempt)
+            started = time.perf_counter()
+            result = func()
+            return result, time.perf_counter() - started
+
+        attempts[self.__pool.submit(lambda: ctx.run(run))] = attempt
+
+    def __attempt(self, func: Callable[[], Any], node_id: Any, hedge: bool) -> Any:
+        hedge_after = self.hedge_delay(node_id) if hedge else None
+        if self.timeout is None and hedge_after is None:
+            token = _current_attempt.set(Attempt())
+            try:
+                started = time.perf_counter()
+                result = func()
+            finally:
+                _current_attempt.reset(token)
+            self.record(node_id, time.perf_counter() - started)
+            return result
+
+        started = time.perf_counter()
+        attempts: Dict[Future, Attempt] = {}
+        self.__start(func, attempts)
+        error = None
+        try:
+            while attempts:
+                now = time.perf_counter()
+                waits = []
+                if self.timeout is not None:
+                    waits.append(started + self.timeout - now)
+                if hedge_after is not None:
+                    waits.append(started + hedge_after - now)
+                done, _ = wait(attempts, timeout=max(min(waits), 0) if waits else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    attempts.pop(future)
+                    if future.exception() is None:
+                        result, duration = future.result()
+                        self.record(node_id, duration)
+                        return result
+                    error = future.exception()
+                if not done:
+                    if self.timeout is not None and time.perf_counter() - started >= self.timeout:
+                        raise NodeTimeoutError(f"Node {node_id} timed out after {self.timeout}s")
+                    if hedge_after is not None and time.perf_counter() - started >= hedge_after:
+                        if events_enabled():
+                            log_event("node_hedge", node_id, after=round(hedge_after, 3))
+                        self.__start(func, attempts)
+                        hedge_after = None
+            raise error
+        finally:
+            # the attempts still running lost the hedge or timed out
+            for future, attempt in attempts.items():
+                attempt.abandon()
+                future.cancel()
+
+    async def acall(self, make_coro: Callable[[], Awaitable], node_id: Any, hedge: bool = True,
+                    can_retry: Optional[Callable[[], bool]] = None, verbose: bool = False) -> Any:
+        """
+        Async version of `call`, `make_coro` returns a new coroutine for every attempt.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await self.__aattempt(make_coro, node_id, hedge)
+            except BaseException as e:
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                delay = self.__retry_in(node_id, attempt, e, can_retry, verbose)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+    async def __aattempt(self, make_coro: Callable[[], Awaitable], node_id: Any, hedge: bool) -> Any:
+        def start():
+            attempt = Attempt()
+
+            async def timed():
+                _current_attempt.set(attempt)
+                started = time.perf_counter()
+                result = await make_coro()
+                return result, time.perf_counter() - started
+            tasks[asyncio.ensure_future(timed())] = attempt
+
+        hedge_after = self.hedge_delay(node_id) if hedge else None
+        started = time.perf_counter()
+        tasks: Dict[asyncio.Future, Attempt] = {}
+        start()
+        error = None
+        try:
+            while tasks:
+                now = time.perf_counter()
+                waits = []
+                if self.timeout is not None:
+                    waits.append(started + self.timeout - now)
+                if hedge_after is not None:
+                    waits.append(started + hedge_after - now)
+                done, _ = await asyncio.wait(tasks, timeout=max(min(waits), 0) if waits else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.pop(task)
+                    if task.exception() is None:
+                        result, duration = task.result()
+                        self.record(node_id, duration)
+                        return result
+                    error = task.exception()
+                if not done:
+                    if self.timeout is not None and time.perf_counter() - started >= self.timeout:
+                        raise NodeTimeoutError(f"Node {node_id} timed out after {self.timeout}s")
+                    if hedge_after is not None and time.perf_counter() - started >= hedge_after:
+                        if events_enabled():
+                            log_event("node_hedge", node_id, after=round(hedge_after, 3))
+                        start()
+                        hedge_after = None
+            raise error
+        finally:
+            for task, attempt in tasks.items():
+                attempt.abandon()
+                task.cancel()
+
+    def __repr__(self) -> str:
+        return (f"RetryPolicy(timeout={self.timeout}, retries={self.retries}, backoff={self.backoff}, "
+                f"hedge_after={self.hedge_after!r})")
+
@@ -1,3 +1,8 @@
+from typing import Dict, Optional
+import heapq
+import threading
+
+
 class FullSelector():
     '''A selector selects all the idle vertices'''
 
@@ -16,3 +21,68 @@ class MaxSelector():
     def select(self, running, idle):
         task_number = max(0, self.max_cocurrent-len(running))
         return sorted(list(idle), key=lambda x: x.node_id)[:task_number]
+
+
+class CriticalPathSelector():
+    """
+    A selector selects at most `max_concurrent` of the idle vertices (all of them when `None`), 
+    those with the longest remaining critical path first, so long chains of nodes start early 
+    instead of in alphabetical order.
+
+    The remaining critical path of a node is its estimated duration plus the longest remaining critical path
+    of its successors. Durations are estimated from `node.duration_hint`, then `stats` (durations learned 
+    from previous runs, see `langdag.stats.DurationStats`), then `default_duration`. 
+    They are computed once per compiled plan (and again when `stats` changes), and each selection only picks 
+    the top idle vertices instead of sorting all of them.
+
+    Args:
+        dag (`LangDAG`, *required*):
+            The DAG to run.
+        max_concurrent (`int`, *optional*, defaults to `None`):
+            Maximum number of nodes running concurrently, unlimited when `None`.
+        stats (`DurationStats`, *optional*, defaults to `None`):
+            Durations of nodes learned from previous runs.
+        default_duration (`float`, *optional*, defaults to 1.0):
+            Estimated duration (seconds) of nodes without a hint or stats.
+    """
+    def __init__(self, dag, max_concurrent: Optional[int] = None, stats=None, default_duration: float = 1.0):
+        self.dag = dag
+        self.max_concurrent = max(max_concurrent, 1) if max_concurrent is not None else None
+        self.stats = stats
+        self.default_duration = default_duration
+        self.__plan = None
+        self.__stats_version = None
+        self.__rank: Dict = {}
+        self.__lock = threading.Lock()
+
+    def duration_of(self, node) -> float:
+        '''Estimated duration of `node` in seconds'''
+        if getattr(node, "duration_hint", None) is not None:
+            return node.duration_hint
+        if self.stats is not None:
+            estimate = self.stats.estimate(node.node_id)
+            if estimate is not None:
+                return estimate
+        return self.default_duration
+
+    def ranks(self) -> Dict:
+        '''Remaining critical path length of each node, recomputed when the plan or `stats` change'''
+        plan = self.dag.compile()
+        stats_version = self.stats.version if self.stats is not None else None
+        if plan is not self.__plan or stats_version != self.__stats_version:
+            with self.__lock:
+                rank = [0.0] * len(plan)
+                for level in reversed(plan.levels):
+                    for i in level:
+                        rank[i] = self.duration_of(plan.nodes[i]) + max((rank[j] for j in plan.successors[i]), default=0.0)
+                self.__rank = {node: rank[i] for i, node in enumerate(plan.nodes)}
+                self.__plan, self.__stats_version = plan, stats_version
+        return self.__rank
+
+    def select(self, running, idle):
+        rank = self.ranks()
+        if self.max_concurrent is None:
+            task_number = len(idle)
+        else:
+            task_number = max(0, self.max_concurrent-len(running))
+        return heapq.nsmallest(task_number, idle, key=lambda x: (-rank.get(x, 0.0), str(x.node_id)))
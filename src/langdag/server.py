@@ -0,0 +1,476 @@
+from typing import Any, Callable, Deque, Dict, List, Optional, TextIO
+from collections import deque
+from concurrent.futures import Executor, Future
+from contextvars import ContextVar
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+
+from langdag import LangDAG, arun_dag
+from langdag.context import RunContext
+from langdag.error import ServerOverloadedError
+from langdag.executor import LangExecutor
+from langdag.selector import FullSelector
+
+log = logging.getLogger("rich")
+
+_ON_FULL = ("reject", "block")
+
+# The request whose nodes are submitted to the `FairExecutor`, set in the task running it
+_current_request: ContextVar[Optional[int]] = ContextVar("langdag_current_request", default=None)
+
+
+class FairExecutor(Executor):
+    """
+    A pool of persistent worker threads running the functions submitted by many runs in turns:
+    each run has a queue of its own, and the workers take the next function of the next run (round-robin),
+    so a run with many parallel nodes does not delay the runs started after it.
+
+    The run of a function is the request of the `DagServer` submitting it, functions submitted outside
+    of a request share one queue.
+
+    Args:
+        max_workers (`int`, *required*`):
+            Number of worker threads, started with the pool and kept until `shutdown`.
+    """
+    def __init__(self, max_workers: int) -> None:
+        if max_workers < 1:
+            raise ValueError(f'max_workers should be at least 1, got {max_workers!r}')
+        self.max_workers = max_workers
+        self.__queues: Dict[Any, Deque] = {}
+        # runs with queued functions, in the order the workers serve them
+        self.__turns: Deque = deque()
+        self.__condition = threading.Condition()
+        self.__shutdown = False
+        self.__threads = [threading.Thread(target=self.__work, name=f"langdag-server-{i}", daemon=True)
+                          for i in range(max_workers)]
+        for thread in self.__threads:
+            thread.start()
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        future = Future()
+        key = _current_request.get()
+        with self.__condition:
+            if self.__shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            if key not in self.__queues:
+                self.__queues[key] = deque()
+                self.__turns.append(key)
+            self.__queues[key].append((future, fn, args, kwargs))
+            self.__condition.notify()
+        return future
+
+    def pending(self) -> int:
+        '''Number of functions waiting for a worker'''
+        with self.__condition:
+            return sum(len(queue) for queue in self.__queues.values())
+
+    def __next(self) -> Optional[tuple]:
+        with self.__condition:
+            while not self.__turns:
+                if self.__shutdown:
+                    return None
+                self.__condition.wait()
+            key = self.__turns.popleft()
+            queue = self.__queues[key]
+            item = queue.popleft()
+            if queue:
+                self.__turns.append(key)
+            else:
+                del self.__queues[key]
+            return item
+
+    def __work(self) -> None:
+        while True:
+            item = self.__next()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        with self.__condition:
+            self.__shutdown = True
+            if cancel_futures:
+                for queue in self.__queues.values():
+                    for future, *_ in queue:
+                        future.cancel()
+                self.__queues.clear()
+                self.__turns.clear()
+            self.__condition.notify_all()
+        if wait:
+            for thread in self.__threads:
+                thread.join()
+
+
+class _Request():
+    def __init__(self, request_id: int, dag_input: Any, future: Future) -> None:
+        self.request_id = request_id
+        self.dag_input = dag_input
+        self.future = future
+        self.submitted_at = time.perf_counter()
+        self.started_at: Optional[float] = None
+
+
+def _percentiles(durations: Deque[float]) -> Dict[str, Optional[float]]:
+    durations = sorted(durations)
+    if not durations:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+
+    def at(percentile: int) -> float:
+        return round(durations[min(len(durations) - 1, len(durations) * percentile // 100)], 6)
+    return {"p50": at(50), "p95": at(95), "p99": at(99), "max": round(durations[-1], 6)}
+
+
+class DagServer():
+    """
+    A long-lived runtime serving many runs of a `LangDAG`, e.g. one per request of a web service, instead of
+    a `run_dag` per request: the plan is compiled once, the runs share a pool of persistent worker threads
+    and an event loop, and there is no progress bar.
+
+    At most `max_running` runs execute at the same time, the others wait in an admission queue of `max_queue`
+    requests. When it is full, `submit` raises `ServerOverloadedError` (`on_full="reject"`) or waits for room
+    (`on_full="block"`, at most `block_timeout` seconds), and requests waiting longer than `queue_timeout`
+    are shed: their future fails with `ServerOverloadedError`. Nodes of the running runs are interleaved
+    fairly on the workers (see `FairExecutor`). `metrics()` returns the queue depth, counts and latencies.
+
+    Example:
+        with DagServer(dag, workers=16, max_queue=100) as server:
+            future = server.submit(user_query)
+            answer = future.result()
+
+    Args:
+        dag (`LangDAG`, *required*`):
+            The DAG to serve, `dag_state["input"]` of each run is the `dag_input` of its request.
+        workers (`int`, *optional*, defaults to 8):
+            Number of worker threads running the plain (not `async def`) functions of nodes.
+        max_running (`int`, *optional*, defaults to `None`):
+            Maximum number of runs executing at the same time, `workers` when `None`.
+        max_queue (`int`, *optional*, defaults to 64):
+            Maximum number of requests waiting to run.
+        on_full (`str`, *optional*, defaults to `"reject"`):
+            When the queue is full, `"reject"` the request with `ServerOverloadedError`, or `"block"` until
+            there is room.
+        block_timeout (`float`, *optional*, defaults to `None`):
+            With `on_full="block"`, maximum seconds to wait for room before rejecting, no limit when `None`.
+        queue_timeout (`float`, *optional*, defaults to `None`):
+            Maximum seconds a request waits in the queue before it is shed, no limit when `None`.
+        selector (*optional*, defaults to `FullSelector()`):
+            The selector of every run, e.g. `MaxSelector(N)` to limit the concurrent nodes of a run.
+        executor (`LangExecutor`, *optional*, defaults to `None`):
+            The executor of every run, a silent `LangExecutor` when `None`.
+        metrics_window (`int`, *optional*, defaults to 1000):
+            Number of latest requests the latency percentiles are computed from.
+    """
+    def __init__(self,
+                 dag: LangDAG,
+                 workers: int = 8,
+                 max_running: Optional[int] = None,
+                 max_queue: int = 64,
+                 on_full: str = "reject",
+                 block_timeout: Optional[float] = None,
+                 queue_timeout: Optional[float] = None,
+                 selector=FullSelector(),
+                 executor: Optional[LangExecutor] = None,
+                 metrics_window: int = 1000) -> None:
+        if on_full not in _ON_FULL:
+            raise ValueError(f'on_full should be "reject" or "block", got {on_full!r}')
+        self.dag = dag
+        self.workers = workers
+        self.max_running = max_running or workers
+        self.max_queue = max_queue
+        self.on_full = on_full
+        self.block_timeout = block_timeout
+        self.queue_timeout = queue_timeout
+        self.selector = selector
+        self.executor = executor or LangExecutor(verbose=False)
+        self.__condition = threading.Condition()
+        self.__queue: Deque[_Request] = deque()
+        self.__running = 0
+        self.__ids = itertools.count()
+        self.__counts = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "shed": 0}
+        self.__latency: Deque[float] = deque(maxlen=metrics_window)
+        self.__queue_wait: Deque[float] = deque(maxlen=metrics_window)
+        self.__started_at: Optional[float] = None
+        self.__closed = False
+        self.__pool: Optional[FairExecutor] = None
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__loop_thread: Optional[threading.Thread] = None
+
+    def start(self) -> "DagServer":
+        """
+        Start the workers and the event loop of the server, done by the first `submit` otherwise.
+        """
+        with self.__condition:
+            if self.__closed:
+                raise RuntimeError('DagServer is closed')
+            if self.__loop is not None:
+                return self
+            self.dag.compile()
+            self.__pool = FairExecutor(self.workers)
+            self.__loop = asyncio.new_event_loop()
+            self.__loop_thread = threading.Thread(target=self.__loop.run_forever, name="langdag-server-loop",
+                                                  daemon=True)
+            self.__loop_thread.start()
+            self.__started_at = time.perf_counter()
+        return self
+
+    def __enter__(self) -> "DagServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def submit(self, dag_input: Any = None) -> Future:
+        """
+        Queue a run of the DAG with `dag_input`, returns a `Future` of the output of the run (`dag_state["output"]`).
+        Raises `ServerOverloadedError` when the queue is full (after waiting for room with `on_full="block"`).
+        """
+        self.start()
+        with self.__condition:
+            if self.__full():
+                if self.on_full == "block":
+                    self.__condition.wait_for(lambda: self.__closed or not self.__full(), self.block_timeout)
+                if self.__full():
+                    self.__counts["rejected"] += 1
+                    raise ServerOverloadedError(
+                        f'DagServer queue is full ({len(self.__queue)} requests waiting, {self.__running} running)')
+            if self.__closed:
+                raise RuntimeError('DagServer is closed')
+            request = _Request(next(self.__ids), dag_input, Future())
+            self.__queue.append(request)
+            self.__counts["submitted"] += 1
+            self.__dispatch()
+            if self.queue_timeout is not None and self.__queue:
+                self.__loop.call_soon_threadsafe(self.__loop.call_later, self.queue_timeout, self.__expire)
+        return request.future
+
+    async def asubmit(self, dag_input: Any = None) -> Any:
+        """
+        Async version of `submit`, returns the output of the run. Waiting for room in the queue does not block
+        the running event loop.
+        """
+        if self.on_full == "block":
+            future = await asyncio.get_running_loop().run_in_executor(None, self.submit, dag_input)
+        else:
+            future = self.submit(dag_input)
+        return await asyncio.wrap_future(future)
+
+    def __full(self) -> bool:
+        return self.__running >= self.max_running and len(self.__queue) >= self.max_queue
+
+    def __shed(self) -> None:
+        """
+        Fail the requests waiting longer than `queue_timeout`, and the cancelled ones.
+        """
+        now = time.perf_counter()
+        kept = deque()
+        for request in self.__queue:
+            if request.future.cancelled():
+                continue
+            if self.queue_timeout is not None and now - request.submitted_at > self.queue_timeout:
+                self.__counts["shed"] += 1
+                request.future.set_exception(ServerOverloadedError(
+                    f'Request {request.request_id} waited more than {self.queue_timeout}s in the DagServer queue'))
+                continue
+            kept.append(request)
+        self.__queue = kept
+
+    def __expire(self) -> None:
+        with self.__condition:
+            self.__shed()
+            self.__condition.notify_all()
+
+    def __dispatch(self) -> None:
+        """
+        Start the waiting requests while fewer than `max_running` runs execute. Called with the lock held.
+        """
+        self.__shed()
+        while self.__queue and self.__running < self.max_running:
+            request = self.__queue.popleft()
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            request.started_at = time.perf_counter()
+            self.__queue_wait.append(request.started_at - request.submitted_at)
+            self.__running += 1
+            self.__loop.call_soon_threadsafe(self.__loop.create_task, self.__run(request))
+        self.__condition.notify_all()
+
+    async def __run(self, request: _Request) -> None:
+        _current_request.set(request.request_id)
+        try:
+            context = RunContext(self.dag, dag_input=request.dag_input, plan=self.dag.compile())
+            await arun_dag(self.dag, selector=self.selector, executor=self.executor, verbose=False,
+                           thread_pool=self.__pool, progressbar=False, context=context)
+        except BaseException as e:
+            self.__finish(request, "failed")
+            request.future.set_exception(e)
+        else:
+            self.__finish(request, "completed")
+            request.future.set_result(context.dag_state["output"])
+
+    def __finish(self, request: _Request, outcome: str) -> None:
+        with self.__condition:
+            self.__running -= 1
+            self.__counts[outcome] += 1
+            self.__latency.append(time.perf_counter() - request.submitted_at)
+            self.__dispatch()
+
+    def metrics(self) -> Dict:
+        """
+        Returns the live metrics of the server: requests waiting (`queue_depth`) and running, counts of requests
+        by outcome, functions waiting for a worker, throughput (completed requests per second), and percentiles
+        (seconds) of the latency (from `submit` to the output) and queue wait of the latest requests.
+        """
+        with self.__condition:
+            self.__shed()
+            uptime = time.perf_counter() - self.__started_at if self.__started_at is not None else 0.0
+            return {
+                "queue_depth": len(self.__queue),
+                "running": self.__running,
+                **self.__counts,
+                "worker_backlog": self.__pool.pending() if self.__pool is not None else 0,
+                "throughput": round(self.__counts["completed"] / uptime, 3) if uptime else 0.0,
+                "latency": _percentiles(self.__latency),
+                "queue_wait": _percentiles(self.__queue_wait),
+            }
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Stop accepting requests. With `wait`, the queued and running requests finish first,
+        otherwise the queued ones are cancelled.
+        """
+        with self.__condition:
+            self.__closed = True
+            if not wait:
+                for request in self.__queue:
+                    request.future.cancel()
+                self.__queue.clear()
+            self.__condition.notify_all()
+            self.__condition.wait_for(lambda: not self.__queue and not self.__running)
+            loop, self.__loop = self.__loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            self.__loop_thread.join()
+            loop.close()
+            self.__pool.shutdown()
+
+
+def _reply(line: str, server: DagServer, respond: Callable[[Dict], None]) -> Optional[Future]:
+    """
+    Handle one line of a front end: `metrics`, or a JSON `dag_input` whose output is given to `respond`.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if line == "metrics":
+        respond({"metrics": server.metrics()})
+        return None
+    try:
+        request = json.loads(line)
+        future = server.submit(request)
+    except Exception as e:
+        respond({"input": line, "error": repr(e)})
+        return None
+
+    def done(future: Future) -> None:
+        try:
+            respond({"input": request, "output": future.result()})
+        except Exception as e:
+            respond({"input": request, "error": repr(e)})
+    future.add_done_callback(done)
+    return future
+
+
+def serve_stdin(server: DagServer, input: TextIO = sys.stdin, output: TextIO = sys.stdout) -> None:
+    """
+    Serve the lines of `input` until it ends: every line is a JSON `dag_input`, answered with a JSON line
+    `{"input": ..., "output": ...}` (or `"error"`) on `output` when its run finishes. The line `metrics` is
+    answered with the metrics of the server.
+    """
+    lock = threading.Lock()
+
+    def respond(reply: Dict) -> None:
+        with lock:
+            output.write(json.dumps(reply, default=repr) + "\n")
+            output.flush()
+
+    futures = [_reply(line, server, respond) for line in input]
+    for future in futures:
+        if future is not None:
+            try:
+                future.result()
+            except Exception:
+                pass
+
+
+async def serve_socket(server: DagServer, path: Optional[str] = None, host: str = "127.0.0.1", port: int = 0) -> None:
+    """
+    Serve the lines of the clients of a local socket, as `serve_stdin` does, until cancelled:
+    a Unix socket at `path`, or a TCP socket on `host` and `port` (a free port when 0, logged).
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+
+        def respond(reply: Dict) -> None:
+            loop.call_soon_threadsafe(writer.write, (json.dumps(reply, default=repr) + "\n").encode())
+
+        futures = []
+        while line := await reader.readline():
+            future = _reply(line.decode(), server, respond)
+            if future is not None:
+                futures.append(asyncio.wrap_future(future))
+        await asyncio.gather(*futures, return_exceptions=True)
+        await asyncio.sleep(0)
+        await writer.drain()
+        writer.close()
+
+    if path is not None:
+        listener = await asyncio.start_unix_server(handle, path=path)
+    else:
+        listener = await asyncio.start_server(handle, host=host, port=port)
+    log.info("DagServer listening on %s", path or "%s:%s" % listener.sockets[0].getsockname()[:2])
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve a LangDAG over stdin or a local socket, "
+                                                 "one JSON dag_input per line.")
+    parser.add_argument("dag", help='the DAG to serve, as "module:attribute"')
+    parser.add_argument("--socket", help="path of a Unix socket to listen on")
+    parser.add_argument("--port", type=int, help="TCP port to listen on (127.0.0.1)")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--max-running", type=int)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--on-full", default="reject", choices=_ON_FULL)
+    parser.add_argument("--queue-timeout", type=float)
+    args = parser.parse_args(argv)
+
+    module, _, attribute = args.dag.partition(":")
+    dag = getattr(importlib.import_module(module), attribute or "dag")
+    with DagServer(dag, workers=args.workers, max_running=args.max_running, max_queue=args.max_queue,
+                   on_full=args.on_full, queue_timeout=args.queue_timeout) as server:
+        if args.socket is None and args.port is None:
+            serve_stdin(server)
+        else:
+            try:
+                asyncio.run(serve_socket(server, path=args.socket, port=args.port or 0))
+            except KeyboardInterrupt:
+                pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+from typing import Any, Dict, Optional
+import threading
+
+
+class Speculation():
+    """
+    Limits of speculative execution of conditional branches: nodes created with `speculative=True` start their
+    transform before their conditional upstream nodes (routers) finish, as soon as their other upstream nodes are
+    done. The result is used if the condition is met, and discarded (cancelled where possible) if not.
+
+    Example:
+        speculation = Speculation(max_concurrent=2, min_hit_rate=0.3)
+        run_dag(dag, processor=MultiThreadProcessor(), speculation=speculation)
+
+    Args:
+        max_concurrent (`int`, *optional*, defaults to 2):
+            Maximum number of speculative transforms running at the same time, in all runs using this `Speculation`.
+        max_per_run (`int`, *optional*, defaults to `None`):
+            Maximum number of speculative transforms started in a run, unlimited when `None`.
+        min_hit_rate (`float`, *optional*, defaults to 0):
+            Stop speculating a node when less than this fraction of its speculative results were used,
+            once it has `min_samples` of them, so only likely-taken branches are speculated.
+        min_samples (`int`, *optional*, defaults to 10):
+            Number of speculative results of a node before `min_hit_rate` applies.
+    """
+    def __init__(self,
+                 max_concurrent: Optional[int] = 2,
+                 max_per_run: Optional[int] = None,
+                 min_hit_rate: float = 0.0,
+                 min_samples: int = 10) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_per_run = max_per_run
+        self.min_hit_rate = min_hit_rate
+        self.min_samples = min_samples
+        self.running = 0
+        self.__outcomes: Dict[Any, Dict[str, int]] = {}
+        self.__lock = threading.Lock()
+
+    def hit_rate(self, node_id: Any) -> Optional[float]:
+        """
+        Returns the fraction of speculative results of `node_id` that were used, None if it was never speculated.
+        """
+        outcome = self.__outcomes.get(node_id)
+        if not outcome:
+            return None
+        return outcome["used"] / (outcome["used"] + outcome["discarded"])
+
+    def try_start(self, node_id: Any) -> bool:
+        """
+        Take a slot to speculate `node_id` if the limits allow it, returns whether it did.
+        """
+        with self.__lock:
+            if self.max_concurrent is not None and self.running >= self.max_concurrent:
+                return False
+            outcome = self.__outcomes.get(node_id)
+            if outcome and outcome["used"] + outcome["discarded"] >= self.min_samples:
+                if outcome["used"] / (outcome["used"] + outcome["discarded"]) < self.min_hit_rate:
+                    return False
+            self.running += 1
+            return True
+
+    def release(self) -> None:
+        """
+        Give back the slot of a speculative transform that ended (or was cancelled).
+        """
+        with self.__lock:
+            self.running -= 1
+
+    def record(self, node_id: Any, used: bool) -> None:
+        """
+        Record whether the speculative result of `node_id` was used.
+        """
+        with self.__lock:
+            outcome = self.__outcomes.setdefault(node_id, {"used": 0, "discarded": 0})
+            outcome["used" if used else "discarded"] += 1
+
+    def stats(self) -> Dict[Any, Dict[str, int]]:
+        """
+        Returns the number of used and discarded speculative results per node_id.
+        """
+        with self.__lock:
+            return {k: dict(v) for k, v in self.__outcomes.items()}
@@ -0,0 +1,418 @@
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections.abc import MutableMapping
+import logging
+import threading
+
+from langdag.error import StateAccessError, StateConflictError
+
+log = logging.getLogger("rich")
+
+_MISSING = object()
+
+_ON_CONFLICT = ("raise", "warn")
+
+
+class TrackedState(MutableMapping):
+    """
+    A view of `dag_state` given to the transform of a node, that records which keys the node reads
+    (and their values when read) and writes. Reads and writes go through to the underlying `dag_state`.
+    Iterating over it (`keys()`, `items()`, ...) counts as reading every key.
+
+    Args:
+        dag_state (`Dict`, *required*):
+            The `dag_state` of the run.
+        on_write (`Callable`, *optional*, defaults to `None`):
+            Called with the key, the previous value and the new value of every write (`_MISSING` when deleted or new).
+    """
+    def __init__(self, dag_state: Dict, on_write: Optional[Callable[[Any, Any, Any], None]] = None) -> None:
+        self.dag_state = dag_state
+        self.on_write = on_write
+        self.reads: Dict[Any, Any] = {}
+        self.writes: Dict[Any, Any] = {}
+        self.deletes = set()
+
+    def __read(self, key) -> None:
+        # values written by the node itself do not make it depend on them
+        if key not in self.reads and key not in self.writes and key not in self.deletes:
+            self.reads[key] = self.dag_state.get(key)
+
+    def __getitem__(self, key) -> Any:
+        self.__read(key)
+        return self.dag_state[key]
+
+    def get(self, key, default=None) -> Any:
+        self.__read(key)
+        return self.dag_state.get(key, default)
+
+    def __contains__(self, key) -> bool:
+        self.__read(key)
+        return key in self.dag_state
+
+    def __setitem__(self, key, value) -> None:
+        if self.on_write:
+            self.on_write(key, self.dag_state.get(key, _MISSING), value)
+        self.dag_state[key] = value
+        self.writes[key] = value
+        self.deletes.discard(key)
+
+    def __delitem__(self, key) -> None:
+        if self.on_write:
+            self.on_write(key, self.dag_state.get(key, _MISSING), _MISSING)
+        del self.dag_state[key]
+        self.writes.pop(key, None)
+        self.deletes.add(key)
+
+    def merge(self, other: "TrackedState") -> None:
+        """
+        Add the reads and writes recorded by `other` (another view of the same `dag_state`) to this one.
+        """
+        for key, value in other.reads.items():
+            if key not in self.reads and key not in self.writes and key not in self.deletes:
+                self.reads[key] = value
+        for key, value in other.writes.items():
+            self.writes[key] = value
+            self.deletes.discard(key)
+        for key in other.deletes:
+            self.writes.pop(key, None)
+            self.deletes.add(key)
+
+    def __iter__(self) -> Iterator:
+        for key in list(self.dag_state):
+            self.__read(key)
+        return iter(self.dag_state)
+
+    def __len__(self) -> int:
+        return len(self.dag_state)
+
+    def __repr__(self) -> str:
+        return f"TrackedState({self.dag_state!r})"
+
+
+class StateIsolation():
+    """
+    Isolation of the `dag_state` of a run between the nodes writing it (`run_dag(..., isolation=StateIsolation())`).
+
+    Without it, every `func_transform` reads and writes the same `dag_state` dict in place, so nodes running in 
+    parallel (e.g. with `MultiThreadProcessor`) see each other's writes half way, and a node that fails leaves its
+    writes behind. With it, the `dag_state` of the run is a `SharedState`: each node gets a `ScopedState`, a view of
+    the `dag_state` as it was when the node started, its writes are buffered in the view and applied all at once
+    when the node finishes (discarded if it fails or is aborted). A key written by a node that ran in parallel
+    and finished first is a conflict.
+
+    Example:
+        run_dag(dag, processor=MultiThreadProcessor(), isolation=StateIsolation(on_conflict="raise"))
+
+    Args:
+        on_conflict (`str`, *optional*, defaults to `"raise"`):
+            `"raise"`: the node writing a key already written by a node that ran in parallel raises a
+            `StateConflictError` and none of its writes are applied. `"warn"`: log a warning and apply the writes
+            (the last node finishing wins). Conflicts are recorded in `SharedState.conflicts` either way.
+    """
+    def __init__(self, on_conflict: str = "raise") -> None:
+        if on_conflict not in _ON_CONFLICT:
+            raise ValueError(f'on_conflict should be "raise" or "warn", got {on_conflict!r}')
+        self.on_conflict = on_conflict
+
+
+class SharedState(MutableMapping):
+    """
+    The `dag_state` of a run with a `StateIsolation`. Its dict is never changed in place: every write replaces it 
+    with an updated copy and increments `version`, so a view of it (`snapshot`) costs nothing and never changes.
+    Values are not copied, a node should replace the value of a key instead of changing it in place 
+    (`dag_state["docs"] = [*dag_state["docs"], doc]` rather than `dag_state["docs"].append(doc)`).
+
+    Writes through the mapping itself (e.g. the DAG output set by terminating nodes) are applied at once and never
+    conflict. Nodes write through their `ScopedState` (`view`), applied by `commit`.
+
+    Args:
+        dag_state (`Dict`, *optional*, defaults to `None`):
+            Initial content.
+        on_conflict (`str`, *optional*, defaults to `"raise"`):
+            What to do on conflicting writes, see `StateIsolation`.
+    """
+    def __init__(self, dag_state: Optional[Dict] = None, on_conflict: str = "raise") -> None:
+        self.__data: Dict[Any, Any] = dict(dag_state or {})
+        self.__lock = threading.Lock()
+        self.on_conflict = on_conflict
+        self.version = 0
+        # last version and node_id (None for direct writes) that wrote each key
+        self.written: Dict[Any, Tuple[int, Any]] = {}
+        # (key, node_id, node_id of the node that wrote the key first) of every conflict
+        self.conflicts: List[Tuple[Any, Any, Any]] = []
+
+    def snapshot(self) -> Tuple[Dict, int]:
+        """
+        Returns the current dict (not to be changed) and its version.
+        """
+        with self.__lock:
+            return self.__data, self.version
+
+    def view(self, node_id: Any, reads: Optional[Iterable] = None, writes: Optional[Iterable] = None) -> "ScopedState":
+        """
+        Returns a `ScopedState` of the node `node_id` on the current dict, see `ScopedState` for `reads` and `writes`.
+        """
+        return ScopedState(self, node_id, reads, writes)
+
+    def __apply(self, writes: Dict, deletes: Iterable, writer: Any) -> None:
+        # called with the lock held
+        data = dict(self.__data)
+        data.update(writes)
+        for key in deletes:
+            data.pop(key, None)
+        self.version += 1
+        for key in (*writes, *deletes):
+            self.written[key] = (self.version, writer)
+        self.__data = data
+
+    def commit(self, view: "ScopedState") -> None:
+        """
+        Apply the writes buffered in `view` at once. Raises `StateConflictError` (applying none of them) 
+        if a key was written by another node since the view was taken and `on_conflict` is `"raise"`.
+        """
+        keys = (*view.writes, *view.deletes)
+        if not keys:
+            return
+        with self.__lock:
+            conflicts = []
+            for key in keys:
+                version, writer = self.written.get(key, (0, None))
+                if version > view.version and writer is not None and writer != view.node_id:
+                    conflicts.append((key, view.node_id, writer))
+            self.conflicts.extend(conflicts)
+            if conflicts and self.on_conflict == "raise":
+                raise StateConflictError(
+                    "Node {0} wrote dag_state keys written by nodes running in parallel: {1}".format(
+                        view.node_id, ", ".join(f"{key!r} (by node {writer})" for key, _, writer in conflicts)))
+            self.__apply(view.writes, view.deletes, view.node_id)
+        for key, node_id, writer in conflicts:
+            log.warning("Node %s overwrote dag_state[%r] written by node %s running in parallel", node_id, key, writer)
+
+    def __getitem__(self, key) -> Any:
+        return self.__data[key]
+
+    def get(self, key, default=None) -> Any:
+        return self.__data.get(key, default)
+
+    def __contains__(self, key) -> bool:
+        return key in self.__data
+
+    def __setitem__(self, key, value) -> None:
+        with self.__lock:
+            self.__apply({key: value}, (), None)
+
+    def __delitem__(self, key) -> None:
+        with self.__lock:
+            if key not in self.__data:
+                raise KeyError(key)
+            self.__apply({}, (key,), None)
+
+    def update(self, other=(), /, **kwargs) -> None:
+        writes = dict(other, **kwargs)
+        with self.__lock:
+            self.__apply(writes, (), None)
+
+    def __iter__(self) -> Iterator:
+        return iter(self.__data)
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def __repr__(self) -> str:
+        return f"SharedState({self.__data!r})"
+
+
+class ScopedState(MutableMapping):
+    """
+    The view of a `SharedState` given to the transform of a node: the `dag_state` as it was when the node started,
+    with the writes of the node. They are buffered in the view until `commit`.
+
+    Args:
+        shared (`SharedState`, *required*):
+            The `dag_state` of the run.
+        node_id (`Any`, *required*):
+            The node writing through the view.
+        reads (`Iterable`, *optional*, defaults to `None`):
+            The only keys the node can read (besides `"input"` and the keys in `writes`), 
+            any other key raises a `StateAccessError`. All keys when `None`.
+        writes (`Iterable`, *optional*, defaults to `None`):
+            The only keys the node can write or delete, any other key raises a `StateAccessError`. All keys when `None`.
+    """
+    def __init__(self, shared: SharedState, node_id: Any, 
+                 reads: Optional[Iterable] = None, writes: Optional[Iterable] = None) -> None:
+        self.shared = shared
+        self.node_id = node_id
+        self.data, self.version = shared.snapshot()
+        self.writable: Optional[frozenset] = frozenset(writes) if writes is not None else None
+        self.readable: Optional[frozenset] = None
+        if reads is not None:
+            self.readable = frozenset(reads) | {"input"} | (self.writable or frozenset())
+        self.writes: Dict[Any, Any] = {}
+        self.deletes = set()
+
+    def __check_read(self, key) -> None:
+        if self.readable is not None and key not in self.readable:
+            raise StateAccessError(f"Node {self.node_id} reads dag_state[{key!r}], not declared in its reads")
+
+    def check_write(self, key) -> None:
+        '''Raises a `StateAccessError` if the node can not write `key`'''
+        if self.writable is not None and key not in self.writable:
+            raise StateAccessError(f"Node {self.node_id} writes dag_state[{key!r}], not declared in its writes")
+
+    def __getitem__(self, key) -> Any:
+        self.__check_read(key)
+        if key in self.writes:
+            return self.writes[key]
+        if key in self.deletes:
+            raise KeyError(key)
+        return self.data[key]
+
+    def get(self, key, default=None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key) -> bool:
+        self.__check_read(key)
+        return key in self.writes or (key not in self.deletes and key in self.data)
+
+    def __setitem__(self, key, value) -> None:
+        self.check_write(key)
+        self.writes[key] = value
+        self.deletes.discard(key)
+
+    def __delitem__(self, key) -> None:
+        self.check_write(key)
+        if key not in self:
+            raise KeyError(key)
+        self.writes.pop(key, None)
+        self.deletes.add(key)
+
+    def absorb(self, other: "ScopedState") -> None:
+        """
+        Add the writes buffered in `other` (an earlier view of the same node, e.g. of a speculative transform) 
+        to this one, as if they were made through it.
+        """
+        for key in other.deletes:
+            self.writes.pop(key, None)
+            self.deletes.add(key)
+        for key, value in other.writes.items():
+            self.writes[key] = value
+            self.deletes.discard(key)
+        self.version = min(self.version, other.version)
+
+    def commit(self) -> None:
+        """
+        Apply the buffered writes to the `SharedState` (see `SharedState.commit`), the view then shows the current dict.
+        """
+        self.shared.commit(self)
+        self.discard()
+
+    def discard(self) -> None:
+        """
+        Drop the buffered writes, the view then shows the current dict.
+        """
+        self.writes = {}
+        self.deletes = set()
+        self.data, self.version = self.shared.snapshot()
+
+    def __iter__(self) -> Iterator:
+        keys = [k for k in self.data if k not in self.deletes and k not in self.writes]
+        keys.extend(self.writes)
+        if self.readable is not None:
+            keys = [k for k in keys if k in self.readable]
+        return iter(keys)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"ScopedState({self.node_id!r}, {dict(self)!r})"
+
+
+class AttemptState(MutableMapping):
+    """
+    The view of `dag_state` given to one attempt of a node with a `RetryPolicy`: reads go through to `dag_state`,
+    writes are buffered until `apply`. Only the writes of the attempt whose output the node keeps are applied, 
+    those of failed attempts and of attempts abandoned on timeout or after losing a hedge (which may keep running 
+    in the background) are dropped.
+
+    Args:
+        dag_state (`Dict`, *required*):
+            The `dag_state` of the node (a `TrackedState` or `ScopedState` in incremental or isolated runs).
+    """
+    def __init__(self, dag_state: Dict) -> None:
+        self.dag_state = dag_state
+        self.writes: Dict[Any, Any] = {}
+        self.deletes = set()
+        self.__lock = threading.Lock()
+
+    def __check_write(self, key) -> None:
+        # declared writes are checked in the attempt, not when the writes are applied
+        base = self.dag_state
+        while isinstance(base, TrackedState):
+            base = base.dag_state
+        if isinstance(base, ScopedState):
+            base.check_write(key)
+
+    def __getitem__(self, key) -> Any:
+        with self.__lock:
+            if key in self.writes:
+                return self.writes[key]
+            if key in self.deletes:
+                raise KeyError(key)
+        return self.dag_state[key]
+
+    def get(self, key, default=None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key) -> bool:
+        with self.__lock:
+            if key in self.writes:
+                return True
+            if key in self.deletes:
+                return False
+        return key in self.dag_state
+
+    def __setitem__(self, key, value) -> None:
+        self.__check_write(key)
+        with self.__lock:
+            self.writes[key] = value
+            self.deletes.discard(key)
+
+    def __delitem__(self, key) -> None:
+        self.__check_write(key)
+        if key not in self:
+            raise KeyError(key)
+        with self.__lock:
+            self.writes.pop(key, None)
+            self.deletes.add(key)
+
+    def apply(self) -> None:
+        """
+        Write the buffered writes and deletes to `dag_state`.
+        """
+        with self.__lock:
+            deletes, writes = self.deletes, self.writes
+            self.deletes, self.writes = set(), {}
+        for key in deletes:
+            if key in self.dag_state:
+                del self.dag_state[key]
+        for key, value in writes.items():
+            self.dag_state[key] = value
+
+    def __iter__(self) -> Iterator:
+        with self.__lock:
+            deletes, writes = set(self.deletes), dict(self.writes)
+        keys = [k for k in self.dag_state if k not in deletes and k not in writes]
+        keys.extend(writes)
+        return iter(keys)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"AttemptState({dict(self)!r})"
@@ -0,0 +1,76 @@
+from typing import Any, Dict, Optional
+import json
+import os
+import tempfile
+import threading
+
+
+class DurationStats():
+    """
+    A small persisted store of node durations learned from previous runs, used by `CriticalPathSelector`
+    to estimate how long each node takes. Durations are kept as an exponential moving average per node_id.
+
+    Example:
+        stats = DurationStats("durations.json")
+        run_dag(dag, selector=CriticalPathSelector(dag, 4, stats=stats), processor=MultiThreadProcessor())
+        stats.record(dag.get_timings())
+        stats.save()
+
+    Args:
+        path (`str`, *optional*, defaults to `None`):
+            A JSON file to load durations from and save them to. Kept in memory only when `None`.
+        alpha (`float`, *optional*, defaults to 0.3):
+            Weight of the newest duration in the moving average.
+    """
+    def __init__(self, path: Optional[str] = None, alpha: float = 0.3) -> None:
+        self.path = path
+        self.alpha = alpha
+        # Incremented on every change, so users of the estimates know when to refresh them
+        self.version = 0
+        self.__durations: Dict[str, Dict[str, float]] = {}
+        self.__lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.__durations = json.load(f)
+
+    def estimate(self, node_id: Any) -> Optional[float]:
+        """
+        Returns the estimated duration of `node_id` in seconds, or None if it never ran.
+        """
+        item = self.__durations.get(str(node_id))
+        return item["mean"] if item else None
+
+    def update(self, node_id: Any, duration: float) -> None:
+        """
+        Add one duration (in seconds) of `node_id` to the moving average.
+        """
+        with self.__lock:
+            item = self.__durations.get(str(node_id))
+            if item is None:
+                self.__durations[str(node_id)] = {"mean": duration, "count": 1}
+            else:
+                item["mean"] += self.alpha * (duration - item["mean"])
+                item["count"] += 1
+            self.version += 1
+
+    def record(self, timings: Dict[Any, Dict]) -> None:
+        """
+        Add the durations of a run, as returned by `dag.get_timings()`. Nodes that did not execute are skipped.
+        """
+        for node_id, timing in timings.items():
+            if timing.get("duration") is not None:
+                self.update(node_id, timing["duration"])
+
+    def save(self) -> None:
+        """
+        Write the durations to `path` (atomically).
+        """
+        if not self.path:
+            return
+        with self.__lock:
+            data = json.dumps(self.__durations)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".langdag-stats-")
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,166 @@
+from typing import Any, Callable, List, Optional
+from concurrent.futures import Future
+import asyncio
+import inspect
+import threading
+
+
+def is_streaming_transform(func_transform: Optional[Callable]) -> bool:
+    """
+    Returns whether `func_transform` is a generator or an async generator function, i.e. the node streams its output.
+    """
+    return inspect.isgeneratorfunction(func_transform) or inspect.isasyncgenfunction(func_transform)
+
+
+def aggregate_chunks(chunks: List) -> Any:
+    """
+    Default aggregation of the chunks of a streaming node into its `node_output`:
+    chunks are joined when they are all `str` (or all `bytes`), otherwise the list of chunks is returned.
+    """
+    if chunks and all(isinstance(x, str) for x in chunks):
+        return "".join(chunks)
+    if chunks and all(isinstance(x, bytes) for x in chunks):
+        return b"".join(chunks)
+    return chunks
+
+
+class NodeStream():
+    """
+    Chunks of a streaming node output as they are produced during a run.
+
+    Iterate it in a plain function (`for chunk in stream`) or in an `async def` function (`async for chunk in stream`),
+    iteration ends when the node finishes, and raises the error of the node if it fails.
+    Every iteration starts from the first chunk, so a stream can be consumed by many downstream nodes.
+    """
+    def __init__(self, node_id: Any) -> None:
+        self.node_id = node_id
+        # Completed with `True` on the first chunk, or with `False` if the stream closes without any chunk
+        self.started: Future = Future()
+        self.__chunks: List = []
+        self.__closed = False
+        self.__error: Optional[BaseException] = None
+        self.__cond = threading.Condition()
+        self.__waiters: List = []
+        self.__targets: List["NodeStream"] = []
+
+    @property
+    def closed(self) -> bool:
+        return self.__closed
+
+    @property
+    def chunks(self) -> List:
+        """Chunks produced so far."""
+        return list(self.__chunks)
+
+    def put(self, chunk: Any) -> None:
+        """
+        Append a chunk and wake up consumers.
+        """
+        with self.__cond:
+            if self.__closed:
+                raise RuntimeError(f"Stream of node {self.node_id} is closed")
+            self.__chunks.append(chunk)
+            self.__wake_up()
+            targets = list(self.__targets)
+        for target in targets:
+            target.put(chunk)
+        if not self.started.done():
+            self.started.set_result(True)
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        """
+        Mark the stream as complete (or failed with `error`). Closing a closed stream does nothing.
+        """
+        with self.__cond:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__error = error
+            self.__wake_up()
+        if not self.started.done():
+            self.started.set_result(False)
+
+    def pipe(self, target: "NodeStream") -> None:
+        """
+        Forward the chunks produced so far and every following chunk to `target`.
+        """
+        with self.__cond:
+            chunks = list(self.__chunks)
+            self.__targets.append(target)
+        for chunk in chunks:
+            target.put(chunk)
+
+    def __wake_up(self) -> None:
+        '''Notify consumers (called with the lock held)'''
+        self.__cond.notify_all()
+        for loop, waiter in self.__waiters:
+            loop.call_soon_threadsafe(_set_waiter, waiter)
+        self.__waiters.clear()
+
+    def __next_chunk(self, i: int):
+        '''Returns (has chunk, chunk, finished) for the i-th chunk (called with the lock held)'''
+        if i < len(self.__chunks):
+            return True, self.__chunks[i], False
+        if self.__closed:
+            if self.__error is not None:
+                raise self.__error
+            return False, None, True
+        return False, None, False
+
+    def __iter__(self):
+        i = 0
+        while True:
+            with self.__cond:
+                has_chunk, chunk, finished = self.__next_chunk(i)
+                while not has_chunk and not finished:
+                    self.__cond.wait()
+                    has_chunk, chunk, finished = self.__next_chunk(i)
+            if finished:
+                return
+            i += 1
+            yield chunk
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        i = 0
+        while True:
+            with self.__cond:
+                has_chunk, chunk, finished = self.__next_chunk(i)
+                if not has_chunk and not finished:
+                    waiter = loop.create_future()
+                    self.__waiters.append((loop, waiter))
+            if finished:
+                return
+            if has_chunk:
+                i += 1
+                yield chunk
+            else:
+                await waiter
+
+    def __repr__(self) -> str:
+        return f"NodeStream({self.node_id!r}, chunks={len(self.__chunks)}, closed={self.__closed})"
+
+
+
+class AttemptStream():
+    """
+    The `NodeStream` of a node as seen by one attempt of its `RetryPolicy`: chunks of the attempt are dropped 
+    once it is abandoned (timed out), it may keep running in the background.
+    """
+    def __init__(self, stream: NodeStream, attempt) -> None:
+        self.stream = stream
+        self.attempt = attempt
+
+    def put(self, chunk: Any) -> None:
+        with self.attempt.lock:
+            if not self.attempt.abandoned:
+                self.stream.put(chunk)
+
+    @property
+    def chunks(self) -> List:
+        return self.stream.chunks
+
+
+def _set_waiter(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
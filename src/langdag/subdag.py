@@ -0,0 +1,269 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import Executor
+import copy
+import threading
+
+from langdag import LangDAG, Node
+from langdag.error import LangdagSyntaxError
+from langdag.plan import resolve_conditions
+from langdag.utils import call_async, call_sync
+
+# DAGs whose plan is being compiled in this thread, a sub-DAG containing its parent would never end
+_compiling = threading.local()
+
+
+class SubDag(Node):
+    """
+    A node running a whole `LangDAG` (the sub-DAG), to reuse a workflow in bigger ones without copying its nodes.
+    Sub-DAGs can be nested.
+
+    The sub-DAG is not run by a nested `run_dag`: its nodes are expanded into the plan of the DAG (`dag.compile()`)
+    with the node_id `"<node_id of the SubDag>/<node_id in the sub-DAG>"`, and scheduled with the other nodes by the
+    processor and selector of the run. They are logged, hooked, timed and inspected (`inspect_execution`) like the
+    others. The `SubDag` node itself finishes when the sub-DAG did, with the output of the sub-DAG.
+
+    The nodes of the sub-DAG see the same `upstream_output` (by their own node_id) as when the sub-DAG runs alone,
+    and a `dag_state` of their own: the `dag_state` of the sub-DAG, with `"input"` the input given to it.
+    The `dag_state` of the run is not visible to them.
+
+    Example:
+        with LangDAG() as rag:
+            ...
+        with LangDAG(user_query) as dag:
+            answer = SubDag("answer", rag, input_map=lambda prompt, upstream_output, dag_state: dag_state["input"])
+            dag += rewrite
+            dag += answer
+            rewrite >> answer
+
+    Args:
+        node_id (`Any`, *required*`):
+            A unique identifier for the node.
+        dag (`LangDAG`, *required*`):
+            The sub-DAG.
+        input_map (`Callable`, *optional*, defaults to `None`):
+            A function of `prompt`, `upstream_output` and `dag_state` (of the `SubDag` node) returning the input
+            of the sub-DAG. By default, the output of the upstream node if there is one, the dict of the upstream
+            outputs if there are more, and `dag_state["input"]` if there are none.
+        output_map (`Callable`, *optional*, defaults to `None`):
+            A function of `prompt`, the outputs of the terminating nodes of the sub-DAG (by their node_id in the
+            sub-DAG) and the `dag_state` of the sub-DAG returning the node output. By default, the output of
+            the sub-DAG (`dag_state["output"]` of the sub-DAG).
+        node_desc (`Any`, *optional*, defaults to `None`):
+            A description of the node, same as in `Node`.
+        prompt (`Any`, *optional*, defaults to `None`):
+            A predefined prompt for the node, given to `input_map` and `output_map`.
+        spec (`Dict | Any`, *optional*, defaults to `None`):
+            Specification of the node as a tool, same as in `Node`.
+        func_desc (`Callable`, *optional*, defaults to `None`):
+            A function that generates a dynamic description, same as in `Node`.
+        func_set_dag_output_when (`Callable`, *optional*, defaults to `None`):
+            Whether the node output should be set as the output of the DAG, same as in `Node`.
+
+    `input_map` and `output_map` can be plain functions or `async def` functions.
+    """
+    def __init__(
+            self,
+            node_id: str,
+            dag: LangDAG,
+            input_map: Optional[Callable[[Any, Dict, Dict], Any]] = None,
+            output_map: Optional[Callable[[Any, Dict, Dict], Any]] = None,
+            node_desc: Optional[str | Dict | Any] = None,
+            prompt: Optional[str | Dict | Any] = None,
+            spec: Optional[Dict | Any] = None,
+            func_desc: Optional[str | Dict | Any] = None,
+            func_set_dag_output_when: Optional[Callable[[str, Dict, Dict, Dict], bool]] = None
+        ) -> None:
+        if not isinstance(dag, LangDAG):
+            raise LangdagSyntaxError('The sub-DAG of a `SubDag` should be a `LangDAG`')
+        if not len(dag.vertices()):
+            raise LangdagSyntaxError(f'The sub-DAG of {node_id} has no nodes')
+        self.dag = dag
+        self.input_map = input_map
+        self.output_map = output_map
+        super().__init__(node_id,
+                         node_desc=node_desc,
+                         prompt=prompt,
+                         spec=spec,
+                         func_desc=func_desc,
+                         func_set_dag_output_when=func_set_dag_output_when)
+
+    # In the plan, the `SubDag` node is downstream of the terminating nodes of the sub-DAG, and of its input node
+    # (so it is aborted only when the input node is): it executes as soon as any of them finished. Whether the
+    # input node needs all or any of the upstream nodes of the `SubDag` node is kept here.
+    @property
+    def allow_execution_only_when_all_upstream_nodes_acceptable(self) -> bool:
+        return False
+
+    @allow_execution_only_when_all_upstream_nodes_acceptable.setter
+    def allow_execution_only_when_all_upstream_nodes_acceptable(self, value: bool) -> None:
+        self.input_needs_all_upstream = value
+
+    def __sub_state(self, context) -> Dict:
+        if context is None:
+            raise LangdagSyntaxError(f'SubDag {self.node_id} can only run in a run (`run_dag`, `arun_dag`, ...)')
+        plan = context.plan
+        return context.subdag_state(plan.sub_input[plan.index[self]])
+
+    def transform(self, context=None, retry_policy=None, verbose: bool = False) -> Any:
+        """
+        Set the node output to the output of the sub-DAG, whose nodes finished.
+        """
+        sub_state = self.__sub_state(context)
+        state = context.state_of(self)
+        if self.output_map is None:
+            state.node_output = sub_state.get("output")
+        else:
+            state.node_output = call_sync(self.output_map, self.prompt, state.upstream_output, sub_state)
+        return state.node_output
+
+    async def atransform(self, context=None, thread_pool: Optional[Executor] = None, retry_policy=None,
+                         verbose: bool = False) -> Any:
+        """
+        Async version of `transform`.
+        """
+        sub_state = self.__sub_state(context)
+        state = context.state_of(self)
+        if self.output_map is None:
+            state.node_output = sub_state.get("output")
+        else:
+            state.node_output = await call_async(self.output_map, self.prompt, state.upstream_output, sub_state,
+                                                 thread_pool=thread_pool)
+        return state.node_output
+
+
+class SubDagInput(Node):
+    """
+    The node of the plan starting a `SubDag`: it runs with the upstream nodes (and conditions) of the `SubDag` node,
+    its output is the input of the sub-DAG. Created by `dag.compile()`.
+
+    Args:
+        subdag (`SubDag`, *required*`):
+            The `SubDag` node.
+    """
+    def __init__(self, subdag: SubDag) -> None:
+        super().__init__(f"{subdag.node_id}/<input>")
+        self.subdag = subdag
+        self.allow_execution_only_when_all_upstream_nodes_acceptable = getattr(subdag, "input_needs_all_upstream", True)
+
+    def __default_input(self, upstream_output: Dict, dag_state: Dict) -> Any:
+        if not upstream_output:
+            return dag_state.get("input")
+        if len(upstream_output) == 1:
+            return next(iter(upstream_output.values()))
+        return dict(upstream_output)
+
+    def transform(self, context=None, retry_policy=None, verbose: bool = False) -> Any:
+        """
+        Set the node output to the input of the sub-DAG, and give the sub-DAG its `dag_state`.
+        """
+        state, dag_state = context.state_of(self), context.dag_state_of(self)
+        if self.subdag.input_map is None:
+            state.node_output = self.__default_input(state.upstream_output, dag_state)
+        else:
+            state.node_output = call_sync(self.subdag.input_map, self.subdag.prompt, state.upstream_output, dag_state)
+        context.subdag_state(context.plan.index[self])
+        return state.node_output
+
+    async def atransform(self, context=None, thread_pool: Optional[Executor] = None, retry_policy=None,
+                         verbose: bool = False) -> Any:
+        """
+        Async version of `transform`.
+        """
+        state, dag_state = context.state_of(self), context.dag_state_of(self)
+        if self.subdag.input_map is None:
+            state.node_output = self.__default_input(state.upstream_output, dag_state)
+        else:
+            state.node_output = await call_async(self.subdag.input_map, self.subdag.prompt, state.upstream_output,
+                                                 dag_state, thread_pool=thread_pool)
+        context.subdag_state(context.plan.index[self])
+        return state.node_output
+
+    def initial_state(self, dag_input: Any) -> Dict:
+        """
+        Returns the initial `dag_state` of the sub-DAG in a run with the input `dag_input`.
+        """
+        dag_state = {**self.subdag.dag.dag_state, "output": None, "input": dag_input}
+        dag_state.pop("output_by_node_id", None)
+        return dag_state
+
+
+class Expansion():
+    """
+    The graph of a DAG with its `SubDag` nodes expanded, and what `ExecutionPlan` needs to know about the nodes
+    of the sub-DAGs (see the attributes of `ExecutionPlan` of the same names). Created by `expand_subdags`.
+    """
+    def __init__(self, graph: Dict, graph_reverse: Dict) -> None:
+        self.graph: Dict[Any, List] = {node: list(successors) for node, successors in graph.items()}
+        self.graph_reverse: Dict[Any, List] = {node: list(predecessors) for node, predecessors in graph_reverse.items()}
+        self.execution_condition: Dict[Any, Dict] = {}
+        self.sets_output: Dict[Any, bool] = {}
+        self.upstream_alias: Dict[Any, Dict] = {}
+        self.scope: Dict[Any, Any] = {}
+        self.sub_input: Dict[Any, Any] = {}
+        self.subplans: List[Tuple[SubDag, Any]] = []
+
+
+def _copy_node(node, node_id) -> Node:
+    """
+    Returns a copy of `node` (sharing its functions and attributes) with the node_id `node_id`.
+    """
+    proxy = copy.copy(node)
+    proxy.node_id = node_id
+    return proxy
+
+
+def expand_subdags(dag: LangDAG, graph: Dict, graph_reverse: Dict) -> Expansion:
+    """
+    Returns the graph of `dag` (given as the successors and predecessors of each node) with each `SubDag` node
+    replaced by its input node, the nodes of its sub-DAG, and the `SubDag` node itself:
+    upstream nodes -> input node -> starting nodes ... terminating nodes -> `SubDag` node -> downstream nodes.
+    The nodes of the sub-DAG are copies with the node_id `"<SubDag node_id>/<node_id>"`.
+    """
+    compiling = getattr(_compiling, "dags", None)
+    if compiling is None:
+        compiling = _compiling.dags = set()
+    if id(dag) in compiling:
+        raise LangdagSyntaxError('A sub-DAG contains the DAG it is a node of')
+    compiling.add(id(dag))
+    try:
+        expansion = Expansion(graph, graph_reverse)
+        for subdag in [node for node in graph if isinstance(node, SubDag)]:
+            _expand(expansion, subdag, list(expansion.graph_reverse[subdag]))
+        return expansion
+    finally:
+        compiling.discard(id(dag))
+
+
+def _expand(expansion: Expansion, subdag: SubDag, upstream_nodes) -> None:
+    plan = subdag.dag.compile()
+    expansion.subplans.append((subdag, plan))
+    prefix = subdag.node_id
+    def qualify(node_id):
+        return f"{prefix}/{node_id}"
+
+    entry = SubDagInput(subdag)
+    nodes = [_copy_node(node, qualify(node.node_id)) for node in plan.nodes]
+    graph, graph_reverse = expansion.graph, expansion.graph_reverse
+    for node in upstream_nodes:
+        graph[node] = [entry if x is subdag else x for x in graph[node]]
+    graph[entry] = [nodes[i] for i in plan.starts] + [subdag]
+    graph_reverse[entry] = list(upstream_nodes)
+    graph_reverse[subdag] = [entry] + [nodes[i] for i in plan.terminals]
+    for i, node in enumerate(nodes):
+        graph[node] = [nodes[j] for j in plan.successors[i]] + ([subdag] if plan.is_terminal[i] else [])
+        graph_reverse[node] = [nodes[j] for j in plan.predecessors[i]] or [entry]
+
+    expansion.execution_condition[entry] = resolve_conditions(subdag, upstream_nodes)
+    expansion.execution_condition[subdag] = {}
+    expansion.upstream_alias[subdag] = {nodes[i].node_id: plan.nodes[i].node_id for i in plan.terminals}
+    expansion.sub_input[subdag] = entry
+    for i, node in enumerate(nodes):
+        expansion.execution_condition[node] = {qualify(k): v for k, v in plan.execution_condition[i].items()}
+        alias = plan.upstream_alias[i]
+        if alias is None:
+            alias = {plan.nodes[j].node_id: plan.nodes[j].node_id for j in plan.predecessors[i]}
+        expansion.upstream_alias[node] = {qualify(k): v for k, v in alias.items()}
+        expansion.sets_output[node] = plan.sets_output[i]
+        expansion.scope[node] = nodes[plan.scope[i]] if plan.scope[i] is not None else entry
+        if plan.sub_input[i] is not None:
+            expansion.sub_input[node] = nodes[plan.sub_input[i]]
@@ -1,9 +1,11 @@
 from typing import List, Set, Dict, Tuple, Optional, Any, Callable
 
+import asyncio
+import contextvars
+import functools
+import inspect
 import logging
-from rich.tree import Tree
-from rich.padding import Padding
-from rich import print
+from concurrent.futures import Executor, ThreadPoolExecutor
 
 class Subset(list):
     """
@@ -177,53 +179,59 @@ def merge_dicts(*dicts: Dict[Any, Any]):
 
 
 
-def walk_dag(dag, child_nodes, parent_tree, parent_node=None):
+async def _await(awaitable):
+    return await awaitable
+
+
+def call_sync(func: Callable, *args) -> Any:
     """
-    Autoregressive tree generation for observability tree (dag.inspect_execution)
+    Call `func` with `args` and return its result. 
+    If `func` is an `async def` function (or returns an awaitable), the awaitable is run to completion 
+    on a fresh event loop, in a helper thread (with the current context variables) if an event loop is already 
+    running in this thread.
     """
-    child_nodes = sorted(child_nodes, key=lambda x: x.node_id)
-    for node in child_nodes:
-        sus_nodes = dag.successors(node)
-        
-        if node.execution_state == "finished":
-            node_es = "[green](√)[/green]" 
-        elif node.execution_state == "aborted":
-            node_es = "[red](X)[/red]" 
-        else:
-            node_es = "(-)" 
+    result = func(*args)
+    if not inspect.isawaitable(result):
+        return result
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_await(result))
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(contextvars.copy_context().run, asyncio.run, _await(result)).result()
+
 
-        condition = ""
-        output_str = f"\n[red]OUTPUT:[/red] [italic]{node.node_output}[/]" 
+async def call_async(func: Callable, *args, thread_pool: Optional[Executor] = None, offload: bool = True) -> Any:
+    """
+    Call `func` with `args` from a coroutine and return its result. 
+    An `async def` function is awaited on the running event loop. A plain function is run in `thread_pool` 
+    (the event loop's default executor when `None`) if `offload` is True, otherwise it is called directly.
+    """
+    if inspect.iscoroutinefunction(func):
+        return await func(*args)
+    if offload:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(thread_pool, functools.partial(func, *args))
+    else:
+        result = func(*args)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
 
-        if parent_node:
-            if node.node_id in parent_node.downstream_execution_condition.keys():
-                if parent_node.node_output == parent_node.downstream_execution_condition[node.node_id][parent_node.node_id]:
-                    condition = f"\n[red]CONDITION MET:[/] {parent_node.downstream_execution_condition[node.node_id]}" 
-                else:
-                    condition = f"\n[red]CONDITION NOT MET:[/] {parent_node.downstream_execution_condition[node.node_id]}" 
 
-        style = "dim" if node.execution_state == "aborted" or "not matched" in condition else ""
-        branch = parent_tree.add(
-                    " ".join([x for x in [f"[bold blue]{str(node.node_id)}[/]", 
-                                          f"[blue](DESC: {str(node.node_desc)})[/blue]", 
-                                          node_es, 
-                                          condition,  
-                                          output_str] if x!=""  ]) ,
-                    style=style,
-                    guide_style=style,
-                )
-        walk_dag(dag, sus_nodes, branch, node)
+def walk_dag(dag, child_nodes, parent_tree, parent_node=None, context=None, critical=None, max_output_chars=200):
+    """
+    Tree generation for observability tree (dag.inspect_execution): add `child_nodes` and the nodes below them
+    to `parent_tree`, each node once (see `langdag.visualize.add_branches`).
+    `critical` is the set of node_ids on the critical path, they are highlighted.
+    """
+    from langdag.visualize import add_branches
+    return add_branches(parent_tree, dag, child_nodes, context, parent_node, max_output_chars, critical=critical)
 
 
-def show_tree(dag):
+def show_tree(dag, context=None, max_output_chars=200, max_depth=None):
     """
     Print to console a rich.tree to show DAG execution (dag.inspect_execution)
     """
-    root_tree = Tree(
-            f"[bold red]DAG INPUT: [italic] {str(dag.dag_state["input"])} [/] [/]",
-            guide_style="bold bright_blue",
-        )
-
-    walk_dag(dag, dag.all_starts(), root_tree)
-    print(Padding(root_tree, (1,1,2,2)))
-    return root_tree
+    from langdag.visualize import show_tree as _show_tree
+    return _show_tree(dag, context, max_output_chars, max_depth)
@@ -0,0 +1,300 @@
+from typing import Any, Dict, List, Optional, Tuple
+import json
+from rich import print
+from rich.markup import escape
+from rich.padding import Padding
+from rich.tree import Tree
+from langdag.events import Payload
+
+_STATE_MARKS = {
+    "finished": "[green](√)[/green]",
+    "aborted": "[red](X)[/red]",
+    "failed": "[bold red](!)[/bold red]",
+}
+
+_DOT_COLORS = {
+    "finished": "darkgreen",
+    "aborted": "gray60",
+    "failed": "red",
+}
+
+
+def _truncate(obj: Any, limit: Optional[int]) -> str:
+    return str(Payload(obj, limit))
+
+
+def _edge_condition(plan, i: int, j: int) -> Tuple[bool, Any]:
+    """
+    Returns whether the edge from node `i` to node `j` of `plan` is conditional, and its condition.
+    """
+    conditions = plan.execution_condition[j]
+    node_id = plan.nodes[i].node_id
+    if node_id in conditions:
+        return True, conditions[node_id]
+    return False, None
+
+
+def _condition_met(plan, states, i: int, j: int) -> Optional[bool]:
+    """
+    Returns whether the condition on the edge from node `i` to node `j` is met by the output of node `i`,
+    as recorded when it was evaluated in the run. None if the edge is not conditional, node `i` did not finish,
+    or the condition was not evaluated and the output of node `i` was released since (unknown).
+    """
+    conditional, condition = _edge_condition(plan, i, j)
+    if not conditional or states[i].execution_state != "finished":
+        return None
+    node_id = plan.nodes[i].node_id
+    met = getattr(states[j], "conditions_met", None) or {}
+    if node_id in met:
+        return met[node_id]
+    if getattr(states[i], "output_released", False):
+        return None
+    return bool(plan.conditions[j].predicates[node_id](states[i].node_output, None))
+
+
+def _run_states(dag, context=None) -> Tuple[Any, List, Dict]:
+    '''Returns the plan, the run state of each node (by integer id) and the dag_state, of `context` if given'''
+    plan = context.plan if context is not None else dag.compile()
+    states = [context.state_of(node) if context is not None else node for node in plan.nodes]
+    dag_state = context.dag_state if context is not None else dag.dag_state
+    return plan, states, dag_state
+
+
+def _sorted(plan, ids) -> List[int]:
+    try:
+        return sorted(ids, key=lambda i: plan.nodes[i].node_id)
+    except TypeError:
+        return sorted(ids, key=lambda i: str(plan.nodes[i].node_id))
+
+
+def add_branches(tree: Tree,
+                 dag,
+                 starts,
+                 context=None,
+                 parent=None,
+                 max_output_chars: Optional[int] = 200,
+                 max_depth: Optional[int] = None,
+                 critical: Optional[set] = None) -> Tree:
+    """
+    Add the execution of the nodes `starts` and of the nodes below them to `tree`. Every node is shown once,
+    under the first of its upstream nodes in depth-first order; under its other upstream nodes it is a one-line
+    reference (`↪ node_id`), so there is one branch per edge and the tree is built in O(V+E).
+    See `build_tree` for the arguments, `parent` is the upstream node of `starts` (for the conditions of its edges).
+    """
+    plan, states, _ = _run_states(dag, context)
+    if critical is None:
+        critical = set(dag.get_critical_path(context))
+
+    def label(i: int, parent: Optional[int]) -> Tuple[str, str]:
+        node, state = plan.nodes[i], states[i]
+        condition = ""
+        if parent is not None:
+            conditional, value = _edge_condition(plan, parent, i)
+            if conditional:
+                met = _condition_met(plan, states, parent, i)
+                # None: the output was released before the condition was evaluated
+                verdict = "UNKNOWN" if met is None else "MET" if met else "NOT MET"
+                condition = (f"\n[red]CONDITION {verdict}:[/] "
+                             f"{escape('{' + repr(plan.nodes[parent].node_id) + ': ' + _truncate(value, max_output_chars) + '}')}")
+        parts = [f"[bold blue]{escape(str(node.node_id))}[/]",
+                 f"[blue](DESC: {escape(_truncate(state.node_desc, max_output_chars))})[/blue]",
+                 _STATE_MARKS.get(state.execution_state, "(-)"),
+                 condition,
+                 f"\n[red]OUTPUT:[/red] [italic]{escape(_truncate(state.node_output, max_output_chars))}[/]"]
+        if getattr(state, "error", None) is not None:
+            parts.append(f"\n[red]ERROR:[/] {escape(_truncate(repr(state.error), max_output_chars))}")
+        timing = getattr(state, "timing", None)
+        if timing is not None and timing.duration is not None:
+            time_str = f"\n[red]TIME:[/] {timing.duration:.3f}s (queue wait {timing.queue_wait:.3f}s)"
+            if node.node_id in critical:
+                time_str += " [bold magenta]<< CRITICAL PATH[/]"
+            parts.append(time_str)
+        style = "dim" if state.execution_state == "aborted" else ""
+        return " ".join(x for x in parts if x != ""), style
+
+    parent_id = plan.index[parent] if parent is not None else None
+    shown = set()
+    # depth-first, children in the order of their node_id
+    stack: List[Tuple[int, Optional[int], Tree, int]] = [
+        (i, parent_id, tree, 1) for i in reversed(_sorted(plan, [plan.index[x] for x in starts]))]
+    while stack:
+        i, parent_i, parent_tree, depth = stack.pop()
+        if i in shown:
+            met = _condition_met(plan, states, parent_i, i) if parent_i is not None else None
+            note = "" if met is None else (" [red](condition met)[/]" if met else " [red](condition not met)[/]")
+            parent_tree.add(f"[blue]↪ {escape(str(plan.nodes[i].node_id))}[/] "
+                            f"{_STATE_MARKS.get(states[i].execution_state, '(-)')} [dim](shown above)[/]{note}",
+                            style="dim")
+            continue
+        shown.add(i)
+        text, style = label(i, parent_i)
+        branch = parent_tree.add(text, style=style, guide_style=style)
+        # a `SubDag` node is shown below the nodes of its sub-DAG, not below its input node
+        successors = [j for j in plan.successors[i] if plan.sub_input[j] != i]
+        if not successors:
+            continue
+        if max_depth is not None and depth >= max_depth:
+            branch.add(f"[dim]... {len(successors)} downstream nodes (max_depth={max_depth})[/]")
+            continue
+        for j in reversed(_sorted(plan, successors)):
+            stack.append((j, i, branch, depth + 1))
+    return tree
+
+
+def build_tree(dag, context=None, max_output_chars: Optional[int] = 200, max_depth: Optional[int] = None) -> Tree:
+    """
+    Returns a rich.tree of the execution of `dag` (of the run `context` if given, otherwise of the last run
+    committed to the nodes), see `add_branches`.
+
+    Args:
+        dag (`LangDAG`, *required*):
+            The DAG.
+        context (`RunContext`, *optional*, defaults to `None`):
+            The run to show.
+        max_output_chars (`int`, *optional*, defaults to 200):
+            Truncate outputs, descriptions and errors to this many characters, no truncation when `None`.
+        max_depth (`int`, *optional*, defaults to `None`):
+            Show nodes down to this depth from the starting nodes, the nodes below are summarized in one line.
+    """
+    plan, _, dag_state = _run_states(dag, context)
+    root = Tree(f"[bold red]DAG INPUT: [italic] {escape(_truncate(dag_state['input'], max_output_chars))} [/] [/]",
+                guide_style="bold bright_blue")
+    return add_branches(root, dag, [plan.nodes[i] for i in plan.starts], context,
+                        max_output_chars=max_output_chars, max_depth=max_depth)
+
+
+def show_tree(dag, context=None, max_output_chars: Optional[int] = 200, max_depth: Optional[int] = None) -> Tree:
+    """
+    Print to console the rich.tree of `build_tree` (dag.inspect_execution) and return it.
+    """
+    tree = build_tree(dag, context, max_output_chars, max_depth)
+    print(Padding(tree, (1, 1, 2, 2)))
+    return tree
+
+
+def _jsonable(obj: Any, limit: Optional[int]) -> Any:
+    '''`obj` if it can be written as JSON (truncated strings), otherwise its truncated representation'''
+    if obj is None or isinstance(obj, (bool, int, float)):
+        return obj
+    if isinstance(obj, str):
+        return _truncate(obj, limit)
+    try:
+        text = json.dumps(obj)
+    except (TypeError, ValueError):
+        return _truncate(obj, limit)
+    if limit is not None and len(text) > limit:
+        return _truncate(obj, limit)
+    return obj
+
+
+def to_dict(dag, context=None, max_output_chars: Optional[int] = None) -> Dict:
+    """
+    Returns the execution of `dag` (of the run `context` if given, otherwise of the last run committed to the
+    nodes) as a dict that can be written as JSON: `input`, `output`, `critical_path`, `nodes` (id, description,
+    execution_state, output, error, cache_hit, timing, on_critical_path) and `edges` (from, to, condition,
+    condition_met). Outputs that can not be written as JSON (or longer than `max_output_chars`) are replaced
+    by their truncated representation.
+    """
+    plan, states, dag_state = _run_states(dag, context)
+    critical = dag.get_critical_path(context)
+    critical_ids = set(critical)
+    nodes = []
+    for node, state in zip(plan.nodes, states):
+        timing = getattr(state, "timing", None)
+        error = getattr(state, "error", None)
+        nodes.append({
+            "id": _jsonable(node.node_id, None),
+            "desc": _jsonable(state.node_desc, max_output_chars),
+            "execution_state": state.execution_state,
+            "output": _jsonable(state.node_output, max_output_chars),
+            "error": repr(error) if error is not None else None,
+            "cache_hit": getattr(state, "cache_hit", None),
+            "timing": timing.as_dict() if timing is not None else None,
+            "on_critical_path": node.node_id in critical_ids,
+        })
+    edges = []
+    for i, successors in enumerate(plan.successors):
+        for j in successors:
+            conditional, condition = _edge_condition(plan, i, j)
+            edges.append({
+                "from": _jsonable(plan.nodes[i].node_id, None),
+                "to": _jsonable(plan.nodes[j].node_id, None),
+                "condition": _jsonable(condition, max_output_chars) if conditional else None,
+                "conditional": conditional,
+                "condition_met": _condition_met(plan, states, i, j),
+            })
+    return {
+        "input": _jsonable(dag_state.get("input"), max_output_chars),
+        "output": _jsonable(dag_state.get("output"), max_output_chars),
+        "critical_path": [_jsonable(x, None) for x in critical],
+        "nodes": nodes,
+        "edges": edges,
+    }
+
+
+def to_json(dag, context=None, path: Optional[str] = None, max_output_chars: Optional[int] = None,
+            indent: Optional[int] = 2) -> str:
+    """
+    Returns the execution of `dag` as JSON (see `to_dict`), also written to `path` if given.
+    """
+    text = json.dumps(to_dict(dag, context, max_output_chars), indent=indent, ensure_ascii=False)
+    if path is not None:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    return text
+
+
+def _dot_quote(text: str) -> str:
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+def to_dot(dag, context=None, path: Optional[str] = None, max_output_chars: Optional[int] = 60) -> str:
+    """
+    Returns the execution of `dag` as a Graphviz DOT graph, also written to `path` if given (render it with
+    e.g. `dot -Tsvg`). Nodes show their id, execution_state, duration and truncated output, colored by state,
+    with the critical path in bold; conditional edges are labeled with their condition, dashed when not met.
+    """
+    plan, states, _ = _run_states(dag, context)
+    critical_path = dag.get_critical_path(context)
+    critical = set(critical_path)
+    critical_edges = set(zip(critical_path, critical_path[1:]))
+    lines = ["digraph langdag {", "  rankdir=TB;", '  node [shape=box, style="rounded", fontname="Helvetica"];',
+             '  edge [fontname="Helvetica", fontsize=10];']
+    for i, (node, state) in enumerate(zip(plan.nodes, states)):
+        label = f"{node.node_id}\n{state.execution_state}"
+        timing = getattr(state, "timing", None)
+        if timing is not None and timing.duration is not None:
+            label += f" {timing.duration:.3f}s"
+        if state.node_output is not None:
+            label += "\n" + _truncate(state.node_output, max_output_chars)
+        error = getattr(state, "error", None)
+        if error is not None:
+            label += "\n" + _truncate(repr(error), max_output_chars)
+        attrs = [f"label={_dot_quote(label)}", f"color={_DOT_COLORS.get(state.execution_state, 'black')}"]
+        if node.node_id in critical:
+            attrs.append("penwidth=2.5")
+        if state.execution_state == "aborted":
+            attrs.append('style="rounded,dashed"')
+            attrs.append("fontcolor=gray50")
+        lines.append(f"  n{i} [{', '.join(attrs)}];")
+    for i, successors in enumerate(plan.successors):
+        for j in successors:
+            attrs = []
+            conditional, condition = _edge_condition(plan, i, j)
+            if conditional:
+                attrs.append(f"label={_dot_quote(_truncate(condition, max_output_chars))}")
+                if _condition_met(plan, states, i, j) is False:
+                    attrs.append("style=dashed")
+                    attrs.append("color=gray60")
+            if plan.sub_input[j] == i:
+                # from the input node of a sub-DAG to its `SubDag` node
+                attrs.append("style=dotted")
+            if (plan.nodes[i].node_id, plan.nodes[j].node_id) in critical_edges:
+                attrs.append("penwidth=2.5")
+            lines.append(f"  n{i} -> n{j}" + (f" [{', '.join(attrs)}]" if attrs else "") + ";")
+    lines.append("}")
+    text = "\n".join(lines) + "\n"
+    if path is not None:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    return text
@@ -0,0 +1,47 @@
+import gc
+import threading
+import time
+
+from langdag.checkpoint import FileCheckpointStore, NodeCheckpoint
+
+
+def writer_threads():
+    return [thread for thread in threading.enumerate() if thread.name == "langdag-checkpoint"]
+
+
+def test_save_keeps_dag_state_at_save_time(tmp_path):
+    store = FileCheckpointStore(str(tmp_path), flush_interval=0.05)
+    dag_state = {"items": [1]}
+    store.save("run", NodeCheckpoint("a", "finished", 1), dag_state)
+    dag_state["items"] = [1, 2]
+    time.sleep(0.2)
+
+    _, saved_state = store.load("run")
+    store.close()
+    assert saved_state == {"items": [1]}
+
+
+def test_writer_does_not_keep_dropped_store(tmp_path):
+    before = len(writer_threads())
+    store = FileCheckpointStore(str(tmp_path), flush_interval=0.05)
+    store.save("run", NodeCheckpoint("a", "finished", 1), {})
+    del store
+    gc.collect()
+    time.sleep(0.2)
+
+    assert len(writer_threads()) == before
+    checkpoints, _ = FileCheckpointStore(str(tmp_path)).load("run")
+    assert checkpoints["a"].node_output == 1
+
+
+def test_file_store_keeps_one_state_per_run(tmp_path):
+    store = FileCheckpointStore(str(tmp_path))
+    for i in range(5):
+        store.save("run", NodeCheckpoint(i, "finished", i), {"step": i, "payload": b"x" * 100_000})
+        store.flush()
+    store.close()
+
+    checkpoints, dag_state = FileCheckpointStore(str(tmp_path)).load("run")
+    assert sorted(checkpoints) == [0, 1, 2, 3, 4]
+    assert dag_state["step"] == 4
+    assert sum(path.stat().st_size for path in tmp_path.iterdir()) < 200_000
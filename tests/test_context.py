@@ -0,0 +1,19 @@
+from langdag import LangDAG, Node, run_dag
+from langdag.context import RunContext
+from langdag.executor import LangExecutor
+
+
+def test_runs_do_not_share_dag_state_template():
+    with LangDAG("x") as dag:
+        node = Node("a", func_transform=lambda prompt, upstream_output, dag_state: dag_state["log"].append(dag_state["input"]))
+        dag += node
+    dag.dag_state["log"] = []
+
+    logs = []
+    for i in range(3):
+        context = RunContext(dag, dag_input=i)
+        run_dag(dag, executor=LangExecutor(verbose=False), progressbar=False, context=context)
+        logs.append(context.dag_state["log"])
+
+    assert logs == [[0], [1], [2]]
+    assert dag.dag_state["log"] == []
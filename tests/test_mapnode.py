@@ -0,0 +1,25 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langdag import LangDAG, arun_dag
+from langdag.executor import LangExecutor
+from langdag.mapnode import MapNode
+
+
+def test_elements_run_in_thread_pool_of_run():
+    threads = set()
+
+    def double(prompt, item, upstream_output, dag_state):
+        threads.add(threading.current_thread().name)
+        return item * 2
+
+    with LangDAG([1, 2, 3]) as dag:
+        node = MapNode("double", func_map=double)
+        dag += node
+
+    with ThreadPoolExecutor(thread_name_prefix="run") as thread_pool:
+        asyncio.run(arun_dag(dag, executor=LangExecutor(verbose=False), progressbar=False, thread_pool=thread_pool))
+
+    assert node.node_output == [2, 4, 6]
+    assert threads and all(name.startswith("run_") for name in threads)
@@ -0,0 +1,37 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from langdag import LangDAG, Node, arun_dag
+from langdag.executor import LangExecutor
+from langdag.processor import MultiProcessProcessor
+from langdag.retry import RetryPolicy
+
+
+def slow_large_output(prompt, upstream_output, dag_state):
+    time.sleep(0.5)
+    return b"x" * (2 << 20)
+
+
+def shared_memory_blocks():
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="no /dev/shm")
+def test_shared_memory_released_after_timeout():
+    before = shared_memory_blocks()
+    processor = MultiProcessProcessor(max_processes=1)
+    with LangDAG("x") as dag:
+        node = Node("a", func_transform=slow_large_output, run_in_process=True, 
+                    retry_policy=RetryPolicy(timeout=0.1))
+        dag += node
+
+    try:
+        asyncio.run(arun_dag(dag, processor=processor, executor=LangExecutor(verbose=False), progressbar=False))
+        assert node.execution_state == "failed"
+        time.sleep(1)
+        assert shared_memory_blocks() - before == set()
+    finally:
+        processor.shutdown()
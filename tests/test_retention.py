@@ -0,0 +1,52 @@
+import json
+
+from rich.console import Console
+
+from langdag import LangDAG, Node, run_dag
+from langdag.executor import LangExecutor
+from langdag.retention import OutputRetention
+from langdag.visualize import build_tree
+
+
+def test_condition_met_after_output_released(tmp_path):
+    with LangDAG("x") as dag:
+        a = Node("a", func_transform=lambda prompt, upstream_output, dag_state: "yes")
+        b = Node("b", func_transform=lambda prompt, upstream_output, dag_state: "b")
+        c = Node("c", func_transform=lambda prompt, upstream_output, dag_state: "c")
+        dag += a
+        dag += b
+        dag += c
+        a >> "yes" >> b
+        a >> "no" >> c
+
+    run_dag(dag, executor=LangExecutor(verbose=False), progressbar=False, 
+            retention=OutputRetention(keep="terminal"))
+
+    assert a.node_output is None
+    assert b.execution_state == "finished"
+    assert c.execution_state == "aborted"
+    path = tmp_path / "run.json"
+    dag.to_json(path=str(path))
+    edges = {(edge["from"], edge["to"]): edge["condition_met"] for edge in json.loads(path.read_text())["edges"]}
+    assert edges[("a", "b")] is True
+    assert edges[("a", "c")] is False
+
+
+def test_tree_shows_unknown_condition_after_output_released():
+    with LangDAG("x") as dag:
+        a = Node("a", func_transform=lambda prompt, upstream_output, dag_state: "yes")
+        b = Node("b", func_transform=lambda prompt, upstream_output, dag_state: "b")
+        dag += a
+        dag += b
+        a >> "yes" >> b
+
+    run_dag(dag, executor=LangExecutor(verbose=False), progressbar=False, 
+            retention=OutputRetention(keep="terminal"))
+    # as if the condition was never evaluated before the output of a was released
+    b.conditions_met = {}
+
+    console = Console(record=True, width=200)
+    console.print(build_tree(dag))
+    text = console.export_text()
+    assert "CONDITION UNKNOWN" in text
+    assert "NOT MET" not in text